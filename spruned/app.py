@@ -72,6 +72,33 @@ if sys.version > '3.5.2':  # pragma: no cover
         action='store', dest='cache_size', default=int(ctx.cache_size),
         help='Cache size (in megabytes)'
     )
+    parser.add_argument(
+        '--cache-compression',
+        action='store', dest='cache_compression', default=ctx.cache_compression or 'none',
+        choices=['none', 'zlib', 'lzma'],
+        help='Codec used to recompress the cached blocks older than --keep-blocks'
+    )
+    parser.add_argument(
+        '--cache-policy',
+        action='store', dest='cache_policy', default=ctx.cache_policy,
+        choices=['lru', 'lfu', 'arc'],
+        help='Eviction policy of the cached blocks'
+    )
+    parser.add_argument(
+        '--hot-cache-size',
+        action='store', dest='hot_cache_size', default=int(ctx.hot_cache_size),
+        help='In memory cache size for parsed and verbose blocks (in megabytes)'
+    )
+    parser.add_argument(
+        '--tx-cache-size',
+        action='store', dest='tx_cache_size', default=int(ctx.tx_cache_size),
+        help='Cache size for verified confirmed transactions (in megabytes)'
+    )
+    parser.add_argument(
+        '--prefetch-blocks',
+        action='store', dest='prefetch_blocks', default=int(ctx.prefetch_blocks),
+        help='Blocks downloaded ahead of sequential getblock requests (0 to disable)'
+    )
     parser.add_argument(
         '--proxy',
         action='store', dest='proxy',
@@ -142,6 +169,11 @@ if sys.version > '3.5.2':  # pragma: no cover
         action='store', dest='mempool_size', default=int(ctx.mempool_size),
         help='Set the mempool size in megabytes (0 = mempool disabled, default) - VERY experimental'
     )
+    parser.add_argument(
+        '--fast-sync',
+        action='store_true', dest='fast_sync', default=ctx.fast_sync,
+        help='Anchor the headers sync to the newest checkpoint, older headers are downloaded in background'
+    )
     parser.add_argument(
         '--version',
         action='store_true', dest='version', default=False,
@@ -167,6 +199,7 @@ if sys.version > '3.5.2':  # pragma: no cover
             from spruned.builder import repository
 
             migrations.run(sqlite)
+            repository.headers.load_index()
 
             version = repository.blockchain.get_db_version()
             if version != repository.blockchain.current_version:
@@ -65,6 +65,22 @@ class HeadersRepository(metaclass=abc.ABCMeta):
     def save_headers(self, headers: List[Dict]):
         pass  # pragma: no cover
 
+    @abc.abstractmethod
+    def ingest_headers(self, headers: List[Dict], check_pow=True):
+        pass  # pragma: no cover
+
+    @abc.abstractmethod
+    def backfill_headers(self, headers: List[Dict]):
+        pass  # pragma: no cover
+
+    @abc.abstractmethod
+    def get_lowest_header(self):
+        pass  # pragma: no cover
+
+    @abc.abstractmethod
+    def get_chain_stats(self, blockheight: int):
+        pass  # pragma: no cover
+
     @abc.abstractmethod
     def get_headers_since_height(self, height: int):
         pass  # pragma: no cover
@@ -1,25 +1,50 @@
 import asyncio
+import binascii
 import pickle
+import struct
 import time
+from typing import Dict, List
 
+from spruned import settings
+from spruned.application.cache_policies import POLICIES
 from spruned.application.database import ldb_batch
 from spruned.application.logging_factory import Logger
 from spruned.application.tools import async_delayed_task
+from spruned.repositories.block_files import CODECS, RAW, compress
 from spruned.repositories.blockchain_repository import BLOCK_INDEX_PREFIX
 
+INDEX_ENTRY = struct.Struct('<IIIdI')
+PINNED_RANGE = struct.Struct('<II')
+ESTIMATED_BLOCK_SIZE = 1024000
+
 
 class CacheAgent:
-    def __init__(self, repository, limit, loop=asyncio.get_event_loop(), delayer=async_delayed_task):
+    """
+    tracks the cached blocks, evicts them over the size limit and recompresses the old ones.
+    the index is kept in memory and persisted as one small leveldb entry per tracked key.
+    """
+    def __init__(
+            self, repository, limit, loop=asyncio.get_event_loop(), delayer=async_delayed_task, compression=None,
+            policy='lru', p2p=None
+    ):
         self.session = repository.blockchain.session
         self.repository = repository
         self.repository.blockchain.set_cache(self)
         self.cache_name = b'cache_index'
+        self.cache_prefix = settings.LEVELDB_CACHE_SLUG + b'.'
+        self.pins_name = b'cache_pins'
+        self.pins = []
+        self.p2p = p2p
+        self._pins_task = None
         self.index = None
         self.limit = limit * 1024000
-        self._last_dump_size = None
         self.loop = loop
         self.lock = asyncio.Lock()
         self.delayer = delayer
+        self.codec = compression and CODECS[compression] or None
+        self.policy = POLICIES[policy]()
+        self.untracked_hits = 0
+        self._dirty = set()
 
     def init(self):
         self._load_index()
@@ -27,7 +52,30 @@ class CacheAgent:
     def dump(self):
         self._save_index()
 
+    @staticmethod
+    def _pack_entry(item: Dict) -> bytes:
+        return INDEX_ENTRY.pack(
+            item['saved_at'], item['size'], item.get('raw_size', 0), item.get('accessed_at', 0), item.get('hits', 0)
+        )
+
+    @staticmethod
+    def _unpack_entry(key: bytes, data: bytes) -> Dict:
+        saved_at, size, raw_size, accessed_at, hits = INDEX_ENTRY.unpack(data)
+        item = {
+            'saved_at': saved_at,
+            'size': size,
+            'key': key
+        }
+        if raw_size:
+            item['raw_size'] = raw_size
+        if accessed_at:
+            item.update({'accessed_at': accessed_at, 'hits': hits})
+        return item
+
     def _deserialize_index(self, rawdata):
+        """
+        the legacy index, a single pickled list
+        """
         index = {'keys': {}}
         data = pickle.loads(rawdata)
         s = 0
@@ -38,80 +86,130 @@ class CacheAgent:
                 'size': d[2],
                 'key': d[0]
             }
+            if len(d) > 3 and d[3] is not None:
+                index['keys'][d[0]]['raw_size'] = d[3]
+            if len(d) > 4:
+                index['keys'][d[0]].update({'accessed_at': d[4], 'hits': d[5]})
         index['total'] = s
         self.index = index
         return index
 
-    def _serialize_index(self):
-        data = []
-        sorted_data = sorted(self.index['keys'].values(), key=lambda x: x['saved_at'])
-        for x in sorted_data:
-            data.append([x['key'], x['saved_at'], x['size']])
-        return pickle.dumps(data)
+    @ldb_batch
+    def _migrate_legacy_index(self, rawdata):
+        self._deserialize_index(rawdata)
+        for item in self.index['keys'].values():
+            self._save_entry(item)
+        self.session.delete(self.cache_name)
+        Logger.cache.info('Migrated legacy cache index, %s entries', len(self.index['keys']))
+
+    def _save_entry(self, item: Dict):
+        self.session.put(self.cache_prefix + item['key'], self._pack_entry(item))
+
+    def _delete_entry(self, key: bytes):
+        self._dirty.discard(key)
+        self.session.delete(self.cache_prefix + key)
 
     @ldb_batch
     def _save_index(self):
-        data = self._serialize_index()
-        self.session.put(self.cache_name, data)
-        Logger.cache.debug('Saved index')
-        self._last_dump_size = self.index['total']
+        """
+        entries are written when tracked, only the ones updated by reads are pending here
+        """
+        if not self._dirty:
+            return
+        for key in self._dirty:
+            item = self.index['keys'].get(key)
+            item and self._save_entry(item)
+        Logger.cache.debug('Saved %s index entries', len(self._dirty))
+        self._dirty = set()
 
     def _load_index(self):
-        index = self.session.get(self.cache_name)
-        if not index:
-            Logger.cache.debug('Cache not found. Ok if is the first time')
+        legacy = self.session.get(self.cache_name)
+        self._load_pins()
+        if legacy:
+            self._migrate_legacy_index(legacy)
             return
-        Logger.cache.debug('Loaded index')
-        index and self._deserialize_index(index)
-        self._last_dump_size = self.index and self.index['total']
+        index = {'keys': {}, 'total': 0}
+        for key, data in self.session.iterator(prefix=self.cache_prefix):
+            item = self._unpack_entry(key[len(self.cache_prefix):], data)
+            index['keys'][item['key']] = item
+            index['total'] += item['size']
+        if not index['keys']:
+            Logger.cache.debug('Cache not found. Ok if is the first time')
+        else:
+            Logger.cache.debug('Loaded index, %s entries', len(index['keys']))
+        self.index = index
 
     def track(self, key, size):
         if not self.index:
             self.index = {'keys': {}, 'total': 0}
+        prev = self.index['keys'].get(key)
+        self.index['total'] += size - (prev and prev['size'] or 0)
         self.index['keys'][key] = {
             'saved_at': int(time.time()),
             'size': size,
             'key': key
         }
+        self._dirty.discard(key)
+        self._save_entry(self.index['keys'][key])
+
+    def charge(self, key, size):
+        """
+        data stored along with a tracked block, i.e. its decoded transactions, is accounted to its entry
+        and is evicted with it
+        """
+        item = self.index and self.index['keys'].get(key)
+        if not item:
+            return
+        item['size'] += size
+        if 'raw_size' in item:
+            item['raw_size'] += size
         self.index['total'] += size
-        self._save_index()
+        self._dirty.discard(key)
+        self._save_entry(item)
+
+    def record_hit(self, key):
+        """
+        a read served by the repository, the index entry is updated in memory and saved on the next check.
+        reads of the blocks not tracked by the index, i.e. the keep_blocks ones, are counted apart.
+        """
+        item = self.index and self.index['keys'].get(key)
+        if not item:
+            self.untracked_hits += 1
+            return
+        self.policy.on_hit(key, item)
+        self._dirty.add(key)
+
+    def record_miss(self, key=None):
+        self.policy.on_miss(key)
 
     async def check(self):
-        if self.index and self.index.get('keys') and not self._last_dump_size:
-            Logger.cache.info('Pending data, dumping')
-            self._save_index()
         if not self.index:
             Logger.cache.info('No prev index found, trying to load')
             self._load_index()
-        if not self.index:
-            self.index = {'keys': {}, 'total': 0}
-            Logger.cache.info('No prev index found nor loaded')
-            self._save_index()
+        if not self.index['keys']:
+            Logger.cache.info('Cache index is empty')
             return
-        else:
-            self._purge_stales()
+        self._purge_stales()
         if self.index['total'] > self.limit:
-            Logger.cache.info('Purging cache, size: %s, limit: %s', self.index['total'], self.limit)
-            index_sorted = sorted(
-                self.index['keys'].values(), key=lambda x: x['saved_at']
+            Logger.cache.info(
+                'Purging cache, size: %s, limit: %s, policy: %s', self.index['total'], self.limit, self.policy.name
+            )
+            victims = self.policy.get_victims(
+                [x for x in self.index['keys'].values() if not self.is_pinned(x['key'])], self.limit
             )
-            i = 0
             while self.index['total'] * 1.1 > self.limit:
-                try:
-                    if len(index_sorted) >= i:
-                        item = index_sorted[i]
-                        Logger.cache.debug('Deleting %s' % item)
-                        self.delete(item)
-                        i += 1
-                    else:
-                        break
-                except IndexError:
+                item = next(victims, None)
+                if item is None:
+                    self.pins and Logger.cache.warning('Cache is over limit, the remaining blocks are pinned')
                     break
+                Logger.cache.debug('Deleting %s' % item)
+                self.delete(item)
+                self.policy.on_evict(item)
         else:
             Logger.cache.info('Cache is ok, size: %s, limit: %s', self.index['total'], self.limit)
-        if self.index['total'] != self._last_dump_size:
-            self._save_index()
+        self._save_index()
 
+    @ldb_batch
     def delete(self, item):
         if item['key'][0] == int.from_bytes(BLOCK_INDEX_PREFIX, 'little'):
             Logger.leveldb.debug('Deleting block %s', item)
@@ -119,11 +217,66 @@ class CacheAgent:
         else:
             raise ValueError('Problem: %s' % item)
         self.index['total'] -= self.index['keys'].pop(item['key'])['size']
+        self._delete_entry(item['key'])
+
+    async def compress(self):
+        """
+        the blocks out of the keep_blocks window are recompressed, one at a time, in the executor.
+        the index then accounts the compressed size, raw_size is kept for the compression ratio.
+        the raw copies left behind in the block files are reclaimed by the repository compaction.
+        """
+        if not self.codec or not self.index:
+            return
+        keypref = BLOCK_INDEX_PREFIX + b'.'
+        hot = {keypref + bytes.fromhex(blockhash) for blockhash in self.repository.get_extemped_blockhash()}
+        done = 0
+        for item in list(self.index['keys'].values()):
+            if item['key'] in hot or 'raw_size' in item:
+                continue
+            blockhash = item['key'][2:]
+            if self.repository.blockchain.get_block_codec(blockhash) != RAW:
+                continue
+            data = self.repository.blockchain.get_block_bytes(blockhash, record_access=False)
+            if data is None:
+                continue
+            charged = max(0, item['size'] - len(data))
+            raw_size = len(data) + charged
+            compressed = await self.loop.run_in_executor(None, compress, self.codec, bytes(data))
+            if len(compressed) < len(data):
+                size = self.repository.blockchain.save_compressed_block(blockhash, self.codec, compressed)
+                if size is None or item['key'] not in self.index['keys']:
+                    continue
+                size += charged
+            else:
+                size = item['size']
+            self.index['total'] += size - item['size']
+            item.update({'size': size, 'raw_size': raw_size})
+            self._save_entry(item)
+            done += 1
+        if done:
+            Logger.cache.info('Compressed %s blocks, compression ratio: %s', done, self.get_info()['compression_ratio'])
+
+    def get_info(self) -> dict:
+        index = self.index or {'keys': {}, 'total': 0}
+        raw_size = sum(x.get('raw_size', x['size']) for x in index['keys'].values())
+        info = {
+            'entries': len(index['keys']),
+            'size': index['total'],
+            'raw_size': raw_size,
+            'limit': self.limit,
+            'compression_ratio': round(raw_size / index['total'], 4) if index['total'] else 1.0
+        }
+        info.update(self.policy.get_info())
+        info['untracked_hits'] = self.untracked_hits
+        return info
 
     async def lurk(self):
         try:
             await self.lock.acquire()
             await self.check()
+            await self.compress()
+            self.repository.blockchain.compact_block_files()
+            self._schedule_pinned_download()
         finally:
             self.lock.release()
             self.loop.create_task(self.delayer(self.lurk(), 600))
@@ -140,4 +293,115 @@ class CacheAgent:
                 stales.append(key)
         for stale in stales:
             self.index['total'] -= self.index['keys'].pop(stale)['size']
+            self._delete_entry(stale)
         Logger.cache.debug('Stales purge done, removed %s items from index', len(stales))
+
+    def _load_pins(self):
+        data = self.session.get(self.pins_name) or b''
+        self.pins = [
+            list(PINNED_RANGE.unpack(data[i:i + PINNED_RANGE.size])) for i in range(0, len(data), PINNED_RANGE.size)
+        ]
+
+    def _save_pins(self):
+        self.session.put(self.pins_name, b''.join(PINNED_RANGE.pack(*pin) for pin in self.pins))
+
+    def pin(self, start: int, end: int) -> List[Dict]:
+        """
+        blocks in the heights range are exempted from eviction, and downloaded if missing
+        """
+        self.pins = self._merge_pins(self.pins + [[start, end]])
+        self._save_pins()
+        self._schedule_pinned_download()
+        return self.get_pins()
+
+    @staticmethod
+    def _merge_pins(pins: List[List[int]]) -> List[List[int]]:
+        pins = sorted([list(pin) for pin in pins])
+        merged = pins[:1]
+        for pin in pins[1:]:
+            if pin[0] <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], pin[1])
+            else:
+                merged.append(pin)
+        return merged
+
+    def can_pin(self, start: int, end: int) -> bool:
+        """
+        whether the pinned blocks, the range included, fit the cache limit.
+        stored blocks count their cached size, missing ones the average of the cached blocks.
+        """
+        keys = self.index and self.index['keys'] or {}
+        average = keys and self.index['total'] // len(keys) or ESTIMATED_BLOCK_SIZE
+        size = 0
+        for pin_start, pin_end in self._merge_pins(self.pins + [[start, end]]):
+            for height in range(pin_start, pin_end + 1):
+                item = keys.get(self._get_pinned_key(height))
+                size += item and item['size'] or average
+                if size > self.limit:
+                    return False
+        return True
+
+    def unpin(self, start: int, end: int) -> List[Dict]:
+        pins = []
+        for pin_start, pin_end in self.pins:
+            if pin_start < start:
+                pins.append([pin_start, min(pin_end, start - 1)])
+            if pin_end > end:
+                pins.append([max(pin_start, end + 1), pin_end])
+        self.pins = pins
+        self._save_pins()
+        return self.get_pins()
+
+    def is_pinned(self, key: bytes) -> bool:
+        if not self.pins or not key.startswith(BLOCK_INDEX_PREFIX + b'.'):
+            return False
+        height = self.repository.headers.get_block_height(binascii.hexlify(key[2:]).decode())
+        return height is not None and any(start <= height <= end for start, end in self.pins)
+
+    def _get_pinned_key(self, height: int) -> (None, bytes):
+        blockhash = self.repository.headers.get_block_hash(height)
+        return blockhash and BLOCK_INDEX_PREFIX + b'.' + binascii.unhexlify(blockhash)
+
+    def get_pins(self) -> List[Dict]:
+        """
+        pinned ranges, with the bytes they cost and the blocks still missing
+        """
+        res = []
+        keys = self.index and self.index['keys'] or {}
+        for start, end in self.pins:
+            items = [keys.get(self._get_pinned_key(height)) for height in range(start, end + 1)]
+            res.append({
+                'start_height': start,
+                'end_height': end,
+                'size': sum(item['size'] for item in items if item),
+                'missing': len([item for item in items if not item])
+            })
+        return res
+
+    def _schedule_pinned_download(self):
+        if self.p2p and self.pins and (not self._pins_task or self._pins_task.done()):
+            self._pins_task = self.loop.create_task(self.fetch_pinned())
+
+    async def fetch_pinned(self, batch_size=8):
+        """
+        downloads the blocks missing from the pinned ranges, a batch at a time
+        """
+        for pin in list(self.pins):
+            for height in range(pin[0], pin[1] + 1, batch_size):
+                if pin not in self.pins:
+                    break
+                blockhashes = []
+                for h in range(height, min(height + batch_size, pin[1] + 1)):
+                    blockhash = self.repository.headers.get_block_hash(h)
+                    if blockhash and not self.repository.blockchain.get_block_index(blockhash):
+                        blockhashes.append(blockhash)
+                if not blockhashes:
+                    continue
+                try:
+                    blocks = await self.p2p.get_blocks(*blockhashes)
+                except Exception:
+                    Logger.cache.exception('Error downloading pinned blocks, will retry')
+                    return
+                for block in blocks.values():
+                    self.repository.blockchain.save_block(block, tracker=self)
+        Logger.cache.debug('Pinned blocks download done')
@@ -0,0 +1,120 @@
+import abc
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, List
+
+
+class EvictionPolicy(metaclass=abc.ABCMeta):
+    """
+    chooses which cache index entries go first once the cache is over its limit.
+    reads are recorded on the index entries ('accessed_at', 'hits'), so the ordering survives restarts.
+    """
+    name = None
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def on_hit(self, key: bytes, item: (None, Dict)):
+        self.hits += 1
+        if item is not None:
+            item['accessed_at'] = time.time()
+            item['hits'] = item.get('hits', 0) + 1
+
+    def on_miss(self, key: (None, bytes)):
+        self.misses += 1
+
+    def on_evict(self, item: Dict):
+        pass
+
+    @abc.abstractmethod
+    def get_victims(self, items: List[Dict], limit: int) -> Iterator[Dict]:
+        pass
+
+    def get_info(self) -> Dict:
+        requests = self.hits + self.misses
+        return {
+            'policy': self.name,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / requests, 4) if requests else 0.0
+        }
+
+    @staticmethod
+    def _last_access(item: Dict):
+        return item.get('accessed_at', item['saved_at'])
+
+
+class LRUPolicy(EvictionPolicy):
+    """
+    least recently read (or saved) first
+    """
+    name = 'lru'
+
+    def get_victims(self, items: List[Dict], limit: int) -> Iterator[Dict]:
+        return iter(sorted(items, key=self._last_access))
+
+
+class LFUPolicy(EvictionPolicy):
+    """
+    least read first, ties broken by recency
+    """
+    name = 'lfu'
+
+    def get_victims(self, items: List[Dict], limit: int) -> Iterator[Dict]:
+        return iter(sorted(items, key=lambda x: (x.get('hits', 0), self._last_access(x))))
+
+
+class ARCPolicy(EvictionPolicy):
+    """
+    adaptive replacement, sized in bytes.
+    entries never read since saved are the recency side (T1), entries read at least once the frequency side (T2).
+    evicted keys are remembered in two ghost lists: a miss on a ghost moves the T1 target size toward the side
+    that would have kept it.
+    """
+    name = 'arc'
+
+    def __init__(self, max_ghosts: int = 4096):
+        super().__init__()
+        self.target = 0
+        self.max_ghosts = max_ghosts
+        self.b1 = OrderedDict()
+        self.b2 = OrderedDict()
+        self._limit = 0
+
+    def on_miss(self, key: (None, bytes)):
+        super().on_miss(key)
+        if key in self.b1:
+            b1_size, b2_size = sum(self.b1.values()), sum(self.b2.values())
+            delta = max(1, b2_size / b1_size) * self.b1.pop(key)
+            self.target = min(self.target + delta, self._limit)
+        elif key in self.b2:
+            b1_size, b2_size = sum(self.b1.values()), sum(self.b2.values())
+            delta = max(1, b1_size / b2_size) * self.b2.pop(key)
+            self.target = max(self.target - delta, 0)
+
+    def on_evict(self, item: Dict):
+        ghosts = self.b2 if item.get('hits') else self.b1
+        ghosts[item['key']] = item.get('raw_size', item['size'])
+        while len(ghosts) > self.max_ghosts:
+            ghosts.popitem(last=False)
+
+    def get_victims(self, items: List[Dict], limit: int) -> Iterator[Dict]:
+        self._limit = limit
+        t1 = sorted((x for x in items if not x.get('hits')), key=lambda x: x['saved_at'], reverse=True)
+        t2 = sorted((x for x in items if x.get('hits')), key=self._last_access, reverse=True)
+        t1_size = sum(x['size'] for x in t1)
+        while t1 or t2:
+            if t1 and (t1_size > self.target or not t2):
+                item = t1.pop()
+                t1_size -= item['size']
+            else:
+                item = t2.pop()
+            yield item
+
+
+POLICIES = {
+    'lru': LRUPolicy,
+    'lfu': LFUPolicy,
+    'arc': ARCPolicy
+}
@@ -26,6 +26,11 @@ class Context(dict):
                     'network': 'bitcoin.mainnet',
                     'debug': False,
                     'cache_size': 50,
+                    'cache_compression': 'zlib',
+                    'cache_policy': 'lru',
+                    'hot_cache_size': 32,
+                    'tx_cache_size': 16,
+                    'prefetch_blocks': 8,
                     'keep_blocks': 200,
                     'proxy': None,
                     'tor': False,
@@ -40,7 +45,8 @@ class Context(dict):
                     'zmqpubrawtx': '',
                     'zmqpubhashtx': '',
                     'zmqpubrawblock': '',
-                    'mempool_size': 0
+                    'mempool_size': 0,
+                    'fast_sync': False
                 }
             }
         )
@@ -48,8 +54,8 @@ class Context(dict):
 
     def load_config(self):
         values = {
-            'i': ['cache_size', 'keep_blocks', 'rpcport'],
-            'b': ['debug']
+            'i': ['cache_size', 'hot_cache_size', 'tx_cache_size', 'prefetch_blocks', 'keep_blocks', 'rpcport'],
+            'b': ['debug', 'fast_sync']
         }
         import os
         filename = self.datadir + '/' + self.configfile
@@ -98,6 +104,10 @@ class Context(dict):
     def mempool_size(self):
         return int(self._get_param('mempool_size') or 0)
 
+    @property
+    def fast_sync(self):
+        return bool(self._get_param('fast_sync'))
+
     @property
     def block_size_for_multiprocessing(self):
         return 0
@@ -138,6 +148,27 @@ class Context(dict):
     def cache_size(self):
         return int(self._get_param('cache_size') or 1)
 
+    @property
+    def cache_compression(self):
+        value = self._get_param('cache_compression')
+        return value != 'none' and value or None
+
+    @property
+    def cache_policy(self):
+        return self._get_param('cache_policy')
+
+    @property
+    def hot_cache_size(self):
+        return int(self._get_param('hot_cache_size') or 0)
+
+    @property
+    def tx_cache_size(self):
+        return int(self._get_param('tx_cache_size') or 0)
+
+    @property
+    def prefetch_blocks(self):
+        return int(self._get_param('prefetch_blocks') or 0)
+
     @property
     def zmqpubhashblock(self) -> str:
         return self._get_param('zmqpubhashblock')
@@ -164,6 +195,11 @@ class Context(dict):
             'network': args.network,
             'debug': args.debug,
             'cache_size': int(args.cache_size),
+            'cache_compression': args.cache_compression,
+            'cache_policy': args.cache_policy,
+            'hot_cache_size': int(args.hot_cache_size),
+            'tx_cache_size': int(args.tx_cache_size),
+            'prefetch_blocks': int(args.prefetch_blocks),
             'keep_blocks': int(args.keep_blocks),
             'proxy': args.proxy,
             'tor': args.tor,
@@ -178,7 +214,8 @@ class Context(dict):
             'zmqpubrawtx': args.zmqpubrawtx,
             'zmqpubhashtx': args.zmqpubhashtx,
             'zmqpubrawblock': args.zmqpubrawblock,
-            'mempool_size': args.mempool_size
+            'mempool_size': args.mempool_size,
+            'fast_sync': args.fast_sync
         }
         self.apply_context()
 
@@ -15,6 +15,8 @@ class Header(Base):
     blockheight = Column(Integer, index=True, unique=True)
     blockhash = Column(BLOB, index=True, unique=True)
     data = Column(BLOB)
+    chainwork = Column(BLOB)
+    mediantime = Column(Integer)
 
 
 engine = create_engine('sqlite:///' + settings.SQLITE_DBNAME)
@@ -32,3 +32,7 @@ class ItemNotFoundException(SprunedException):
 
 class StorageErrorException(SprunedException):
     pass
+
+
+class CacheLimitExceededException(SprunedException):
+    pass
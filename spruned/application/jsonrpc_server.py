@@ -2,6 +2,7 @@ import asyncio
 import base64
 import binascii
 import gc
+import itertools
 
 import re
 
@@ -15,12 +16,16 @@ from spruned.application import exceptions
 
 from spruned.application.exceptions import InvalidPOWException, ItemNotFoundException
 from spruned.application.logging_factory import Logger
+from spruned.application.tools import SerializedJSON
 from spruned.daemon.exceptions import GenesisTransactionRequestedException
 from spruned import __version__ as spruned_version
 from spruned.dependencies.pybitcointools import address_to_script
 
 config.schema_validation = False
 
+SERIALIZED_JSON_PLACEHOLDER = '"\\u0000serialized\\u0000"'
+STREAM_CHUNK_SIZE = 2**16
+
 API_HELP = \
 """== Blockchain ==
 getbestblockhash
@@ -41,10 +46,15 @@ sendrawtransaction "hexstring" ( allowhighfees )
 estimatefee nblocks
 estimatesmartfee conf_target ("estimate_mode")
 uptime
+getcacheinfo
+pinblocks start_height end_height
+unpinblocks start_height end_height
+listpinnedblocks
 
 == Network ==
 getpeerinfo
 getnetworkinfo
+getnetworkstats
 
 == Wallet ==
 validateaddress
@@ -81,8 +91,8 @@ class JSONRPCServer:
         return bool(request.headers.get('Authorization') == self._auth)
 
     @staticmethod
-    def _json_dumps_with_fixed_float_precision(value):
-        res = json.dumps(value)
+    def _json_dumps_with_fixed_float_precision(value, default=None):
+        res = json.dumps(value, default=default)
 
         def parser(x):
             res = x.group().split(' ')
@@ -99,11 +109,13 @@ class JSONRPCServer:
         request = await jsonrequest.json()
         if isinstance(request, dict):
             response, http_status = await self._handle_request(request)
-            return web.json_response(
-                response,
-                status=http_status,
-                dumps=self._json_dumps_with_fixed_float_precision
+            serialized = []
+            body = self._json_dumps_with_fixed_float_precision(
+                response, default=lambda o: self._placeholder_for_serialized_json(o, serialized)
             )
+            if serialized:
+                return await self._stream_response(jsonrequest, body, serialized, http_status)
+            return web.Response(text=body, status=http_status, content_type='application/json')
         elif isinstance(request, list):
             futures = []
             for r in request:
@@ -111,10 +123,34 @@ class JSONRPCServer:
             responses = await asyncio.gather(*futures)
             data = [x[0] for x in responses]
             return web.Response(
-                body=json.dumps(data),
+                body=json.dumps(data, default=lambda o: json.loads(o.decode())),
                 status=200,
             )
 
+    @staticmethod
+    def _placeholder_for_serialized_json(obj, serialized: list):
+        if not isinstance(obj, SerializedJSON):
+            raise TypeError('Object of type %s is not JSON serializable' % obj.__class__.__name__)
+        serialized.append(obj)
+        return '\x00serialized\x00'
+
+    @staticmethod
+    async def _stream_response(jsonrequest, body: str, serialized: list, http_status: int):
+        """
+        the already serialized values are spliced into the response body, and written out in chunks
+        """
+        parts = [p.encode() for p in body.split(SERIALIZED_JSON_PLACEHOLDER)]
+        response = web.StreamResponse(status=http_status)
+        response.content_type = 'application/json'
+        response.content_length = sum(len(x) for x in parts) + sum(len(x) for x in serialized)
+        await response.prepare(jsonrequest)
+        for part, value in itertools.zip_longest(parts, serialized, fillvalue=b''):
+            await response.write(part)
+            for i in range(0, len(value), STREAM_CHUNK_SIZE):
+                await response.write(value[i:i + STREAM_CHUNK_SIZE])
+        await response.write_eof()
+        return response
+
     async def _handle_request(self, request):
         result = {
             "id": request.get("id", 0),
@@ -159,9 +195,14 @@ class JSONRPCServer:
         methods.add(self.getmininginfo)
         methods.add(self.getrawmempool)
         methods.add(self.getnetworkinfo)
+        methods.add(self.getnetworkstats)
         methods.add(self.uptime)
         methods.add(self.getnettotals)
         methods.add(self.validateaddress)
+        methods.add(self.getcacheinfo)
+        methods.add(self.pinblocks)
+        methods.add(self.unpinblocks)
+        methods.add(self.listpinnedblocks)
         methods.add(self.dev_memorysummary, name="dev-gc-stats")
         methods.add(self.dev_collect, name="dev-gc-collect")
         return await web.TCPSite(runner, host=self.host, port=self.port).start()
@@ -375,6 +416,49 @@ class JSONRPCServer:
                 message="server error: try again"
             )
 
+    async def getcacheinfo(self):
+        return await self.vo_service.getcacheinfo()
+
+    async def getnetworkstats(self):
+        return await self.vo_service.getnetworkstats()
+
+    @staticmethod
+    def _parse_heights_range(start_height, end_height) -> (int, int):
+        try:
+            start_height, end_height = int(start_height), int(end_height)
+        except (ValueError, TypeError):
+            raise JsonRpcServerException(
+                code=-5,
+                message="Error parsing JSON:%s %s" % (start_height, end_height)
+            )
+        if start_height < 0 or end_height < start_height:
+            raise JsonRpcServerException(
+                code=-8,
+                message="Invalid heights range"
+            )
+        return start_height, end_height
+
+    async def pinblocks(self, start_height: int, end_height: int):
+        try:
+            response = await self.vo_service.pinblocks(*self._parse_heights_range(start_height, end_height))
+        except exceptions.CacheLimitExceededException:
+            raise JsonRpcServerException(
+                code=-8,
+                message="Pinned blocks would exceed the cache size"
+            )
+        if response is None:
+            raise JsonRpcServerException(
+                code=-8,
+                message="Block height out of range"
+            )
+        return response
+
+    async def unpinblocks(self, start_height: int, end_height: int):
+        return await self.vo_service.unpinblocks(*self._parse_heights_range(start_height, end_height))
+
+    async def listpinnedblocks(self):
+        return await self.vo_service.listpinnedblocks()
+
     async def getrawmempool(self, verbose=False):
         try:
             return await self.vo_service.getrawmempool(verbose)
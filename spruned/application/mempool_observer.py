@@ -1,13 +1,14 @@
 import asyncio
 import time
 
-from pycoin.block import Block
+from pycoin.serialize import b2h_rev
 
 from spruned.application.logging_factory import Logger
 
 from spruned.application.tools import async_delayed_task
 
 from spruned.daemon import exceptions
+from spruned.daemon.bitcoin_p2p.p2p_connection import PRIORITY_BACKGROUND
 from spruned.daemon.bitcoin_p2p.p2p_interface import P2PInterface
 from spruned.daemon.bitcoin_p2p.utils import get_block_factory
 from spruned.repositories.repository import Repository
@@ -40,13 +41,8 @@ class MempoolObserver:
     async def on_block_header(self, blockheader: dict, i=0):
         try:
             Logger.mempool.debug('New block request: %s', blockheader['block_hash'])
-            block_transactions, size = self.repository.blockchain.get_transactions_by_block_hash(
-                blockheader['block_hash']
-            )
-            block_raw_data = (tx['transaction_bytes'] for tx in block_transactions)
-            cached_block = block_transactions and (blockheader['header_bytes'] + b''.join(block_raw_data)) or None
             try:
-                block_object = Block.from_bin(cached_block)
+                block_object = self.repository.blockchain.get_block_object(blockheader['block_hash'])
             except:
                 block_object = None
             if block_object:
@@ -56,7 +52,7 @@ class MempoolObserver:
                 }
             else:
                 Logger.mempool.debug('Block %s not in cache, fetching', blockheader['block_hash'])
-                block = await self.p2p.get_block(blockheader['block_hash'], timeout=15)
+                block = await self.p2p.get_block(blockheader['block_hash'], timeout=15, priority=PRIORITY_BACKGROUND)
                 if not block:
                     raise exceptions.MissingResponseException
                 Logger.mempool.debug(
@@ -99,7 +95,7 @@ class MempoolObserver:
         transaction = {
             "timestamp": int(time.time()),
             "txid": txid,
-            "outpoints": ["{}:{}".format(x.previous_hash, x.previous_index) for x in item["tx"].txs_in],
+            "outpoints": ["{}:{}".format(b2h_rev(x.previous_hash), x.previous_index) for x in item["tx"].txs_in],
             "bytes": item['tx'].as_bin()
         }
         transaction["size"] = len(transaction["bytes"])
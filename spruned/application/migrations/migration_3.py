@@ -0,0 +1,40 @@
+import struct
+
+
+def migrate(sql):
+    from spruned.application.tools import get_work
+    columns = [x[1] for x in sql.execute("PRAGMA table_info('headers')").fetchall()]
+    if 'chainwork' not in columns:
+        sql.execute("ALTER TABLE headers ADD COLUMN chainwork BLOB")
+    if 'mediantime' not in columns:
+        sql.execute("ALTER TABLE headers ADD COLUMN mediantime INTEGER")
+    sql.commit()
+    offset = -1
+    chainwork = 0
+    timestamps = []
+    while 1:
+        action = "SELECT blockheight, data FROM headers where blockheight > %s " \
+                 "ORDER BY blockheight ASC limit %s" % (offset, 10000)
+        res = sql.execute(action).fetchall()
+        if not res:
+            break
+        data = []
+        for blockheight, header in res:
+            if blockheight != offset + 1:
+                chainwork, timestamps = 0, []
+            timestamp, bits = struct.unpack_from('<II', header, 68)
+            chainwork += get_work(bits)
+            timestamps = timestamps[-10:] + [timestamp]
+            data.append({
+                'blockheight': blockheight,
+                'chainwork': chainwork.to_bytes(chainwork.bit_length() // 8 + 1, 'big', signed=True),
+                'mediantime': sorted(timestamps)[len(timestamps) // 2]
+            })
+            offset = blockheight
+        query = "UPDATE headers SET chainwork = :chainwork, mediantime = :mediantime WHERE blockheight = :blockheight"
+        sql.execute(query, data)
+        sql.commit()
+    sql.execute("UPDATE migrations SET version = 3")
+    sql.commit()
+    sql.close()
+    return True
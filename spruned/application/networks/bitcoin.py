@@ -17,6 +17,9 @@ mainnet = {
     'pycoin': MAINNET,
     'alias': 'bc_mainnet',
     'chain': 'main',
+    'address_prefix': b'\x00',
+    'pay_to_script_prefix': b'\x05',
+    'bech32_hrp': 'bc',
     'regex_legacy_addresses_prefix': '1',
     'electrum_concurrency': 4,
     'fees_consensus': 3,
@@ -49,6 +52,9 @@ testnet = {
     'pycoin': TESTNET,
     'alias': 'bc_testnet',
     'chain': 'test',
+    'address_prefix': b'\x6f',
+    'pay_to_script_prefix': b'\xc4',
+    'bech32_hrp': 'tb',
     'electrum_concurrency': 1,
     'fees_consensus': 1,
     'tx0': '4a5e1e4baab89f3a32518a88c31bc87f618f76673e2cc77ab2127b7afdeda33b',
@@ -68,6 +74,9 @@ regtest = {
     'pycoin': REGTEST,
     'alias': 'bc_regtest',
     'chain': 'regtest',
+    'address_prefix': b'\x6f',
+    'pay_to_script_prefix': b'\xc4',
+    'bech32_hrp': 'bcrt',
     'electrum_concurrency': 1,
     'fees_consensus': 1,
     'tx0': '4a5e1e4baab89f3a32518a88c31bc87f618f76673e2cc77ab2127b7afdeda33b',
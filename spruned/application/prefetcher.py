@@ -0,0 +1,120 @@
+import asyncio
+import time
+from typing import Dict, List
+
+from spruned.application.logging_factory import Logger
+
+
+class BlocksPrefetcher:
+    """
+    detects sequential walks over the chain (getblockhash h, getblock, h + 1, ...) and downloads the next blocks
+    ahead of the requests, into the cache.
+    rpc requests carry no client identity: each walk is a stream, extended by a request at its next height,
+    so interleaved clients are followed on their own. idle streams are dropped and their downloads cancelled.
+    """
+    def __init__(
+            self, repository, p2p, cache_agent=None, depth=8, budget=32, min_run=3, max_streams=8, idle_timeout=30,
+            loop=asyncio.get_event_loop()
+    ):
+        self.repository = repository
+        self.p2p = p2p
+        self.cache_agent = cache_agent
+        self.depth = depth
+        self.budget = budget
+        self.min_run = min_run
+        self.max_streams = max_streams
+        self.idle_timeout = idle_timeout
+        self.loop = loop
+        self._streams = []
+        self._pending = {}
+
+    def on_block_request(self, block_header: Dict):
+        if not self.depth:
+            return
+        now = time.time()
+        for stream in [s for s in self._streams if s['seen_at'] < now - self.idle_timeout]:
+            self._drop_stream(stream)
+        height = block_header['block_height']
+        stream = self._find_stream(height)
+        if not stream:
+            self._streams.append({'height': height, 'direction': 0, 'run': 1, 'seen_at': now, 'task': None})
+            while len(self._streams) > self.max_streams:
+                self._drop_stream(self._streams[0])
+            return
+        stream['seen_at'] = now
+        if stream['height'] == height:
+            return
+        stream['direction'] = height - stream['height']
+        stream['height'] = height
+        stream['run'] += 1
+        if stream['run'] >= self.min_run and (not stream['task'] or stream['task'].done()):
+            stream['task'] = self.loop.create_task(self._prefetch(stream))
+
+    def _find_stream(self, height: int) -> (None, Dict):
+        for stream in self._streams:
+            if stream['height'] == height:
+                return stream
+            elif stream['direction'] and stream['height'] + stream['direction'] == height:
+                return stream
+            elif not stream['direction'] and abs(stream['height'] - height) == 1:
+                return stream
+
+    def _drop_stream(self, stream: Dict):
+        self._streams.remove(stream)
+        if stream['task'] and not stream['task'].done():
+            Logger.p2p.debug('Sequential access at height %s stopped, cancelling prefetch', stream['height'])
+            stream['task'].cancel()
+
+    def _get_next_blockhashes(self, stream: Dict) -> List[str]:
+        blockhashes = []
+        for i in range(1, self.depth + 1):
+            if len(self._pending) + len(blockhashes) >= self.budget:
+                break
+            height = stream['height'] + stream['direction'] * i
+            blockhash = height >= 0 and self.repository.headers.get_block_hash(height)
+            if not blockhash or blockhash in self._pending or self.repository.blockchain.get_block_index(blockhash):
+                continue
+            blockhashes.append(blockhash)
+        return blockhashes
+
+    async def _prefetch(self, stream: Dict):
+        """
+        keeps the blocks ahead of the stream downloaded, until it reaches them or goes idle
+        """
+        while stream in self._streams:
+            blockhashes = self._get_next_blockhashes(stream)
+            if not blockhashes:
+                return
+            futures = {blockhash: self.loop.create_future() for blockhash in blockhashes}
+            self._pending.update(futures)
+            try:
+                Logger.p2p.debug('Prefetching %s blocks from height %s', len(blockhashes), stream['height'])
+                blocks = await self.p2p.get_blocks(*blockhashes)
+                for blockhash, block in blocks.items():
+                    futures[blockhash].set_result(
+                        self.repository.blockchain.save_block(block, tracker=self.cache_agent)
+                    )
+                if len(blocks) < len(blockhashes):
+                    return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                Logger.p2p.exception('Error prefetching blocks %s', blockhashes)
+                return
+            finally:
+                for blockhash, future in futures.items():
+                    self._pending.pop(blockhash, None)
+                    future.done() or future.cancel()
+
+    async def wait_for(self, blockhash: str) -> (None, Dict):
+        """
+        the block, if it's being prefetched
+        """
+        future = self._pending.get(blockhash)
+        if not future:
+            return
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise
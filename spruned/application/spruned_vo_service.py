@@ -1,15 +1,13 @@
 import asyncio
 import binascii
-import io
 import itertools
 import time
 
-from pycoin.block import Block
-from pycoin.tx.Tx import Tx
-
 from spruned.application.cache import CacheAgent
 from spruned.application.logging_factory import Logger
-from spruned.application.tools import deserialize_header, script_to_scripthash, ElectrumMerkleVerify, is_address
+from spruned.application.tools import deserialize_header, script_to_scripthash, ElectrumMerkleVerify, is_address, \
+    SerializedJSON
+from spruned.application.tx_decoder import decode_transaction, serialize_transactions
 from spruned.application import exceptions
 from spruned.application.abstracts import RPCAPIService
 from spruned.daemon.bitcoin_p2p.utils import get_block_factory
@@ -26,9 +24,11 @@ class SprunedVOService(RPCAPIService):
             repository=None,
             loop=asyncio.get_event_loop(),
             context=None,
-            fallback_non_segwit_blocks=False
+            fallback_non_segwit_blocks=False,
+            prefetcher=None
     ):
         self.cache_agent = cache_agent
+        self.prefetcher = prefetcher
         self.p2p = p2p
         self.electrod = electrod
         self.repository = repository
@@ -46,32 +46,41 @@ class SprunedVOService(RPCAPIService):
         block_header = self.repository.headers.get_block_header(blockhash)
         if not block_header:
             return
+        block_object = self.repository.blockchain.get_cached_block_object(blockhash)
+        if block_object:
+            return block_object
+        block_bytes = self.repository.blockchain.get_block_bytes(blockhash)
+        if block_bytes is not None:
+            return await self._parse_block(blockhash, block_bytes)
         try:
             block = await self._get_block(block_header)
         except exceptions.ServiceException:
             if not self._fallback_non_segwit_blocks:
                 raise
             block = await self._get_block(block_header, segwit=False)
-        block_object = await self.block_factory.get(block['block_bytes'])
+        return block['block_object']
+
+    async def _parse_block(self, blockhash: str, block_bytes: bytes):
+        """
+        one parse per block, shared with the other consumers through the repository hot cache
+        """
+        block_object = self.repository.blockchain.get_cached_block_object(blockhash)
+        if not block_object:
+            block_object = await self.block_factory.get(bytes(block_bytes))
+            self.repository.blockchain.cache_block_object(blockhash, block_object, len(block_bytes))
         return block_object
 
     async def getblock(self, blockhash: str, mode: int = 1):
         start = time.time()
-        if mode == 2:
-            raise NotImplementedError
         block_header = self.repository.headers.get_block_header(blockhash)
         if not block_header:
             return
+        self.prefetcher and self.prefetcher.on_block_request(block_header)
+        if mode == 2:
+            return await self._getblock_with_transactions(block_header, start)
         if mode == 1:
-            txids, size = self.repository.blockchain.get_txids_by_block_hash(block_header['block_hash'])
-            if txids:
-                block = self._serialize_header(block_header)
-                block.update({
-                    'tx': txids,
-                    'size': size
-                })
-                best_header = self.repository.headers.get_best_header()
-                block['confirmations'] = best_header['block_height'] - block_header['block_height'] + 1
+            block = self._get_verbose_block(block_header)
+            if block:
                 Logger.p2p.info(
                     'Verbose block %s (%s) provided from local storage in %ss)',
                     block_header['block_height'],
@@ -88,20 +97,17 @@ class SprunedVOService(RPCAPIService):
             )
             return p2p_block['verbose']
         else:
-            transactions, size = self.repository.blockchain.get_transactions_by_block_hash(blockhash)
-            if transactions:
+            block_bytes = self.repository.blockchain.get_block_bytes(blockhash)
+            if block_bytes is not None:
                 Logger.p2p.info(
                     'Raw block %s (%s) provided from local storage in %ss)',
                     block_header['block_height'],
                     blockhash,
                     '{:.4f}'.format(time.time() - start)
                 )
-                try:
-                    block = Block.parse(io.BytesIO(block_header['header_bytes']), include_transactions=False)
-                    block.set_txs([Tx.from_bin(t['transaction_bytes']) for t in transactions])
-                    return block.as_hex()
-                except:
-                    Logger.repository.error('Error loading block %s from repository, falling back to P2P' % blockhash)
+                if block_bytes[:80] == block_header['header_bytes']:
+                    return binascii.hexlify(block_bytes).decode()
+                Logger.repository.error('Error loading block %s from repository, falling back to P2P' % blockhash)
             p2p_block = await self._get_block(block_header)
             Logger.p2p.info(
                 'Raw block %s (%s) provided from P2P in %ss)',
@@ -113,22 +119,83 @@ class SprunedVOService(RPCAPIService):
                 p2p_block['block_bytes']
             ).decode()
 
+    async def _getblock_with_transactions(self, block_header: dict, start: float) -> dict:
+        blockhash = block_header['block_hash']
+        transactions, size = self.repository.blockchain.get_decoded_transactions(blockhash)
+        if transactions:
+            source = 'local storage'
+        else:
+            block_bytes = self.repository.blockchain.get_block_bytes(blockhash)
+            source = 'local storage' if block_bytes is not None else 'P2P'
+            if block_bytes is None:
+                block_bytes = (await self._get_block(block_header))['block_bytes']
+            block_object = await self._parse_block(blockhash, block_bytes)
+            transactions = await self.loop.run_in_executor(None, self._decode_transactions, block_object)
+            size = len(block_bytes)
+            self.repository.blockchain.save_decoded_transactions(blockhash, transactions, size)
+        block = self._serialize_header(block_header)
+        block.update({
+            'tx': SerializedJSON(transactions),
+            'size': size
+        })
+        best_header = self.repository.headers.get_best_header()
+        block['confirmations'] = best_header['block_height'] - block_header['block_height'] + 1
+        Logger.p2p.info(
+            'Verbose block with transactions %s (%s) provided from %s in %ss)',
+            block_header['block_height'],
+            blockhash,
+            source,
+            '{:.4f}'.format(time.time() - start)
+        )
+        return block
+
+    def _decode_transactions(self, block_object) -> bytes:
+        network = self.context.get_network()
+        return serialize_transactions([decode_transaction(tx, network) for tx in block_object.txs])
+
+    def _get_verbose_block(self, block_header: dict) -> (None, dict):
+        """
+        the verbose block from the hot cache or from the stored txids.
+        the cached dict is shared, confirmations and nextblockhash are set on a copy.
+        blocks without chainwork, i.e. while the headers are backfilled, aren't cached.
+        """
+        blockhash = block_header['block_hash']
+        block = self.repository.blockchain.get_cached_verbose_block(blockhash)
+        if not block:
+            txids, size = self.repository.blockchain.get_txids_by_block_hash(blockhash)
+            if not txids:
+                return
+            block = self._serialize_header(block_header)
+            block.update({
+                'tx': txids,
+                'size': size
+            })
+            'chainwork' in block and self.repository.blockchain.cache_verbose_block(blockhash, block)
+        block = dict(block, nextblockhash=block_header.get('next_block_hash'))
+        best_header = self.repository.headers.get_best_header()
+        block['confirmations'] = best_header['block_height'] - block_header['block_height'] + 1
+        return block
+
     async def _make_verbose_block(self, block: dict, block_header) -> dict:
-        block_object = await self.block_factory.get(block['block_bytes'])
+        block_object = block.get('block_object') or await self._parse_block(block['block_hash'], block['block_bytes'])
         serialized = self._serialize_header(block_header or deserialize_header(block['block_bytes'][:80]))
         serialized['tx'] = [tx.id() for tx in block_object.txs]
         serialized['size'] = len(block['block_bytes'])
-        return serialized
+        'chainwork' in serialized and self.repository.blockchain.cache_verbose_block(block['block_hash'], serialized)
+        return dict(serialized)
 
     async def _get_block(self, blockheader, retries=0, verbose=False, segwit=True):
         blockhash = blockheader['block_hash']
-
-        block = await self.p2p.get_block(blockhash, privileged_peers=retries > 3, segwit=segwit)
+        block = not retries and self.prefetcher and await self.prefetcher.wait_for(blockhash)
+        if not block:
+            block = await self.p2p.get_block(blockhash, privileged_peers=retries > 3, segwit=segwit)
         if not block:
             if retries > 3:
                 raise exceptions.ServiceException
             else:
                 block = await self._get_block(blockheader, retries + 1, segwit=segwit)
+        if not block.get('block_object'):
+            block['block_object'] = await self._parse_block(blockhash, block['block_bytes'])
         if verbose and not block.get('verbose'):
             block['verbose'] = await self._make_verbose_block(block, blockheader)
         self.loop.create_task(
@@ -142,9 +209,10 @@ class SprunedVOService(RPCAPIService):
             if not response:
                 raise exceptions.ItemNotFoundException
             if verbose:
-                for vout in response.get('vout'):
-                    if vout.get('value'):
-                        vout['value'] = "{:.8f}".format(vout['value'])
+                response = dict(response, vout=[
+                    dict(vout, value="{:.8f}".format(vout['value'])) if vout.get('value') else vout
+                    for vout in response.get('vout')
+                ])
             return response
         except:
             if txid not in self._expected_data['txids'] or retries > 10:
@@ -152,11 +220,48 @@ class SprunedVOService(RPCAPIService):
             await asyncio.sleep(1)
             return await self._get_electrum_transaction(txid, verbose=verbose, retries=retries + 1)
 
+    def _get_confirmed_transaction(self, txid: str) -> (None, dict):
+        """
+        a stored verified transaction, as long as its block is still in the main chain
+        """
+        transaction = self.repository.blockchain.get_confirmed_transaction(txid)
+        if not transaction:
+            return
+        block_header = self.repository.headers.get_block_header(transaction['block_hash'])
+        if not block_header or block_header['block_height'] != transaction['merkle_proof']['block_height']:
+            Logger.repository.debug('Transaction %s reorged out, dropping it', txid)
+            self.repository.blockchain.remove_confirmed_transaction(txid)
+            return
+        transaction['block_header'] = block_header
+        return transaction
+
+    async def _get_verbose_transaction(self, transaction_bytes: bytes, block_header: dict) -> dict:
+        transaction = decode_transaction(transaction_bytes, self.context.get_network())
+        blocktime = deserialize_header(block_header['header_bytes'])['timestamp']
+        transaction.update({
+            'blockhash': block_header['block_hash'],
+            'confirmations': (await self.getblockcount()) - block_header['block_height'] + 1,
+            'time': blocktime,
+            'blocktime': blocktime
+        })
+        return transaction
+
     async def getrawtransaction(self, txid: str, verbose=False):
-        if not verbose:
-            tx = self.repository.blockchain.get_transaction(txid)
-            if tx:
+        tx = self.repository.blockchain.get_transaction(txid)
+        if tx:
+            if not verbose:
                 return binascii.hexlify(tx['transaction_bytes']).decode()
+            block_header = self.repository.headers.get_block_header(binascii.hexlify(tx['block_hash']).decode())
+            if block_header:
+                return await self._get_verbose_transaction(tx['transaction_bytes'], block_header)
+
+        confirmed = self._get_confirmed_transaction(txid)
+        if confirmed:
+            if verbose:
+                return await self._get_verbose_transaction(
+                    confirmed['transaction_bytes'], confirmed['block_header']
+                )
+            return binascii.hexlify(confirmed['transaction_bytes']).decode()
 
         transaction = await self._get_electrum_transaction(txid, verbose=True)
         block_header = None
@@ -166,6 +271,10 @@ class SprunedVOService(RPCAPIService):
             dh = deserialize_header(block_header['header_bytes'])
             if not ElectrumMerkleVerify.verify_merkle(txid, merkle_proof, dh):
                 raise exceptions.InvalidPOWException
+            self.repository.blockchain.save_confirmed_transaction(
+                txid, binascii.unhexlify(transaction['hex']), transaction['blockhash'],
+                dict(merkle_proof, block_height=block_header['block_height'])
+            )
         if verbose:
             if transaction.get('blockhash'):
                 incl_height = block_header and block_header['block_height'] or \
@@ -203,24 +312,26 @@ class SprunedVOService(RPCAPIService):
             res = binascii.hexlify(header['header_bytes']).decode()
         return res
 
-    @staticmethod
-    def _serialize_header(header):
+    def _serialize_header(self, header):
         _deserialized_header = deserialize_header(header['header_bytes'], fmt='hex')
-        return {
+        stats = self.repository.headers.get_chain_stats(header['block_height']) or {}
+        res = {
             "hash": _deserialized_header['hash'],
             "height": header['block_height'],
             "version": _deserialized_header['version'],
             "versionHex": "",
             "merkleroot": _deserialized_header['merkle_root'],
             "time": _deserialized_header['timestamp'],
-            "mediantime": _deserialized_header['timestamp'],
+            "mediantime": stats.get('mediantime', _deserialized_header['timestamp']),
             "nonce": _deserialized_header['nonce'],
             "bits": str(_deserialized_header['bits']),
-            "difficulty": 0,
-            "chainwork": '00'*32,
+            "difficulty": stats.get('difficulty', 0),
             "previousblockhash": _deserialized_header['prev_block_hash'],
             "nextblockhash": header.get('next_block_hash')
         }
+        if 'chainwork' in stats:
+            res['chainwork'] = stats['chainwork']
+        return res
 
     async def getblockcount(self) -> int:
         return self.repository.headers.get_best_header().get('block_height')
@@ -252,19 +363,22 @@ class SprunedVOService(RPCAPIService):
         from spruned import __bitcoind_version_emulation__ as bitcoind_version
         best_header = self.repository.headers.get_best_header()
         _deserialized_header = deserialize_header(best_header['header_bytes'])
-        return {
+        stats = self.repository.headers.get_chain_stats(best_header['block_height']) or {}
+        res = {
             "chain": "main",
             "warning": "spruned %s, emulating bitcoind v%s" % (spruned_version, bitcoind_version),
             "blocks": best_header["block_height"],
             "headers": best_header["block_height"],
             "bestblockhash": best_header["block_hash"],
-            "difficulty": 0,
-            "chainwork": '00'*32,
-            "mediantime": _deserialized_header["timestamp"],
+            "difficulty": stats.get('difficulty', 0),
+            "mediantime": stats.get('mediantime', _deserialized_header["timestamp"]),
             "verificationprogress": self.p2p.bootstrap_status,
             "pruned": False,
             "initialblockdownload": False
         }
+        if 'chainwork' in stats:
+            res['chainwork'] = stats['chainwork']
+        return res
 
     async def gettxout(self, txid: str, index: int):
         repo_tx = self.repository.blockchain.get_transaction(txid)
@@ -276,6 +390,11 @@ class SprunedVOService(RPCAPIService):
         if index + 1 > len(deserialized['outs']):
             return
         vout = deserialized['outs'][index]
+        txout = repo_tx and self._get_local_txout(txid, index, repo_tx['block_hash'], vout['value'])
+        if txout is False:
+            return
+        elif txout:
+            return await self._format_gettxout(txout, vout)
         scripthash = script_to_scripthash(vout['script'])
         unspents = await self._listunspent_by_scripthash(scripthash) or []
         txout = None
@@ -284,6 +403,28 @@ class SprunedVOService(RPCAPIService):
                 txout = unspent
         return txout and await self._format_gettxout(txout, vout)
 
+    def _get_local_txout(self, txid: str, index: int, blockhash: bytes, value: int) -> (None, bool, dict):
+        """
+        answers from the spends index when every block since the output one is stored:
+        the unspent output, False if spent, None if the local storage can't tell.
+        """
+        block_header = self.repository.headers.get_block_header(binascii.hexlify(blockhash).decode())
+        best_header = self.repository.headers.get_best_header()
+        if not block_header or \
+                best_header['block_height'] - block_header['block_height'] >= self.repository.keep_blocks:
+            return
+        stored_since = self.repository.get_stored_since_height()
+        if stored_since is None or stored_since > block_header['block_height'] + 1:
+            return
+        spend = self.repository.blockchain.get_spend(txid, index)
+        if spend:
+            if self.repository.headers.get_block_header(binascii.hexlify(spend['block_hash']).decode()):
+                return False
+            return
+        if self.repository.mempool and self.repository.mempool.is_spent(txid, index):
+            return False
+        return {'height': block_header['block_height'], 'value': value}
+
     async def _format_gettxout(self, txout: dict, deserialized_vout: dict):
         best_header = self.repository.headers.get_best_header()
         return {
@@ -323,6 +464,12 @@ class SprunedVOService(RPCAPIService):
             )
         return response
 
+    async def getnetworkstats(self):
+        return {
+            'electrum': self.electrod.get_network_stats(),
+            'p2p': self.p2p.get_network_stats()
+        }
+
     async def getmempoolinfo(self):
         if not self.repository.mempool:
             raise exceptions.MempoolDisabledException
@@ -334,5 +481,22 @@ class SprunedVOService(RPCAPIService):
         mempool_txids = self.repository.mempool.get_raw_mempool(verbose)
         return mempool_txids
 
+    async def getcacheinfo(self):
+        return self.cache_agent.get_info()
+
+    async def pinblocks(self, start_height: int, end_height: int):
+        best_header = self.repository.headers.get_best_header()
+        if not best_header or end_height > best_header['block_height']:
+            return
+        if not self.cache_agent.can_pin(start_height, end_height):
+            raise exceptions.CacheLimitExceededException
+        return self.cache_agent.pin(start_height, end_height)
+
+    async def unpinblocks(self, start_height: int, end_height: int):
+        return self.cache_agent.unpin(start_height, end_height)
+
+    async def listpinnedblocks(self):
+        return self.cache_agent.get_pins()
+
     async def validateaddress(self, address):
         return bool(is_address(address, self.context.get_network()['regex_legacy_addresses_prefix']))
@@ -51,6 +51,34 @@ def verify_pow(header, blockhash):
     raise exceptions.InvalidPOWException
 
 
+def bits_to_target(bits: int) -> int:
+    exponent, mantissa = bits >> 24, bits & 0x007fffff
+    return mantissa << (8 * (exponent - 3)) if exponent > 3 else mantissa >> (8 * (3 - exponent))
+
+
+def get_work(bits: int) -> int:
+    """
+    expected number of hashes for a block with the given target, as bitcoind GetBlockProof
+    """
+    target = bits_to_target(bits)
+    return target and (1 << 256) // (target + 1) or 0
+
+
+def get_difficulty(bits: int) -> float:
+    """
+    as bitcoind GetDifficulty
+    """
+    shift = (bits >> 24) & 0xff
+    difficulty = float(0x0000ffff) / float(bits & 0x00ffffff or 1)
+    while shift < 29:
+        difficulty *= 256.0
+        shift += 1
+    while shift > 29:
+        difficulty /= 256.0
+        shift -= 1
+    return difficulty
+
+
 def serialize_header(inp):
     o = encode(inp['version'], 256, 4)[::-1] + \
         binascii.unhexlify(inp['prev_block_hash'])[::-1] + \
@@ -187,3 +215,9 @@ def is_address(addr, prefix):
 def inject_attribute(obj: callable, attr_name: str, *objects: object):
     for o in objects:
         setattr(o, attr_name, obj)
+
+
+class SerializedJSON(bytes):
+    """
+    an already serialized json value, written out by the rpc server as is
+    """
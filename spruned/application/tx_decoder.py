@@ -0,0 +1,242 @@
+import binascii
+import json
+import re
+from typing import Dict, List
+
+from pycoin.contrib import segwit_addr
+from pycoin.encoding import hash160, hash160_sec_to_bitcoin_address
+from pycoin.tx.Tx import Tx
+from pycoin.tx.script.opcodes import INT_TO_OPCODE
+
+OP_0 = 0x00
+OP_PUSHDATA1 = 0x4c
+OP_PUSHDATA2 = 0x4d
+OP_PUSHDATA4 = 0x4e
+OP_1NEGATE = 0x4f
+OP_1 = 0x51
+OP_16 = 0x60
+OP_RETURN = 0x6a
+OP_DUP = 0x76
+OP_EQUAL = 0x87
+OP_EQUALVERIFY = 0x88
+OP_HASH160 = 0xa9
+OP_CHECKSIG = 0xac
+OP_CHECKMULTISIG = 0xae
+
+SIGHASH_TYPES = {
+    0x01: 'ALL',
+    0x81: 'ALL|ANYONECANPAY',
+    0x02: 'NONE',
+    0x82: 'NONE|ANYONECANPAY',
+    0x03: 'SINGLE',
+    0x83: 'SINGLE|ANYONECANPAY'
+}
+
+
+def _hex(data: bytes) -> str:
+    return binascii.hexlify(data).decode()
+
+
+def parse_script(script: bytes) -> (List, bool):
+    """
+    the list of (opcode, pushed data) of a script, the flag is False on a truncated script
+    """
+    ops = []
+    i = 0
+    while i < len(script):
+        opcode = script[i]
+        i += 1
+        data = None
+        if opcode <= OP_PUSHDATA4:
+            if opcode < OP_PUSHDATA1:
+                size = opcode
+            else:
+                width = {OP_PUSHDATA1: 1, OP_PUSHDATA2: 2, OP_PUSHDATA4: 4}[opcode]
+                if i + width > len(script):
+                    return ops, False
+                size = int.from_bytes(script[i:i + width], 'little')
+                i += width
+            if i + size > len(script):
+                return ops, False
+            data = script[i:i + size]
+            i += size
+        ops.append((opcode, data))
+    return ops, True
+
+
+def _script_num(data: bytes) -> int:
+    if not data:
+        return 0
+    value = int.from_bytes(data, 'little')
+    if data[-1] & 0x80:
+        return -(value & ~(0x80 << (8 * (len(data) - 1))))
+    return value
+
+
+def _is_valid_signature_encoding(sig: bytes) -> bool:
+    """
+    bip66 strict der, plus the hashtype byte
+    """
+    if len(sig) < 9 or len(sig) > 73:
+        return False
+    if sig[0] != 0x30 or sig[1] != len(sig) - 3:
+        return False
+    len_r = sig[3]
+    if 5 + len_r >= len(sig):
+        return False
+    len_s = sig[5 + len_r]
+    if len_r + len_s + 7 != len(sig):
+        return False
+    if sig[2] != 0x02 or len_r == 0 or sig[4] & 0x80:
+        return False
+    if len_r > 1 and sig[4] == 0x00 and not sig[5] & 0x80:
+        return False
+    if sig[len_r + 4] != 0x02 or len_s == 0 or sig[len_r + 6] & 0x80:
+        return False
+    if len_s > 1 and sig[len_r + 6] == 0x00 and not sig[len_r + 7] & 0x80:
+        return False
+    return True
+
+
+def _op_name(opcode: int) -> str:
+    if opcode == OP_0:
+        return '0'
+    elif opcode == OP_1NEGATE:
+        return '-1'
+    elif OP_1 <= opcode <= OP_16:
+        return str(opcode - OP_1 + 1)
+    return INT_TO_OPCODE.get(opcode, 'OP_UNKNOWN')
+
+
+def script_to_asm(script: bytes, attempt_sighash_decode=False) -> str:
+    """
+    the bitcoind asm representation of a script
+    """
+    ops, valid = parse_script(script)
+    if attempt_sighash_decode and ops and ops[0][0] == OP_RETURN:
+        attempt_sighash_decode = False
+    res = []
+    for opcode, data in ops:
+        if data is None or opcode == OP_0:
+            res.append(_op_name(opcode))
+        elif len(data) <= 4:
+            res.append(str(_script_num(data)))
+        elif attempt_sighash_decode and _is_valid_signature_encoding(data) and data[-1] in SIGHASH_TYPES:
+            res.append('%s[%s]' % (_hex(data[:-1]), SIGHASH_TYPES[data[-1]]))
+        else:
+            res.append(_hex(data))
+    if not valid:
+        res.append('[error]')
+    return ' '.join(res)
+
+
+def _p2pkh(network: Dict, h160: bytes) -> str:
+    return hash160_sec_to_bitcoin_address(h160, address_prefix=network['address_prefix'])
+
+
+def _p2sh(network: Dict, h160: bytes) -> str:
+    return hash160_sec_to_bitcoin_address(h160, address_prefix=network['pay_to_script_prefix'])
+
+
+def get_script_type(script: bytes, network: Dict) -> (str, int, List[str]):
+    """
+    type, required signatures and addresses of an output script, as solved by bitcoind
+    """
+    ops, valid = parse_script(script)
+    if not valid:
+        return 'nonstandard', 0, []
+    if len(script) == 25 and script[:3] == bytes([OP_DUP, OP_HASH160, 20]) \
+            and script[23:] == bytes([OP_EQUALVERIFY, OP_CHECKSIG]):
+        return 'pubkeyhash', 1, [_p2pkh(network, script[3:23])]
+    if len(script) == 23 and script[:2] == bytes([OP_HASH160, 20]) and script[22] == OP_EQUAL:
+        return 'scripthash', 1, [_p2sh(network, script[2:22])]
+    if 4 <= len(script) <= 42 and (script[0] == OP_0 or OP_1 <= script[0] <= OP_16) \
+            and script[1] + 2 == len(script):
+        version = script[0] and script[0] - OP_1 + 1
+        program = script[2:]
+        address = segwit_addr.encode(network['bech32_hrp'], version, program)
+        if version == 0 and len(program) == 20:
+            return 'witness_v0_keyhash', 1, [address]
+        elif version == 0 and len(program) == 32:
+            return 'witness_v0_scripthash', 1, [address]
+        elif version:
+            return 'witness_unknown', 1, [address]
+        return 'nonstandard', 0, []
+    if len(ops) == 2 and ops[1] == (OP_CHECKSIG, None) and ops[0][1] and len(ops[0][1]) in (33, 65):
+        return 'pubkey', 1, [_p2pkh(network, hash160(ops[0][1]))]
+    if ops and ops[0][0] == OP_RETURN and all(op[1] is not None or op[0] <= OP_16 for op in ops[1:]):
+        return 'nulldata', 0, []
+    if len(ops) >= 4 and ops[-1] == (OP_CHECKMULTISIG, None) \
+            and OP_1 <= ops[0][0] <= OP_16 and OP_1 <= ops[-2][0] <= OP_16:
+        required, keys = ops[0][0] - OP_1 + 1, ops[1:-2]
+        if len(keys) == ops[-2][0] - OP_1 + 1 >= required \
+                and all(k[1] is not None and len(k[1]) in (33, 65) for k in keys):
+            return 'multisig', required, [_p2pkh(network, hash160(k[1])) for k in keys]
+    return 'nonstandard', 0, []
+
+
+def decode_script_pubkey(script: bytes, network: Dict) -> Dict:
+    script_type, required, addresses = get_script_type(script, network)
+    res = {
+        'asm': script_to_asm(script),
+        'hex': _hex(script)
+    }
+    if required:
+        res['reqSigs'] = required
+    res['type'] = script_type
+    if addresses:
+        res['addresses'] = addresses
+    return res
+
+
+def decode_transaction(tx: (Tx, bytes), network: Dict) -> Dict:
+    """
+    the bitcoind decoderawtransaction representation of a transaction
+    """
+    if not isinstance(tx, Tx):
+        tx = Tx.from_bin(bytes(tx))
+    raw = tx.as_bin()
+    base_size = tx.has_witness_data() and len(tx.as_bin(include_witness_data=False)) or len(raw)
+    vin = []
+    for tx_in in tx.txs_in:
+        if tx.is_coinbase():
+            _in = {'coinbase': _hex(tx_in.script)}
+        else:
+            _in = {
+                'txid': _hex(tx_in.previous_hash[::-1]),
+                'vout': tx_in.previous_index,
+                'scriptSig': {
+                    'asm': script_to_asm(tx_in.script, attempt_sighash_decode=True),
+                    'hex': _hex(tx_in.script)
+                }
+            }
+        if tx_in.witness:
+            _in['txinwitness'] = [_hex(w) for w in tx_in.witness]
+        _in['sequence'] = tx_in.sequence
+        vin.append(_in)
+    vout = []
+    for n, tx_out in enumerate(tx.txs_out):
+        vout.append({
+            'value': '{:.8f}'.format(tx_out.coin_value / 10**8),
+            'n': n,
+            'scriptPubKey': decode_script_pubkey(tx_out.script, network)
+        })
+    return {
+        'txid': tx.id(),
+        'hash': tx.w_id(),
+        'version': tx.version,
+        'size': len(raw),
+        'vsize': (base_size * 3 + len(raw) + 3) // 4,
+        'locktime': tx.lock_time,
+        'vin': vin,
+        'vout': vout,
+        'hex': _hex(raw)
+    }
+
+
+def serialize_transactions(transactions: List[Dict]) -> bytes:
+    """
+    json array of decoded transactions, values are emitted as fixed precision numbers
+    """
+    res = json.dumps(transactions)
+    return re.sub(r'"value": "(\d+(?:\.\d+)?)"', r'"value": \1', res).encode()
@@ -4,6 +4,7 @@ from spruned.daemon.zeromq import build_zmq
 
 def builder(ctx: Context):  # pragma: no cover
     from spruned.application.cache import CacheAgent
+    from spruned.application.prefetcher import BlocksPrefetcher
     from spruned.repositories.repository import Repository
     from spruned.daemon.tasks.blocks_reactor import BlocksReactor
     from spruned.daemon.tasks.headers_reactor import HeadersReactor
@@ -15,18 +16,23 @@ def builder(ctx: Context):  # pragma: no cover
     electrod_connectionpool, electrod_interface = electrod_builder(ctx)
     p2p_connectionpool, p2p_interface = p2p_builder(ctx)
     repository = Repository.instance()
-    cache = CacheAgent(repository, int(ctx.cache_size))
+    cache = CacheAgent(
+        repository, int(ctx.cache_size), compression=ctx.cache_compression, policy=ctx.cache_policy,
+        p2p=p2p_interface
+    )
     repository.set_cache(cache)
+    prefetcher = BlocksPrefetcher(repository, p2p_interface, cache_agent=cache, depth=ctx.prefetch_blocks)
     service = spruned_vo_service.SprunedVOService(
         electrod_interface,
         p2p_interface,
         repository=repository,
         cache_agent=cache,
-        context=ctx
+        context=ctx,
+        prefetcher=prefetcher
     )
     jsonrpc_server = JSONRPCServer(ctx.rpcbind, ctx.rpcport, ctx.rpcuser, ctx.rpcpassword)
     jsonrpc_server.set_vo_service(service)
-    headers_reactor = HeadersReactor(repository.headers, electrod_interface)
+    headers_reactor = HeadersReactor(repository.headers, electrod_interface, fast_sync=ctx.fast_sync)
 
     if ctx.mempool_size:
         from spruned.application.mempool_observer import MempoolObserver
@@ -1,4 +1,7 @@
 import asyncio
+import random
+from collections import deque
+from typing import Dict
 
 import aiohttp_socks
 import async_timeout
@@ -8,7 +11,7 @@ from spruned.application.logging_factory import Logger
 from spruned.application.tools import check_internet_connection, async_delayed_task
 from spruned.daemon import exceptions
 from spruned.daemon.bitcoin_p2p import save_p2p_peers
-from spruned.daemon.connection_base_impl import BaseConnection
+from spruned.daemon.connection_base_impl import BaseConnection, EWMA_ALPHA, get_percentile
 from spruned.daemon.connectionpool_base_impl import BaseConnectionPool
 from spruned.dependencies.pycoinnet.Peer import Peer
 from spruned.dependencies.pycoinnet.PeerEvent import PeerEvent
@@ -19,6 +22,17 @@ from spruned.dependencies.pycoinnet.pycoin.InvItem import ITEM_TYPE_TX
 from spruned.dependencies.pycoinnet.pycoin.bloom import BloomFilter, filter_size_required, hash_function_count_required
 from spruned.dependencies.pycoinnet.version import version_data_for_peer, NODE_NONE, NODE_WITNESS
 
+REFERENCE_BLOCK_SIZE = 1024 * 1024
+
+PRIORITY_PRIVILEGED = -1
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_CLASSES = {
+    PRIORITY_PRIVILEGED: 'privileged',
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_BACKGROUND: 'background'
+}
+
 
 def connector_f(host=None, port=None, proxy=None):
     if proxy:
@@ -26,9 +40,14 @@ def connector_f(host=None, port=None, proxy=None):
     return asyncio.open_connection(host=host, port=port)
 
 
+def batcher_f():
+    return InvBatcher(reserved_priority=PRIORITY_INTERACTIVE)
+
+
 class P2PConnection(BaseConnection):
     def ping(self, timeout=None):
-        self.peer.send_msg('ping', int(time.time()))
+        self._ping = (random.randint(0, 2**64 - 1), time.time())
+        self.peer.send_msg('ping', nonce=self._ping[0])
 
     def __init__(
             self, hostname, port, peer=Peer, network=MAINNET, loop=asyncio.get_event_loop(),
@@ -62,6 +81,8 @@ class P2PConnection(BaseConnection):
         self.version_checker = version_checker
         self.failed = False
         self._antispam = []
+        self._ping = None
+        self._throughput = None
 
     @property
     def proxy(self):
@@ -100,6 +121,25 @@ class P2PConnection(BaseConnection):
     def add_success(self):
         self._score += 1
 
+    def add_throughput(self, size: int, seconds: float):
+        throughput = size / max(seconds, 0.001)
+        self._throughput = throughput if self._throughput is None \
+            else self._throughput + EWMA_ALPHA * (throughput - self._throughput)
+
+    @property
+    def throughput(self) -> (None, float):
+        return self._throughput
+
+    @property
+    def cost(self) -> (None, float):
+        """
+        expected seconds to deliver a reference block, None until a block is delivered:
+        the ping latency alone is not comparable with the cost of the peers serving blocks.
+        """
+        if not self._throughput:
+            return
+        return (self._latency or 0) + REFERENCE_BLOCK_SIZE / self._throughput
+
     async def connect(self):
         try:
             async with async_timeout.timeout(self._timeout):
@@ -172,6 +212,7 @@ class P2PConnection(BaseConnection):
         self.peer_event_handler.set_request_callback('addr', self._on_addr)
         self.peer_event_handler.set_request_callback('alert', self._on_alert)
         self.peer_event_handler.set_request_callback('ping', self._on_ping)
+        self.peer_event_handler.set_request_callback('pong', self._on_pong)
         self.peer_event_handler.set_request_callback('sendheaders', self._dummy_handler)
         self.peer_event_handler.set_request_callback('feefilter', self._dummy_handler)
         self.peer_event_handler.set_request_callback('sendcmpct', self._dummy_handler)
@@ -215,6 +256,11 @@ class P2PConnection(BaseConnection):
         except:
             Logger.p2p.exception('Exception on ping')
 
+    def _on_pong(self, event_handler, name, data):
+        if self._ping and data.get('nonce') == self._ping[0]:
+            self.add_latency(time.time() - self._ping[1])
+            self._ping = None
+
     async def _process_inv(self, event_handler, name, data):
         txs = 0
         for item in data.get('items'):
@@ -243,7 +289,7 @@ class P2PConnectionPool(BaseConnectionPool):
             proxy=False,
             connections=3,
             sleep_no_internet=30,
-            batcher=InvBatcher,
+            batcher=batcher_f,
             network=MAINNET,
             batcher_timeout=20,
             ipv6=False,
@@ -260,6 +306,10 @@ class P2PConnectionPool(BaseConnectionPool):
         self._batcher_factory = batcher
         self._network = network
         self._batcher_timeout = batcher_timeout
+        self._batcher = None
+        self._batcher_peers = dict()
+        self._fetch_stats = dict()
+        self._fetch_latencies = dict()
         self._busy_peers = set()
         self.servers_storage = servers_storage
         self._storage_lock = asyncio.Lock()
@@ -342,14 +392,21 @@ class P2PConnectionPool(BaseConnectionPool):
                     self.loop.create_task(self._connect_peer(host, port))
             elif len(self.established_connections) > self._required_connections:
                 Logger.p2p.warning('Too many connections')
-                connection = self._pick_connection()
+                connection = self._get_slowest_connection() or self._pick_connection()
                 self.loop.create_task(connection.disconnect())
+            else:
+                connection = self._get_slowest_connection()
+                if connection:
+                    Logger.p2p.info('Rotating out slow peer %s (%.2fs)', connection.hostname, connection.cost)
+                    self.loop.create_task(connection.disconnect())
             #Logger.p2p.debug(
             #    'P2PConnectionPool: Sleeping %ss, connected to %s peers', 10, len(self.established_connections)
             #)
             for connection in self._connections:
                 if connection.score <= 0:
                     self.loop.create_task(self._disconnect_peer(connection))
+                elif connection.connected:
+                    connection.ping()
             await asyncio.sleep(10)
 
     async def _disconnect_peer(self, peer):
@@ -380,54 +437,104 @@ class P2PConnectionPool(BaseConnectionPool):
         for callback in self._on_block_callback:
             connection.add_on_blocks_callback(callback)
 
-    async def get(self, inv_item: InvItem, peers=None, timeout=None, privileged=False):
-        batcher = self._batcher_factory()
-        connections = []
+    def _get_batcher(self):
+        if not self._batcher:
+            self._batcher = self._batcher_factory()
+            self._batcher.add_on_batch_callback(self._on_batch_done)
+            self._batcher.add_on_hedge_win_callback(lambda *_: self.hedges.on_win())
+        return self._batcher
+
+    async def _sync_batcher_peers(self):
+        """
+        keeps the peers of the pool batcher in line with the established connections
+        """
+        batcher = self._get_batcher()
+        connections = {connection.peer_event_handler: connection for connection in self.established_connections}
+        for peer in [peer for peer in self._batcher_peers if peer not in connections]:
+            batcher.remove_peer(peer)
+            self._batcher_peers.pop(peer)
+        for peer, connection in connections.items():
+            if peer not in self._batcher_peers:
+                Logger.p2p.debug('Adding connection %s to batcher', connection.hostname)
+                self._batcher_peers[peer] = connection
+                await batcher.add_peer(peer)
+        return batcher
+
+    def _on_batch_done(self, peer, completed: int, failed: int, batch_time: float, size: int):
+        connection = self._batcher_peers.get(peer)
+        if not connection:
+            return
+        completed and connection.add_success()
+        failed and connection.add_error()
+        size and connection.add_throughput(size, batch_time)
+
+    def _track_fetch(self, priority: int, elapsed: float, failed: bool):
+        stats = self._fetch_stats.setdefault(
+            priority, {'requests': 0, 'failures': 0, 'total_time': 0, 'max_time': 0}
+        )
+        stats['requests'] += 1
+        stats['failures'] += int(failed)
+        stats['total_time'] += elapsed
+        stats['max_time'] = max(stats['max_time'], elapsed)
+        failed or self._fetch_latencies.setdefault(priority, deque(maxlen=100)).append(elapsed)
+
+    def get_fetch_info(self) -> Dict:
+        return {
+            PRIORITY_CLASSES[priority]: {
+                'requests': stats['requests'],
+                'failures': stats['failures'],
+                'avg_time': round(stats['total_time'] / stats['requests'], 4),
+                'max_time': round(stats['max_time'], 4)
+            } for priority, stats in sorted(self._fetch_stats.items())
+        }
+
+    async def _wait_hedged(self, batcher, inv_item: InvItem, future: asyncio.Future, priority: int):
+        """
+        an item slower than the p95 latency of its priority class is hedged on another peer, within the budget.
+        the first peer delivering it wins, the batcher drops the other request.
+        """
+        self.hedges.on_request()
+        delay = get_percentile(self._fetch_latencies.get(priority, ()), 95)
+        if delay is not None and len(self._batcher_peers) > 1:
+            done, _ = await asyncio.wait([future], timeout=delay)
+            if not done and self.hedges.allow() and await batcher.hedge(inv_item):
+                Logger.p2p.debug('Hedging InvItem %s', inv_item)
+                self.hedges.on_hedge()
+        return await future
+
+    async def prioritize(self, inv_item: InvItem, priority: int):
+        self._batcher and await self._batcher.prioritize(inv_item, priority)
+
+    async def get(self, inv_item: InvItem, peers=None, timeout=None, privileged=False, priority=PRIORITY_INTERACTIVE):
+        """
+        items are fetched by the pool batcher, shared by all the requests and living as long as the pool:
+        established connections are registered once and keep their adaptive batch size between requests.
+        the queue is ordered by priority class, privileged first and background last, and each peer keeps
+        a batch slot reserved to the interactive requests.
+        """
         s = time.time()
-        Logger.p2p.debug('Fetching InvItem %s', inv_item)
+        priority = PRIORITY_PRIVILEGED if privileged else priority
+        Logger.p2p.debug('Fetching InvItem %s (%s)', inv_item, PRIORITY_CLASSES[priority])
         future = None
+        response = None
         try:
             async with async_timeout.timeout(timeout if timeout is not None else self._batcher_timeout):
-                connections = privileged and self._pick_privileged_connections(
-                    peers if peers is not None else (2 if len(self.established_connections) >= 2 else 1)
-                ) or []
-                connections = connections or self._pick_multiple_connections(
-                    peers if peers is not None else (2 if len(self.established_connections) >= 2 else 1)
-                )
-                for connection in connections:
-                    Logger.p2p.debug('Adding connection %s to batcher', connection.hostname)
-                    await batcher.add_peer(connection.peer_event_handler)
-                future = await batcher.inv_item_to_future(inv_item)
-                response = await future
+                batcher = await self._sync_batcher_peers()
+                if not self._batcher_peers:
+                    raise exceptions.NoPeersException
+                future = await batcher.inv_item_to_future(inv_item, priority=priority)
+                response = await self._wait_hedged(batcher, inv_item, future, priority)
                 Logger.p2p.debug('InvItem %s fetched in %ss', inv_item, round(time.time() - s, 4))
-                for connection in connections:
-                    connection.add_success()
                 return response and response
         except asyncio.TimeoutError as error:
-            for connection in connections:
-                connection.add_error()
             Logger.p2p.debug(
                 'Error in get InvItem %s, error: %s, failed in %ss from peers %s',
                 inv_item, str(error), round(time.time() - s, 4),
-                ', '.join(['{} ({})'.format(x.hostname, len(x.errors)) for x in connections])
+                ', '.join(['{} ({})'.format(x.hostname, len(x.errors)) for x in self._batcher_peers.values()])
             )
             future and future.cancel()
         finally:
-            try:
-                _ = [self._busy_peers.remove(connection.hostname) for connection in connections]
-                del connections
-            except KeyError as e:
-                Logger.p2p.debug('Peer %s already removed from busy peers', str(e))
-
-            def del_batcher(_b):
-                try:
-                    _b.stop()
-                    del _b._inv_item_future_queue
-                    del _b._inv_item_hash_to_future[str(inv_item)]
-                except:
-                    del _b
-
-            self.loop.run_in_executor(None, lambda: del_batcher(batcher))
+            self._track_fetch(priority, time.time() - s, not response)
 
     async def on_peer_connected(self, peer):
         Logger.p2p.debug('on_peer_connected: %s', peer.hostname)
@@ -441,12 +548,7 @@ class P2PConnectionPool(BaseConnectionPool):
             self._storage_lock.release()
 
     async def get_from_connection(self, connection, inv_item):
-        batcher = self._batcher_factory()
-        await batcher.add_peer(connection.peer_event_handler)
-        future = None
-        try:
-            future = await batcher.inv_item_to_future(inv_item)
-            response = await future
-            return response
-        finally:
-            future and future.cancel()
+        """
+        asks the item to a given connection, the response is delivered to the connection callbacks
+        """
+        connection.peer_event_handler.send_msg("getdata", items=[inv_item])
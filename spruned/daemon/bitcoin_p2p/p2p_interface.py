@@ -8,14 +8,14 @@ from spruned.dependencies.pycoinnet.pycoin.InvItem import InvItem, ITEM_TYPE_SEG
 from spruned.dependencies.pycoinnet.networks import MAINNET
 from spruned.application import exceptions
 from spruned.daemon.bitcoin_p2p import utils
-from spruned.daemon.bitcoin_p2p.p2p_connection import P2PConnectionPool
+from spruned.daemon.bitcoin_p2p.p2p_connection import P2PConnectionPool, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
 
 
 class P2PInterface:
     def __init__(self,
                  connection_pool: P2PConnectionPool, loop=asyncio.get_event_loop(),
                  network=MAINNET, peers_bootstrapper=utils.dns_bootstrap_servers,
-                 mempool_repository=None):
+                 mempool_repository=None, blocks_per_peer=16):
         self.pool = connection_pool
         self._on_connect_callbacks = []
         self.loop = loop
@@ -23,40 +23,101 @@ class P2PInterface:
         self._bootstrap_status = 0
         self.peers_bootstrapper = peers_bootstrapper
         self.mempool = mempool_repository
+        self._inflight_blocks = {}
+        self._inflight_priorities = {}
+        self._blocks_per_peer = blocks_per_peer
 
     async def on_connect(self):
         for callback in self._on_connect_callbacks:
             self.loop.create_task(callback())
 
-    async def get_block(self, blockhash: str, peers=None, timeout=None, privileged_peers=False, segwit=True) -> Dict:
+    async def get_block(
+            self, blockhash: str, peers=None, timeout=None, privileged_peers=False, segwit=True,
+            priority=PRIORITY_INTERACTIVE
+    ) -> Dict:
+        """
+        concurrent requests of the same block share a single download, and the same block dict:
+        the first save_block parses and stores it, the next ones find it already saved.
+        a request of a higher priority class joining a download moves it up in the pool queue.
+        """
+        key = (blockhash, segwit)
+        future = self._inflight_blocks.get(key)
+        if future:
+            Logger.p2p.debug('Block %s already downloading' % blockhash)
+            if priority < self._inflight_priorities.get(key, priority):
+                self._inflight_priorities[key] = priority
+                await self.pool.prioritize(self._get_inv_item(blockhash, segwit), priority)
+        else:
+            future = asyncio.ensure_future(self._get_block(
+                blockhash, peers=peers, timeout=timeout, privileged_peers=privileged_peers, segwit=segwit,
+                priority=priority
+            ))
+            self._inflight_blocks[key] = future
+            self._inflight_priorities[key] = priority
+
+            def done(_):
+                self._inflight_blocks.pop(key, None)
+                self._inflight_priorities.pop(key, None)
+            future.add_done_callback(done)
+        return await asyncio.shield(future)
+
+    @staticmethod
+    def _get_inv_item(blockhash: str, segwit: bool) -> InvItem:
+        return InvItem(segwit and ITEM_TYPE_SEGWIT_BLOCK or ITEM_TYPE_BLOCK, h2b_rev(blockhash))
+
+    async def _get_block(
+            self, blockhash: str, peers=None, timeout=None, privileged_peers=False, segwit=True,
+            priority=PRIORITY_INTERACTIVE
+    ) -> Dict:
         Logger.p2p.debug('Downloading block %s' % blockhash)
-        block_type = segwit and ITEM_TYPE_SEGWIT_BLOCK or ITEM_TYPE_BLOCK
-        inv_item = InvItem(block_type, h2b_rev(blockhash))
-        response = await self.pool.get(inv_item, peers=peers, timeout=timeout, privileged=privileged_peers)
+        inv_item = self._get_inv_item(blockhash, segwit)
+        response = await self.pool.get(
+            inv_item, peers=peers, timeout=timeout, privileged=privileged_peers, priority=priority
+        )
         return response and {
             "block_hash": str(blockhash),
             "header_bytes": response[:80],
             "block_bytes": response
         }
 
-    async def get_blocks(self, *blockhash: str) -> Dict:
+    async def get_blocks(
+            self, *blockhash: str, on_block: callable = None, max_retry=100, priority=PRIORITY_BACKGROUND
+    ) -> Dict:
         """
-        I have to work on pycoinnet to understand how the invbatcher can handle a more efficient 'getblocks'.
-        Meanwhile, parallelize getblocks. This may be dirty, let's try it....
+        downloads the blocks in a sliding window, <blocks_per_peer> blocks for each established connection.
+        the pool batcher hands different blocks to different peers, sizing each peer batch by its throughput and
+        moving stalled blocks to other peers: as soon as a block is downloaded the next one enters the window,
+        failed ones go back in line.
+        on_block is called with each block, as it arrives, and the block is not retained: the returned dict then
+        maps the block hash to None.
+        bulk downloads are background work by default.
         """
         Logger.p2p.debug('Downloading blocks %s' % ', '.join(blockhash))
-        sorted_hash = [x for x in blockhash]
+        pending = [x for x in blockhash]
         blocks = {}
-        r, max_retry = 0, 100
-        while sorted_hash:
-            r += 1
-            if r > max_retry:
-                raise ValueError
-            _blocks = await asyncio.gather(*(self.get_block(h) for h in sorted_hash), return_exceptions=True)
-            for i, _hash in enumerate(sorted_hash):
-                if isinstance(_blocks[i], dict):
-                    blocks[_hash] = _blocks[i]
-            sorted_hash = [h for h in sorted_hash if h not in blocks]
+        failures = {}
+        inflight = {}
+        try:
+            while pending or inflight:
+                window = self._blocks_per_peer * max(1, len(self.pool.established_connections))
+                while pending and len(inflight) < window:
+                    _hash = pending.pop(0)
+                    inflight[asyncio.ensure_future(self.get_block(_hash, priority=priority))] = _hash
+                done, _ = await asyncio.wait(list(inflight), return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    _hash = inflight.pop(future)
+                    block = not future.cancelled() and not future.exception() and future.result()
+                    if isinstance(block, dict):
+                        blocks[_hash] = None if on_block else block
+                        on_block and on_block(block)
+                        continue
+                    failures[_hash] = failures.get(_hash, 0) + 1
+                    if failures[_hash] >= max_retry:
+                        raise ValueError
+                    pending.append(_hash)
+        finally:
+            for future in inflight:
+                future.cancel()
         return blocks
 
     def add_on_connect_callback(self, callback):
@@ -88,3 +149,9 @@ class P2PInterface:
         return [
             peer for peer in self.pool.established_connections
         ]
+
+    def get_network_stats(self) -> Dict:
+        return {
+            'fetches': self.pool.get_fetch_info(),
+            'hedges': self.pool.hedges.get_info()
+        }
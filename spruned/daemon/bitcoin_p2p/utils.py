@@ -1,3 +1,5 @@
+import io
+
 import async_timeout
 import threading, queue
 from pycoin.block import Block
@@ -31,12 +33,15 @@ class AsyncBlockFactory:
         self.min_size = min_size
 
     @staticmethod
-    def getblock(data, q):
-        q.put(Block.from_bin(data))
+    def parse(data):
+        return Block.parse(io.BytesIO(data), include_offsets=True)
+
+    def getblock(self, data, q):
+        q.put(self.parse(data))
 
     async def get(self, block_bytes: bytes):
         if not self.min_size or len(block_bytes) <= self.min_size:
-            return Block.from_bin(block_bytes)
+            return self.parse(block_bytes)
         else:
             q = queue.Queue()
             thread = threading.Thread(target=self.getblock, args=(block_bytes, q))
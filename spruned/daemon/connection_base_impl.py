@@ -1,10 +1,20 @@
 import abc
 import asyncio
 import time
+from collections import deque
 from typing import Dict, List
 from spruned.application.tools import async_delayed_task
 from spruned.daemon.abstracts import ConnectionAbstract
 
+EWMA_ALPHA = 0.3
+
+
+def get_percentile(samples, percentile: int, min_samples=20) -> (None, float):
+    if len(samples) < min_samples:
+        return
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
 
 class BaseConnection(ConnectionAbstract, metaclass=abc.ABCMeta):
     def __init__(
@@ -34,6 +44,8 @@ class BaseConnection(ConnectionAbstract, metaclass=abc.ABCMeta):
         self._expire_errors_after = expire_errors_after
         self._is_online_checker = is_online_checker
         self.delayer = delayer
+        self._latency = None
+        self._latencies = dict()
 
     @property
     def proxy(self):
@@ -52,6 +64,31 @@ class BaseConnection(ConnectionAbstract, metaclass=abc.ABCMeta):
     def add_success(self):
         self._score += 1
 
+    def add_latency(self, seconds: float, method: str = None):
+        """
+        every sample feeds the connection latency, the <method> ones also the method percentiles
+        """
+        self._latency = seconds if self._latency is None else self._latency + EWMA_ALPHA * (seconds - self._latency)
+        if method:
+            self._latencies.setdefault(method, deque(maxlen=100)).append(seconds)
+
+    @property
+    def latency(self) -> (None, float):
+        return self._latency
+
+    def get_latency_p95(self, method: str) -> (None, float):
+        """
+        over the last 100 <method> calls, None until 20 are collected
+        """
+        return get_percentile(self._latencies.get(method, ()), 95)
+
+    @property
+    def cost(self) -> (None, float):
+        """
+        expected seconds to serve a request, None until measured
+        """
+        return self._latency
+
     def is_online(self):
         if self._is_online_checker is not None:
             return self._is_online_checker()
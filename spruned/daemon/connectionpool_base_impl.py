@@ -1,8 +1,10 @@
 import abc
 import asyncio
+import bisect
+import itertools
 import random
 import time
-from typing import List
+from typing import Dict, List
 
 from spruned.application.logging_factory import Logger
 from spruned.application.tools import check_internet_connection, async_delayed_task
@@ -10,6 +12,40 @@ from spruned.daemon import exceptions
 from spruned.daemon.abstracts import ConnectionPoolAbstract, ConnectionAbstract
 
 
+class HedgeBudget:
+    """
+    hedged requests are capped to <ratio> of the requests, plus a small burst.
+    a win is a hedged request answered first by the second connection.
+    """
+    def __init__(self, ratio=0.05, burst=5):
+        self.ratio = ratio
+        self.burst = burst
+        self.requests = 0
+        self.hedged = 0
+        self.wins = 0
+
+    def on_request(self):
+        self.requests += 1
+
+    def allow(self) -> bool:
+        return self.hedged < self.requests * self.ratio + self.burst
+
+    def on_hedge(self):
+        self.hedged += 1
+
+    def on_win(self):
+        self.wins += 1
+
+    def get_info(self) -> Dict:
+        return {
+            'requests': self.requests,
+            'hedged': self.hedged,
+            'wins': self.wins,
+            'hedge_rate': self.requests and round(self.hedged / self.requests, 4),
+            'win_rate': self.hedged and round(self.wins / self.hedged, 4)
+        }
+
+
 class BaseConnectionPool(ConnectionPoolAbstract, metaclass=abc.ABCMeta):
     def __init__(self,
                  peers=list(),
@@ -19,7 +55,9 @@ class BaseConnectionPool(ConnectionPoolAbstract, metaclass=abc.ABCMeta):
                  proxy=False,
                  connections=3,
                  sleep_no_internet=30,
-                 ipv6=False
+                 ipv6=False,
+                 exploration=0.1,
+                 hedge_budget=0.05
                  ):
         self._connections = []
         self._peers = peers
@@ -36,6 +74,8 @@ class BaseConnectionPool(ConnectionPoolAbstract, metaclass=abc.ABCMeta):
         self._sleep_on_no_internet_connectivity = sleep_no_internet
         self._keepalive = True
         self._ipv6 = ipv6
+        self._exploration = exploration
+        self.hedges = HedgeBudget(ratio=hedge_budget)
         self.starting_height = None
 
     @property
@@ -87,44 +127,60 @@ class BaseConnectionPool(ConnectionPoolAbstract, metaclass=abc.ABCMeta):
             else:
                 raise exceptions.NoServersException
 
+    def _get_connection_weights(self, connections: List[ConnectionAbstract]) -> List[float]:
+        """
+        connections are weighted by their measured cost, the ones not measured yet get the median
+        """
+        costs = sorted(connection.cost for connection in connections if connection.cost)
+        default = costs and costs[len(costs) // 2] or 1
+        return [1 / (connection.cost or default) for connection in connections]
+
+    def _pick_weighted_connection(self, connections: List[ConnectionAbstract]) -> ConnectionAbstract:
+        if random.random() < self._exploration:
+            return random.choice(connections)
+        cumulative = list(itertools.accumulate(self._get_connection_weights(connections)))
+        i = bisect.bisect(cumulative, random.random() * cumulative[-1])
+        return connections[min(i, len(connections) - 1)]
+
     def _pick_connection(self, fail_silent=False):
-        i = 0
-        while 1:
-            if self.established_connections:
-                connection = random.choice(self.established_connections)
-                if connection.connected and connection.score > 0:
-                    return connection
-                if ':' in connection.hostname and not self._ipv6:
-                    i += 1
-                    continue
-                i += 1
-                if i < 100:
-                    continue
-            if not fail_silent:
-                raise exceptions.NoPeersException
-            return
+        connections = [
+            connection for connection in self.established_connections if connection.connected and connection.score > 0
+        ]
+        if connections:
+            return self._pick_weighted_connection(connections)
+        if not fail_silent:
+            raise exceptions.NoPeersException
+
+    def pick_connection(self, fail_silent=False) -> (None, ConnectionAbstract):
+        """
+        an established connection, picked by cost as the pool calls do
+        """
+        return self._pick_connection(fail_silent=fail_silent)
 
     def _pick_multiple_connections(self, howmany: int, accept=2) -> List[ConnectionAbstract]:
         assert howmany >= 1
-        i = 0
-        connections = []
-        while 1:
-            if self.established_connections:
-                connection = self._pick_connection()
-                if connection in connections:
-                    i += 1
-                    if i > 100:
-                        if len(connections) >= accept:
-                            return connection
-                        raise exceptions.NoPeersException
-                    continue
-                connections.append(connection)
-                if len(connections) == howmany:
-                    return connections
-            i += 1
-            if i < 100:
-                continue
-            raise exceptions.NoPeersException
+        connections = [
+            connection for connection in self.established_connections if connection.connected and connection.score > 0
+        ]
+        picked = []
+        while connections and len(picked) < howmany:
+            connection = self._pick_weighted_connection(connections)
+            connections.remove(connection)
+            picked.append(connection)
+        if len(picked) == howmany or (picked and len(picked) >= accept):
+            return picked
+        raise exceptions.NoPeersException
+
+    def _get_slowest_connection(self, ratio=4) -> (None, ConnectionAbstract):
+        """
+        the connection costing more than <ratio> times the median one, if any
+        """
+        connections = sorted(
+            [connection for connection in self.established_connections if connection.cost],
+            key=lambda connection: connection.cost
+        )
+        if len(connections) >= 3 and connections[-1].cost > connections[len(connections) // 2].cost * ratio:
+            return connections[-1]
 
     def _pick_privileged_connections(self, howmany, accept=1) -> List[ConnectionAbstract]:
         connection = sorted([x for x in self.established_connections], key=lambda x: getattr(x, 'score'))
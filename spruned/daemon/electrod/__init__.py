@@ -48,6 +48,7 @@ def build(ctx, loop=asyncio.get_event_loop()):  # pragma: no cover
     from spruned.daemon.electrod.electrod_interface import ElectrodInterface
     from spruned.daemon.electrod.electrod_fee_estimation import EstimateFeeConsensusProjector, \
         EstimateFeeConsensusCollector
+    from spruned.daemon.electrod.electrod_unspents_cache import ScripthashUnspentsCache
     network = ctx.get_network()
     peers = load_electrum_servers(ctx)
     fees_collector = EstimateFeeConsensusCollector(consensus=ctx.get_network()['fees_consensus'])
@@ -63,7 +64,8 @@ def build(ctx, loop=asyncio.get_event_loop()):  # pragma: no cover
         electrod_pool,
         loop,
         fees_projector=EstimateFeeConsensusProjector(),
-        fees_collector=fees_collector
+        fees_collector=fees_collector,
+        unspents_cache=ScripthashUnspentsCache(electrod_pool, loop=loop)
     )
     electrod_interface.add_on_connected_callback(electrod_interface.bootstrap_collector)
     return electrod_pool, electrod_interface
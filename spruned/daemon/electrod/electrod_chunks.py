@@ -0,0 +1,211 @@
+import asyncio
+import binascii
+import hashlib
+import heapq
+import struct
+from typing import Dict, List
+
+from spruned.application.logging_factory import Logger
+from spruned.application.tools import bits_to_target
+from spruned.daemon import exceptions
+
+HEADER_SIZE = 80
+HEADER_STRUCT = struct.Struct('<I32s32sIII')
+
+
+def verify_merkle_branch(leaf: bytes, index: int, branch: List[str], root: str) -> bool:
+    """
+    electrum protocol 1.4 cp_height proof.
+    the leaf is a block hash in internal byte order, branch and root are hex strings as served by the server.
+    """
+    sha256 = hashlib.sha256
+    try:
+        res = leaf
+        for item in branch:
+            item = binascii.unhexlify(item)[::-1]
+            res = sha256(sha256(index & 1 and item + res or res + item).digest()).digest()
+            index >>= 1
+        return not index and res[::-1] == binascii.unhexlify(root)
+    except (binascii.Error, TypeError):
+        return False
+
+
+class HeadersChunkValidator:
+    """
+    Validates a whole Electrum headers chunk at once.
+
+    The chunk is unpacked in a single pass into packed header fields, then hashes,
+    proof of work, prev hash linkage and checkpoints are checked over the whole batch,
+    before any per-header dict is built.
+    """
+    def __init__(self, checkpoints: Dict[int, str]):
+        self._checkpoints = checkpoints
+        self._targets = {}
+
+    def _get_target(self, bits: int) -> int:
+        target = self._targets.get(bits)
+        if target is None:
+            target = self._targets[bits] = bits_to_target(bits)
+        return target
+
+    @staticmethod
+    def unpack(chunk: bytes) -> (List, List):
+        """
+        returns the unpacked fields (version, prev, merkle, time, bits, nonce) and the hashes,
+        both in internal byte order.
+        """
+        if len(chunk) % HEADER_SIZE:
+            raise exceptions.BrokenDataException('Chunk size is not a multiple of %s' % HEADER_SIZE)
+        sha256 = hashlib.sha256
+        view = memoryview(chunk)
+        hashes = [
+            sha256(sha256(view[i:i + HEADER_SIZE]).digest()).digest() for i in range(0, len(chunk), HEADER_SIZE)
+        ]
+        return list(HEADER_STRUCT.iter_unpack(chunk)), hashes
+
+    def validate(self, chunk: (str, bytes), starting_height: int, prev_block_hash: str = None) -> List[Dict]:
+        try:
+            chunk = isinstance(chunk, str) and binascii.unhexlify(chunk) or chunk
+        except (binascii.Error, TypeError) as e:
+            raise exceptions.BrokenDataException from e
+        fields, hashes = self.unpack(chunk)
+        if not fields:
+            return []
+        prevs = [f[1] for f in fields]
+        if prev_block_hash is not None and prevs[0] != binascii.unhexlify(prev_block_hash)[::-1]:
+            raise exceptions.NetworkHeadersInconsistencyException(
+                'Chunk at %s does not link to %s' % (starting_height, prev_block_hash)
+            )
+        if prevs[1:] != hashes[:-1]:
+            broken = next(i for i in range(1, len(prevs)) if prevs[i] != hashes[i - 1])
+            raise exceptions.NetworkHeadersInconsistencyException(
+                'Broken prev hash linkage at height %s' % (starting_height + broken)
+            )
+        get_target = self._get_target
+        for i, (f, h) in enumerate(zip(fields, hashes)):
+            if int.from_bytes(h, 'little') > get_target(f[4]):
+                raise exceptions.NetworkHeadersInconsistencyException(
+                    'Invalid POW at height %s' % (starting_height + i)
+                )
+        ending_height = starting_height + len(fields)
+        for height, blockhash in self._checkpoints.items():
+            if starting_height <= height < ending_height and \
+                    hashes[height - starting_height][::-1] != binascii.unhexlify(blockhash):
+                raise exceptions.NetworkHeadersInconsistencyException(
+                    'Checkpoint failure. Expected: %s, Failure: %s' % (
+                        blockhash, binascii.hexlify(hashes[height - starting_height][::-1]).decode()
+                    )
+                )
+        hexlify = binascii.hexlify
+        return [
+            {
+                'version': f[0],
+                'prev_block_hash': hexlify(f[1][::-1]).decode(),
+                'merkle_root': hexlify(f[2][::-1]).decode(),
+                'timestamp': f[3],
+                'bits': f[4],
+                'nonce': f[5],
+                'block_hash': hexlify(h[::-1]).decode(),
+                'block_height': starting_height + i,
+                'header_bytes': chunk[i * HEADER_SIZE:(i + 1) * HEADER_SIZE]
+            } for i, (f, h) in enumerate(zip(fields, hashes))
+        ]
+
+
+class HeadersChunksPipeline:
+    """
+    Downloads a range of headers chunks from many servers at once.
+
+    download: every idle connection is given the next chunk, so up to a chunk per connection is in flight.
+    validate: chunks are validated as they arrive (by the interface) and parked until their turn.
+    commit: parked chunks are handed to <commit> in height order, each one must link to the previous one.
+    A failed chunk goes back to the queue and is retried on another server, if any.
+    """
+    def __init__(self, interface, max_retries=5, buffered_chunks_per_connection=2):
+        self.interface = interface
+        self.max_retries = max_retries
+        self.buffered_chunks_per_connection = buffered_chunks_per_connection
+
+    async def run(self, starts_from: int, ends_to: int, commit: callable, prev_block_hash: str = None):
+        """
+        fetch the chunks from <starts_from> to <ends_to> (excluded), <commit> is called with the
+        headers of each chunk, in order.
+        """
+        next_chunk, next_commit = starts_from, starts_from
+        retries = []
+        in_flight = {}  # future: (chunk_index, connection)
+        parked = {}  # chunk_index: (connection, headers)
+        failures = {}  # chunk_index: [connections]
+        try:
+            while next_commit < ends_to:
+                connections = self.interface.get_peers()
+                busy = [c for _, c in in_flight.values()]
+                idle = [c for c in connections if c not in busy]
+                max_buffered = max(1, len(connections)) * self.buffered_chunks_per_connection
+                while idle and (retries or next_chunk < ends_to) and len(in_flight) + len(parked) < max_buffered:
+                    if retries:
+                        chunk_index = heapq.heappop(retries)
+                    else:
+                        chunk_index, next_chunk = next_chunk, next_chunk + 1
+                    failed = failures.get(chunk_index, [])
+                    connection = next((c for c in idle if c not in failed), None)
+                    if connection is None:
+                        if any(c not in failed for c in connections):
+                            # wait for a server that didn't fail this chunk yet
+                            heapq.heappush(retries, chunk_index)
+                            break
+                        connection = idle[0]
+                    idle.remove(connection)
+                    future = asyncio.ensure_future(
+                        self.interface.get_headers_from_chunk(chunk_index, get_peer=True, connection=connection)
+                    )
+                    in_flight[future] = (chunk_index, connection)
+                if not in_flight:
+                    raise exceptions.NoPeersException
+                done, _ = await asyncio.wait(list(in_flight), return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    chunk_index, connection = in_flight.pop(future)
+                    try:
+                        response = future.result()
+                    except (
+                        exceptions.NetworkHeadersInconsistencyException,
+                        exceptions.ElectrodMissingResponseException,
+                        exceptions.NoPeersException,
+                        exceptions.BrokenDataException,
+                        asyncio.TimeoutError,
+                        ConnectionError
+                    ) as e:
+                        Logger.electrum.debug('Error fetching chunk %s from %s: %r', chunk_index, connection, e)
+                        response = None
+                    if response and response[1]:
+                        parked[chunk_index] = connection, response[1]
+                    else:
+                        self._on_chunk_failure(chunk_index, connection, failures, retries)
+
+                while next_commit in parked:
+                    connection, headers = parked.pop(next_commit)
+                    if prev_block_hash and headers[0]['prev_block_hash'] != prev_block_hash:
+                        Logger.electrum.error(
+                            'Chunk %s from %s does not link to the previous chunk', next_commit, connection
+                        )
+                        self._on_chunk_failure(next_commit, connection, failures, retries)
+                        break
+                    try:
+                        commit(headers)
+                    except exceptions.HeadersInconsistencyException:
+                        await connection.disconnect()
+                        raise
+                    prev_block_hash = headers[-1]['block_hash']
+                    next_commit += 1
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    def _on_chunk_failure(self, chunk_index: int, connection, failures: Dict, retries: List):
+        failed = failures.setdefault(chunk_index, [])
+        failed.append(connection)
+        if len(failed) > self.max_retries:
+            Logger.electrum.error('Chunk %s failed %s times, giving up', chunk_index, len(failed))
+            raise exceptions.NoHeadersException
+        Logger.electrum.warning('Chunk %s failed on %s, retrying', chunk_index, connection)
+        heapq.heappush(retries, chunk_index)
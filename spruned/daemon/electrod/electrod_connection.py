@@ -1,4 +1,5 @@
 import asyncio
+import copy
 import os
 import binascii
 import time
@@ -13,7 +14,7 @@ from spruned.application.context import ctx
 from spruned.application.logging_factory import Logger
 from spruned.application.tools import async_delayed_task, check_internet_connection
 from spruned.daemon import exceptions
-from spruned.daemon.connection_base_impl import BaseConnection
+from spruned.daemon.connection_base_impl import BaseConnection, EWMA_ALPHA
 from spruned.daemon.connectionpool_base_impl import BaseConnectionPool
 from spruned.daemon.electrod import save_electrum_servers
 
@@ -40,6 +41,10 @@ class ElectrodConnection(BaseConnection):
             expire_errors_after=expire_errors_after
         )
         self.starting_height = None
+        self._scripthash_queue = None
+        self._on_scripthash_status = None
+        self._ping_latency = None
+        self.last_ping = 0
 
     @property
     def proxy(self):
@@ -88,19 +93,39 @@ class ElectrodConnection(BaseConnection):
             self.loop.create_task(callback(self))
 
     async def ping(self, timeout=2) -> (None, float):
+        self.last_ping = time.time()
         try:
             async with async_timeout.timeout(timeout):
                 now = time.time()
                 await self.client.RPC('server.ping')
-                return time.time() - now
+                latency = time.time() - now
+                self.add_latency(latency)
+                self._add_ping_latency(latency)
+                return latency
         except asyncio.TimeoutError:
+            self._add_ping_latency(timeout)
             return
 
+    def _add_ping_latency(self, seconds: float):
+        self._ping_latency = seconds if self._ping_latency is None \
+            else self._ping_latency + EWMA_ALPHA * (seconds - self._ping_latency)
+
+    @property
+    def cost(self) -> (None, float):
+        """
+        the ping round trip, None until pinged: the calls latency depends on the method, i.e. headers chunks
+        and large listunspents, and is not comparable between connections serving different calls.
+        """
+        return self._ping_latency
+
     async def rpc_call(self, method: str, args):
         try:
             async with async_timeout.timeout(self._timeout):
-                return await self.client.RPC(method, *args)
-        except asyncio.InvalidStateError:
+                now = time.time()
+                response = await self.client.RPC(method, *args)
+                self.add_latency(time.time() - now, method=method)
+                return response
+        except (asyncio.InvalidStateError, asyncio.CancelledError):
             raise
         except ElectrumErrorResponse as e:
             if e.args and isinstance(e.args[0], dict):
@@ -136,6 +161,32 @@ class ElectrodConnection(BaseConnection):
             Logger.electrum.error('queue poll failed')
             self.loop.create_task(self.delayer(self.on_error(e)))
 
+    async def subscribe_scripthash(self, scripthash: str, on_status: callable) -> (None, str):
+        """
+        subscribe the scripthash status, on_status(connection, scripthash, status) is called on changes.
+        notifications are routed by method: the first subscription opens the queue, the others are plain calls.
+        """
+        self._on_scripthash_status = on_status
+        async with async_timeout.timeout(self._timeout):
+            if not self._scripthash_queue:
+                future, self._scripthash_queue = self.client.subscribe('blockchain.scripthash.subscribe', scripthash)
+                self.loop.create_task(self._poll_scripthash_queue(self._scripthash_queue))
+            else:
+                future = self.client.RPC('blockchain.scripthash.subscribe', scripthash)
+            return await future
+
+    async def unsubscribe_scripthash(self, scripthash: str):
+        try:
+            async with async_timeout.timeout(self._timeout):
+                await self.client.RPC('blockchain.scripthash.unsubscribe', scripthash)
+        except Exception as e:
+            Logger.electrum.debug('unsubscribe %s on %s failed: %s', scripthash, self.hostname, e)
+
+    async def _poll_scripthash_queue(self, queue: asyncio.Queue):
+        while self.connected:
+            scripthash, status = await queue.get()
+            self._on_scripthash_status and self._on_scripthash_status(self, scripthash, status)
+
     async def disconnect(self):
         try:
             self.client.close()
@@ -171,6 +222,9 @@ class ElectrodConnectionPool(BaseConnectionPool):
         self.servers_storage = servers_storage
         self._storage_lock = asyncio.Lock()
         self.tor = tor
+        self._inflight_calls = {}
+        self.calls = 0
+        self.coalesced_calls = 0
 
     @property
     def proxy(self):
@@ -195,14 +249,33 @@ class ElectrodConnectionPool(BaseConnectionPool):
                 self.loop.create_task(self._connect_servers(missings))
             elif missings < 0:
                 Logger.electrum.warning('Too many peers.')
-                connection = self._pick_connection(fail_silent=True)
+                connection = self._get_slowest_connection() or self._pick_connection(fail_silent=True)
                 self.loop.create_task(connection.disconnect())
             elif not self._connection_notified:
                 for observer in self._on_connect_observers:
                     self.loop.create_task(observer())
                 self._connection_notified = True
+            else:
+                await self._ping_connections()
+                connection = self._get_slowest_connection()
+                if connection:
+                    Logger.electrum.info('Rotating out slow peer %s (%.2fs)', connection.hostname, connection.cost)
+                    self.loop.create_task(connection.disconnect())
             await asyncio.sleep(missings and 2 or 10)
 
+    async def _ping_connections(self):
+        """
+        the connections cost is sampled pinging them, once every keepalive interval
+        """
+        now = time.time()
+        connections = [
+            connection for connection in self.established_connections
+            if now - connection.last_ping > self._connections_keepalive_time
+        ]
+        connections and await asyncio.gather(
+            *(connection.ping() for connection in connections), return_exceptions=True
+        )
+
     async def _connect_servers(self, howmany: int):
         peers = self._pick_multiple_peers(howmany)
         peers and Logger.electrum.debug('Connecting to peers (%s)', howmany)
@@ -224,7 +297,52 @@ class ElectrodConnectionPool(BaseConnectionPool):
             Logger.electrum.debug('Created client instance: %s', peer[0])
             self.loop.create_task(instance.connect())
 
-    async def call(self, method, *params, agreement=1, get_peer=False, fail_silent=False) -> (None, Dict):
+    async def call(
+            self, method, *params, agreement=1, get_peer=False, fail_silent=False, connection=None
+    ) -> (None, Dict):
+        """
+        call <method> on a random connection, or on <connection> if provided.
+        concurrent identical calls, not bound to a connection, share the same in-flight request:
+        each caller gets its own copy of the response.
+        """
+        self.calls += 1
+        key = not connection and (method, params, agreement, get_peer, fail_silent)
+        try:
+            inflight = key and self._inflight_calls.get(key)
+        except TypeError:
+            key = inflight = None
+        if inflight:
+            self.coalesced_calls += 1
+            Logger.electrum.debug(
+                'call %s coalesced, %s of %s calls saved', method, self.coalesced_calls, self.calls
+            )
+            return self._copy_response(await asyncio.shield(inflight), get_peer)
+        future = asyncio.ensure_future(
+            self._call(method, *params, agreement=agreement, get_peer=get_peer, fail_silent=fail_silent,
+                       connection=connection)
+        )
+        if key:
+            self._inflight_calls[key] = future
+            future.add_done_callback(lambda _: self._inflight_calls.pop(key, None))
+            return self._copy_response(await asyncio.shield(future), get_peer)
+        return await asyncio.shield(future)
+
+    @staticmethod
+    def _copy_response(response, get_peer: bool):
+        if get_peer and response:
+            return response[0], copy.deepcopy(response[1])
+        return copy.deepcopy(response)
+
+    def get_calls_info(self) -> Dict:
+        return {
+            'calls': self.calls,
+            'coalesced_calls': self.coalesced_calls,
+            'inflight_calls': len(self._inflight_calls)
+        }
+
+    async def _call(
+            self, method, *params, agreement=1, get_peer=False, fail_silent=False, connection=None
+    ) -> (None, Dict):
         if get_peer and agreement > 1:
             raise ValueError('Error!')
         if agreement > self._required_connections:
@@ -249,13 +367,49 @@ class ElectrodConnectionPool(BaseConnectionPool):
                 if fail_silent:
                     return
                 raise
-        connection = self._pick_connection()
-        response = await connection.rpc_call(method, params)
+        if connection:
+            response = await connection.rpc_call(method, params)
+        else:
+            connection, response = await self._hedged_rpc_call(self._pick_connection(), method, params)
         if not response and not fail_silent:
             await self.on_peer_error(connection)
             raise exceptions.ElectrodMissingResponseException(connection)
         return (connection, response) if get_peer else response
 
+    async def _hedged_rpc_call(self, connection: ElectrodConnection, method: str, params):
+        """
+        a call slower than the connection p95 latency for its method is issued to a second connection, within
+        the hedge budget: the first response wins, the other call is cancelled. pings don't count.
+        """
+        self.hedges.on_request()
+        first = asyncio.ensure_future(connection.rpc_call(method, params))
+        delay = connection.get_latency_p95(method)
+        if delay is None:
+            return connection, await first
+        done, _ = await asyncio.wait([first], timeout=delay)
+        others = [c for c in self.established_connections if c is not connection and c.connected and c.score > 0]
+        if done or not others or not self.hedges.allow():
+            return connection, await first
+        self.hedges.on_hedge()
+        hedge_connection = self._pick_weighted_connection(others)
+        Logger.electrum.debug('Hedging call %s on %s', method, hedge_connection.hostname)
+        futures = {
+            first: connection,
+            asyncio.ensure_future(hedge_connection.rpc_call(method, params)): hedge_connection
+        }
+        try:
+            while futures:
+                done, _ = await asyncio.wait(list(futures), return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    _connection = futures.pop(future)
+                    if future.exception() is None and future.result() is not None:
+                        _connection is hedge_connection and self.hedges.on_win()
+                        return _connection, future.result()
+            return connection, await first
+        finally:
+            for future in futures:
+                future.cancel()
+
     @staticmethod
     def _handle_responses(responses) -> Dict:
         if len(responses) == 1:
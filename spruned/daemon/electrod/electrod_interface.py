@@ -6,9 +6,11 @@ from spruned.application.exceptions import InvalidPOWException
 from spruned.application.logging_factory import Logger
 from spruned.daemon import exceptions
 from spruned.application.tools import blockheader_to_blockhash, deserialize_header, serialize_header, verify_pow
+from spruned.daemon.electrod.electrod_chunks import HeadersChunkValidator, verify_merkle_branch
 from spruned.daemon.electrod.electrod_connection import ElectrodConnectionPool, ElectrodConnection
 from spruned.daemon.electrod.electrod_fee_estimation import EstimateFeeConsensusProjector, \
     EstimateFeeConsensusCollector
+from spruned.daemon.electrod.electrod_unspents_cache import ScripthashUnspentsCache
 
 
 class ElectrodInterface:
@@ -16,15 +18,18 @@ class ElectrodInterface:
                  connectionpool: ElectrodConnectionPool,
                  loop=asyncio.get_event_loop(),
                  fees_projector: EstimateFeeConsensusProjector = None,
-                 fees_collector: EstimateFeeConsensusCollector = None
+                 fees_collector: EstimateFeeConsensusCollector = None,
+                 unspents_cache: ScripthashUnspentsCache = None
                  ):
         self._network = ctx.get_network()
         self.pool = connectionpool
         self._checkpoints = self._network['checkpoints']
+        self._chunk_validator = HeadersChunkValidator(self._checkpoints)
         self.loop = loop
         self._fees_projector = fees_projector
         self._fees_collector = fees_collector
         self._collector_bootstrap = False
+        self._unspents_cache = unspents_cache
 
     async def bootstrap_collector(self):
         if not self._collector_bootstrap:
@@ -47,6 +52,10 @@ class ElectrodInterface:
     def is_pool_online(self):  # pragma: no cover
         return self.pool.is_online()
 
+    @property
+    def checkpoint_height(self) -> int:
+        return max(self._checkpoints)
+
     def _parse_header(self, electrum_header: Dict):
         if electrum_header.get('hex'):
             header_hex = electrum_header['hex']
@@ -126,6 +135,8 @@ class ElectrodInterface:
         return await self.pool.call('blockchain.address.listunspent', address)
 
     async def listunspents_by_scripthash(self, scripthash: str, get_peer=False, fail_silent=False):
+        if self._unspents_cache and not get_peer and not fail_silent:
+            return await self._unspents_cache.listunspents(scripthash)
         return await self.pool.call(
             'blockchain.scripthash.listunspent', scripthash, get_peer=get_peer, fail_silent=fail_silent
         )
@@ -133,8 +144,10 @@ class ElectrodInterface:
     async def getaddresshistory(self, scripthash: str):
         return await self.pool.call('blockchain.address.get_history', scripthash)
 
-    async def get_headers(self, height: int, count=2016, get_peer=False):
-        return await self.pool.call('blockchain.block.headers', height, count, get_peer=get_peer)
+    async def get_headers(self, height: int, count=2016, get_peer=False, connection=None):
+        return await self.pool.call(
+            'blockchain.block.headers', height, count, get_peer=get_peer, connection=connection
+        )
 
     async def get_merkleproof(self, txid: str, block_height: int):
         return await self.pool.call('blockchain.transaction.get_merkle', txid, block_height)
@@ -178,39 +191,54 @@ class ElectrodInterface:
             Logger.electrum.error('Fee estimation error', exc_info=True)
             raise exceptions.MissingResponseException
 
-    async def get_headers_from_chunk(self, chunk_index: int, get_peer=True):
+    async def get_headers_from_chunk(self, chunk_index: int, get_peer=True, connection=None):
         peer = None
         if get_peer:
-            res = await self.get_headers(chunk_index * 2016, get_peer=get_peer)
+            res = await self.get_headers(chunk_index * 2016, get_peer=get_peer, connection=connection)
             peer, chunk = res if res else (None, None)
         else:
-            chunk = await self.get_headers(chunk_index * 2016, get_peer=get_peer)
+            chunk = await self.get_headers(chunk_index * 2016, get_peer=get_peer, connection=connection)
 
         if not chunk or not 'hex' in chunk:
             return
 
-        chunk = chunk['hex']
-
         try:
-            hex_headers = [chunk[i:i + 160] for i in range(0, len(chunk), 160)]
-        except TypeError as e:
-            raise exceptions.BrokenDataException from e
-        headers = []
-        for i, header_hex in enumerate(hex_headers):
-            header = deserialize_header(header_hex)
-            header['block_height'] = int(chunk_index * 2016 + i)
-            header['header_bytes'] = binascii.unhexlify(header_hex)
-            header['block_hash'] = header.pop('hash')
-            if header['block_height'] in self._checkpoints:
-                if self._checkpoints[header['block_height']] != header['block_hash']:
-                    await peer.disconnect()
-                    raise exceptions.NetworkHeadersInconsistencyException(
-                        'Checkpoint failure. Expected: %s, Failure: %s',
-                        self._checkpoints[header['block_height']], header['block_hash']
-                    )
-            headers.append(header)
+            headers = self._chunk_validator.validate(chunk['hex'], chunk_index * 2016)
+        except (exceptions.NetworkHeadersInconsistencyException, exceptions.BrokenDataException):
+            Logger.electrum.error('Invalid chunk %s from peer %s', chunk_index, peer, exc_info=True)
+            peer and await peer.disconnect()
+            raise
         return get_peer and (peer, headers) or headers
 
+    async def get_headers_with_checkpoint_proof(self, starts_from: int, count: int, cp_height: int = None):
+        """
+        protocol 1.4 headers with a cp_height proof: the last header of the batch is proven against
+        the merkle root of all the block hashes up to the checkpoint.
+        returns (peer, headers, root)
+        """
+        cp_height = self.checkpoint_height if cp_height is None else cp_height
+        peer, response = await self.pool.call(
+            'blockchain.block.headers', starts_from, count, cp_height, get_peer=True
+        )
+        if not response or 'hex' not in response or 'root' not in response:
+            return
+        try:
+            headers = self._chunk_validator.validate(response['hex'], starts_from)
+            if len(headers) != count or not verify_merkle_branch(
+                binascii.unhexlify(headers[-1]['block_hash'])[::-1],
+                headers[-1]['block_height'],
+                response.get('branch', []),
+                response['root']
+            ):
+                raise exceptions.NetworkHeadersInconsistencyException(
+                    'Invalid checkpoint proof for headers %s-%s' % (starts_from, starts_from + count - 1)
+                )
+        except exceptions.NetworkHeadersInconsistencyException:
+            Logger.electrum.error('Invalid checkpoint headers from peer %s', peer, exc_info=True)
+            await peer.disconnect()
+            raise
+        return peer, headers, response['root']
+
     async def start(self):
         self.loop.create_task(self.pool.connect())
 
@@ -224,3 +252,12 @@ class ElectrodInterface:
         return [
             peer for peer in self.pool.established_connections
         ]
+
+    def get_network_stats(self) -> Dict:
+        stats = {
+            'calls': self.pool.get_calls_info(),
+            'hedges': self.pool.hedges.get_info()
+        }
+        if self._unspents_cache:
+            stats['unspents_cache'] = {'hits': self._unspents_cache.hits, 'misses': self._unspents_cache.misses}
+        return stats
@@ -0,0 +1,93 @@
+import asyncio
+from collections import OrderedDict
+from typing import Dict, List
+
+from spruned.application.logging_factory import Logger
+
+
+class ScripthashUnspentsCache:
+    """
+    listunspent results, by scripthash.
+    each cached scripthash is subscribed on a single pool connection: an entry is served until its status
+    notification changes, or the connection is lost. subscriptions are bounded, least recently used out first.
+    listunspent is asked to the connection holding the subscription, so a cached result always matches the
+    status it is invalidated by. if that connection fails the call, the subscriptions are dropped and moved to
+    another connection by the next call, the failed call is served uncached by the pool.
+    """
+    def __init__(self, pool, max_subscriptions: int = 1000, loop=asyncio.get_event_loop()):
+        self.pool = pool
+        self.max_subscriptions = max_subscriptions
+        self.loop = loop
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._entries = OrderedDict()
+        self._inflight = dict()
+
+    def _get_connection(self):
+        if not self._connection or not self._connection.connected:
+            self._entries.clear()
+            self._connection = self.pool.pick_connection(fail_silent=True)
+        return self._connection
+
+    def on_status(self, connection, scripthash: str, status: (None, str)):
+        entry = self._entries.get(scripthash)
+        if not entry or connection is not self._connection or entry['status'] == status:
+            return
+        Logger.electrum.debug('Scripthash %s status changed, dropping cached unspents', scripthash)
+        entry.update({'status': status, 'unspents': None, 'version': entry['version'] + 1})
+
+    async def _subscribe(self, connection, scripthash: str) -> Dict:
+        entry = {'status': None, 'unspents': None, 'version': 0}
+        self._entries[scripthash] = entry
+        try:
+            entry['status'] = await connection.subscribe_scripthash(scripthash, self.on_status)
+        except Exception as e:
+            Logger.electrum.debug('Error subscribing scripthash %s: %s', scripthash, e)
+            self._entries.pop(scripthash, None)
+            return
+        while len(self._entries) > self.max_subscriptions:
+            _scripthash, _ = self._entries.popitem(last=False)
+            self.loop.create_task(connection.unsubscribe_scripthash(_scripthash))
+        return entry
+
+    def _drop_connection(self, connection):
+        if connection is not self._connection:
+            return
+        Logger.electrum.debug('listunspent failed on %s, dropping subscriptions', connection.hostname)
+        if connection.connected:
+            for scripthash in self._entries:
+                self.loop.create_task(connection.unsubscribe_scripthash(scripthash))
+        self._entries.clear()
+        self._connection = None
+
+    async def _fetch(self, connection, scripthash: str) -> (None, List[Dict]):
+        key = connection, scripthash
+        future = self._inflight.get(key)
+        if not future:
+            future = self._inflight[key] = asyncio.ensure_future(
+                connection.rpc_call('blockchain.scripthash.listunspent', (scripthash,)), loop=self.loop
+            )
+            future.add_done_callback(lambda f: self._inflight.pop(key, None))
+        return await asyncio.shield(future, loop=self.loop)
+
+    async def listunspents(self, scripthash: str) -> (None, List[Dict]):
+        connection = self._get_connection()
+        entry = connection and self._entries.get(scripthash)
+        if entry and entry['unspents'] is not None:
+            self._entries.move_to_end(scripthash)
+            self.hits += 1
+            return entry['unspents']
+        self.misses += 1
+        if not connection:
+            return await self.pool.call('blockchain.scripthash.listunspent', scripthash)
+        entry = entry or await self._subscribe(connection, scripthash)
+        version = entry and entry['version']
+        unspents = await self._fetch(connection, scripthash)
+        if unspents is None:
+            self._drop_connection(connection)
+            return await self.pool.call('blockchain.scripthash.listunspent', scripthash)
+        if isinstance(unspents, list) and entry and entry['version'] == version \
+                and self._entries.get(scripthash) is entry:
+            entry['unspents'] = unspents
+        return unspents
@@ -93,7 +93,9 @@ class BlocksReactor:
             height_to_start = height_to_start if height_to_start >= 0 else 0
             urgent = True
 
-        headers = self.repo.headers.get_headers_since_height(height_to_start, limit=self._max_per_batch)
+        headers = self.repo.headers.get_headers_since_height(
+            height_to_start, limit=self._keep_blocks if urgent else self._max_per_batch
+        )
 
         _local_blocks_indexes = {
             k: v for k, v in {
@@ -105,33 +107,39 @@ class BlocksReactor:
         _request = [
             x['block_hash'] for x in headers if x['block_hash'] not in _local_blocks_indexes.keys()
         ]
+        stored = set(_local_blocks_indexes)
         if _request:
-            blocks = await self.interface.get_blocks(*_request)
-            urgent = urgent or False
+            def save_block(block):
+                self.repo.blockchain.save_block(block)
+                stored.add(block['block_hash'])
+                Logger.p2p.debug('Saved block %s', block['block_hash'])
+                self._set_last_stored_block(headers, stored)
+
             try:
-                sorted_values = sorted(blocks.values(), key=lambda x: x['block_hash'])
-                saved_blocks = self.repo.blockchain.save_blocks(*sorted_values)
-                last_hash = saved_blocks and saved_blocks[-1]['block_hash']
-                Logger.p2p.debug('Saved block %s', saved_blocks)
-            except:
-                Logger.p2p.warning('Error saving blocks %s', blocks)
+                await self.interface.get_blocks(*_request, on_block=save_block)
+            except Exception as e:
+                Logger.p2p.warning('Error fetching blocks %s: %s', _request, e)
                 return True
         else:
             urgent = True
-            last_hash = headers[-1]['block_hash']
-
-        if last_hash:
-            _headers_by_block_hash = {v['block_hash']: v for v in headers}
-            self.set_last_processed_block(
-                {
-                    'block_hash': last_hash,
-                    'block_height': _headers_by_block_hash[last_hash]['block_height']
-                }
-            )
-        else:
+        if not self._set_last_stored_block(headers, stored):
             urgent = True
         return urgent
 
+    def _set_last_stored_block(self, headers, stored) -> bool:
+        """
+        the last processed block moves along the headers, up to the first one not stored yet
+        """
+        last = None
+        for header in headers:
+            if header['block_hash'] not in stored:
+                break
+            last = header
+        last and self.set_last_processed_block(
+            {'block_hash': last['block_hash'], 'block_height': last['block_height']}
+        )
+        return bool(last)
+
     async def on_connected(self):
         self._available = True
         self.loop.create_task(self.check())
@@ -153,44 +161,30 @@ class BlocksReactor:
             for blockheader in headers:
                 if not self.repo.blockchain.get_block_index(blockheader['block_hash']):
                     missing_blocks.append(blockheader['block_hash'])
-            i = 0
-            while 1:
-                i += 1
-                if len(self.interface.pool.established_connections) - len(self.interface.pool._busy_peers) \
-                        < self.interface.pool.required_connections / 2:
+
+            def save_block(block):
+                missing_blocks.remove(block['block_hash'])
+                self.repo.blockchain.save_block(block)
+                Logger.p2p.info(
+                    'Bootstrap: saved block %s (%s/%s)',
+                    block['block_hash'],
+                    self._keep_blocks - len(missing_blocks),
+                    self._keep_blocks
+                )
+                status = float(100) / self._keep_blocks * (len(headers) - len(missing_blocks))
+                self.interface.set_bootstrap_status(status if status <= 100 else 100)
+
+            while missing_blocks:
+                if len(self.interface.pool.established_connections) < self.interface.pool.required_connections / 2:
                     Logger.p2p.debug('Missing peers. Waiting.')
                     await asyncio.sleep(20)
                     continue
-
-                status = float(100) / self._keep_blocks * (len(headers) - len(missing_blocks))
-                status = status if status <= 100 else 100
-                self.interface.set_bootstrap_status(status)
-                missing_blocks = missing_blocks[::-1]
-                blocks_per_round = min([int(len(self.interface.pool.established_connections)*0.5), len(missing_blocks)])
-                _blocks = missing_blocks and [missing_blocks[i] for i in range(0, blocks_per_round)] or []
-                if not _blocks:
-                    Logger.p2p.info('Bootstrap: No blocks to fetch.')
-                    break
-                not i and Logger.p2p.info('Bootstrap: Fetching %s blocks', len(_blocks))
-
-                async def save_block(blockhash):
-                    block = (await asyncio.gather(
-                        self.interface.get_block(blockhash, peers=1, timeout=10),
-                        return_exceptions=True
-                    ))[0]
-                    if block and isinstance(block, dict):
-                        missing_blocks.remove(block['block_hash'])
-                        Logger.p2p.info(
-                            'Bootstrap: saved block %s (%s/%s)',
-                            block['block_hash'],
-                            self._keep_blocks - len(missing_blocks),
-                            self._keep_blocks
-                        )
-                        self.repo.blockchain.save_block(block)
-                    else:
-                        Logger.p2p.debug('Failed downloading block %s, retrying', blockhash)
-
-                futures = [save_block(blockhash) for blockhash in _blocks]
-                await asyncio.gather(*futures, return_exceptions=True)
+                Logger.p2p.info('Bootstrap: Fetching %s blocks', len(missing_blocks))
+                try:
+                    await self.interface.get_blocks(*missing_blocks, on_block=save_block)
+                except Exception as e:
+                    Logger.p2p.debug('Bootstrap: failed downloading blocks (%s), retrying', e)
+                    await asyncio.sleep(5)
+            Logger.p2p.info('Bootstrap: No blocks to fetch.')
         finally:
             self.lock.release()
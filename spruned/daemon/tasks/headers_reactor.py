@@ -1,7 +1,8 @@
 import asyncio
-from typing import Dict
+from typing import Dict, List
 import time
 from spruned.application.abstracts import HeadersRepository
+from spruned.daemon.electrod.electrod_chunks import HeadersChunksPipeline
 from spruned.daemon.electrod.electrod_connection import ElectrodConnection
 from spruned.daemon.electrod.electrod_interface import ElectrodInterface
 from spruned.daemon import exceptions
@@ -22,7 +23,9 @@ class HeadersReactor:
             loop=asyncio.get_event_loop(),
             store_headers=True,
             delayed_task=async_delayed_task,  # asyncio testing...  :/
-            sleep_time_on_inconsistency=20
+            sleep_time_on_inconsistency=20,
+            fast_sync=False,
+            chunks_pipeline: HeadersChunksPipeline = None
     ):
         self.repo = repo
         self.interface = interface
@@ -41,6 +44,11 @@ class HeadersReactor:
         self.on_best_height_hit_volatile_callbacks = []
         self.on_best_height_hit_persistent_callbacks = []
         self._on_new_best_header_callbacks = []
+        self.fast_sync = fast_sync
+        self.chunks_pipeline = chunks_pipeline or HeadersChunksPipeline(interface)
+        self.backfill_interval = 1
+        self._backfilling = False
+        self._checkpoint_root = None
 
     def add_on_new_header_callback(self, callback):
         self._on_new_best_header_callbacks.append(callback)
@@ -66,6 +74,84 @@ class HeadersReactor:
     async def on_connected(self):
         if self.store_headers:
             self.loop.create_task(self.check_headers())
+            self._start_backfill()
+
+    def _start_backfill(self):
+        if self._backfilling:
+            return
+        lowest_header = self.repo.get_lowest_header()
+        if lowest_header and lowest_header['block_height']:
+            self._backfilling = True
+            self.loop.create_task(self.backfill_headers())
+
+    async def _fetch_checkpoint_headers(self, starts_from: int) -> List[Dict]:
+        """
+        fetch the headers from <starts_from> to the newest checkpoint, with the checkpoint merkle proof.
+        the checkpoint root is kept to verify the backfilled chunks.
+        """
+        cp_height = self.interface.checkpoint_height
+        response = await self.interface.get_headers_with_checkpoint_proof(starts_from, cp_height - starts_from + 1)
+        if not response:
+            raise exceptions.NoHeadersException
+        _, headers, self._checkpoint_root = response
+        return headers
+
+    async def _fast_sync_anchor(self, network_best_header: Dict) -> (None, Dict):
+        """
+        checkpoint anchored sync: on an empty db, save only the headers of the newest checkpoint chunk,
+        up to the checkpoint, and let the usual chunks sync go from there.
+        older headers are backfilled lazily.
+        """
+        cp_height = self.interface.checkpoint_height
+        if network_best_header['block_height'] <= cp_height:
+            return
+        headers = await self._fetch_checkpoint_headers(get_nearest_parent(cp_height, 2016))
+        self.repo.backfill_headers(headers)
+        Logger.electrum.info(
+            'Fast sync: anchored to checkpoint %s (%s), older headers are backfilled in background',
+            cp_height, headers[-1]['block_hash']
+        )
+        self._start_backfill()
+        return self.repo.get_best_header()
+
+    async def backfill_headers(self):
+        """
+        download a chunk of headers below the lowest saved header, then reschedule itself until genesis.
+        each chunk must link to the lowest saved header and prove itself against the checkpoint root.
+        """
+        lowest_header = self.repo.get_lowest_header()
+        if not lowest_header or not lowest_header['block_height']:
+            self._backfilling = False
+            lowest_header and Logger.electrum.info('Headers backfill completed')
+            return
+        ends_to = lowest_header['block_height']
+        starts_from = get_nearest_parent(ends_to - 1, 2016)
+        try:
+            if not self._checkpoint_root:
+                await self._fetch_checkpoint_headers(self.interface.checkpoint_height)
+            response = await self.interface.get_headers_with_checkpoint_proof(starts_from, ends_to - starts_from)
+            if not response:
+                raise exceptions.NoHeadersException
+            peer, headers, root = response
+            if root != self._checkpoint_root:
+                Logger.electrum.error('Checkpoint root mismatch from peer %s: %s, expected %s',
+                                      peer, root, self._checkpoint_root)
+                await self.interface.handle_peer_error(peer)
+                raise exceptions.NetworkHeadersInconsistencyException
+            self.repo.backfill_headers(headers)
+            Logger.electrum.debug('Backfilled headers %s - %s', starts_from, ends_to - 1)
+        except (
+                exceptions.NoQuorumOnResponsesException,
+                exceptions.NoPeersException,
+                exceptions.NoHeadersException,
+                exceptions.ElectrodMissingResponseException,
+                exceptions.NetworkHeadersInconsistencyException,
+                exceptions.HeadersInconsistencyException
+        ):
+            Logger.electrum.warning('Headers backfill error below %s, retrying in 30s', ends_to, exc_info=True)
+            self.loop.create_task(self.delayed_task(self.backfill_headers(), 30))
+            return
+        self.loop.create_task(self.delayed_task(self.backfill_headers(), self.backfill_interval))
 
     async def start(self):
         self.interface.add_header_subscribe_callback(self.on_new_header)
@@ -242,15 +328,16 @@ class HeadersReactor:
     async def on_local_headers_behind(self, local_best_header: Dict, network_best_header: Dict):
         MAX_SINGLE_HEADERS_BEFORE_USING_CHUNKS = 10
 
-        chunks_at_time = 1
         try:
+            if not local_best_header and self.fast_sync:
+                local_best_header = await self._fast_sync_anchor(network_best_header)
             if not local_best_header or \
                     local_best_header['block_height'] < network_best_header['block_height'] - \
                     MAX_SINGLE_HEADERS_BEFORE_USING_CHUNKS:
                 """
                 bootstrap or behind more than <N> headers
                 """
-                await self._fetch_headers_chunks(chunks_at_time, local_best_header, network_best_header)
+                await self._fetch_headers_chunks(local_best_header, network_best_header)
             elif local_best_header['block_height'] == network_best_header['block_height'] - 1:
                 """
                 behind 1 header
@@ -294,57 +381,29 @@ class HeadersReactor:
         self.set_last_processed_header(network_best_header)
         self.synced = True
 
-    async def _fetch_headers_chunks(self, chunks_at_time, local_best_header, network_best_header):
+    async def _fetch_headers_chunks(self, local_best_header, network_best_header):
         """
-        fetch chunks from local height to network best height, download <chunks_at_time> (>1 is unstable)
+        fetch chunks from local height to network best height through the chunks pipeline,
+        chunks are downloaded from many servers at once and saved in height order.
         """
-        i = 0
-        current_height = local_best_header and local_best_header['block_height'] or 0
-        saving_headers = []
-        while 1:
-            Logger.electrum.debug(
-                '%s headers behind, downloading',
-                network_best_header['block_height'] - current_height - len(saving_headers)
-
-            )
-            local_best_height = local_best_header and local_best_header['block_height'] or 0
-            rewind_from = get_nearest_parent(local_best_height, 2016) // 2016 + i
-            _from = rewind_from
-            _to = rewind_from + chunks_at_time
-            if _from > (network_best_header['block_height'] // 2016):
-                saved_headers = saving_headers and self.repo.save_headers(saving_headers) or []
-                saved_headers and self.set_last_processed_header(saved_headers[-1])
+        local_best_height = local_best_header and local_best_header['block_height'] or 0
+        starts_from = get_nearest_parent(local_best_height, 2016) // 2016
+        ends_to = network_best_header['block_height'] // 2016 + 1
+        Logger.electrum.debug(
+            '%s headers behind, downloading chunks %s - %s',
+            network_best_header['block_height'] - local_best_height, starts_from, ends_to - 1
+        )
 
-                self.synced = True
-                return
-            res = await self.interface.get_headers_in_range_from_chunks(_from, _to, get_peer=True)
-            peer, headers = res if res else (None, [])
-            if not headers:
-                raise exceptions.NoHeadersException
+        def commit(headers):
             if local_best_height:
-                saving_headers = saving_headers + [h for h in headers if h['block_height'] > local_best_height]
-            else:
-                saving_headers = saving_headers + headers
-            try:
-                if not i % 5:
-                    saved_headers = headers and self.repo.save_headers(saving_headers) or []
-                    saving_headers = []
-                else:
-                    saved_headers = []
-
-            except exceptions.HeadersInconsistencyException:
-                await peer.disconnect()
-                raise
-            Logger.electrum.debug(
-                'Fetched %s headers (chunk %s/%s), tot. %s',
-                len(headers), _from, _to, len(saving_headers)
-            )
+                headers = [h for h in headers if h['block_height'] > local_best_height]
+            saved_headers = headers and self.repo.ingest_headers(headers, check_pow=False)
             if saved_headers:
                 self.set_last_processed_header(saved_headers[-1])
-                current_height = self._last_processed_header['block_height']
-            elif saving_headers:
-                self.set_last_processed_header(None)
-            i += 1
+                Logger.electrum.debug('Saved headers up to %s', saved_headers[-1]['block_height'])
+
+        await self.chunks_pipeline.run(starts_from, ends_to, commit)
+        self.synced = True
 
     @database.atomic
     async def on_network_headers_behind(self, network_best_header: Dict, peer=None):
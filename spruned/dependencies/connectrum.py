@@ -338,6 +338,8 @@ class StratumClient:
 
         # it's a future which is done now
         req, rv = inf
+        if rv.cancelled():
+            return
         if 'error' in msg:
             err = msg['error']
 
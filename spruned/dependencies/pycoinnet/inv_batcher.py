@@ -24,6 +24,7 @@
 #
 
 import asyncio
+import itertools
 
 from spruned.application.tools import blockheader_to_blockhash
 from spruned.dependencies.pycoinnet.pycoin.InvItem import \
@@ -33,39 +34,87 @@ from spruned.dependencies.pycoinnet import logger
 
 
 class InvBatcher:
-    def __init__(self, target_batch_time=10, max_batch_size=500, inv_item_future_q_maxsize=1000):
+    def __init__(
+            self, target_batch_time=10, max_batch_size=500, inv_item_future_q_maxsize=1000, fetch_workers=8,
+            idle_peer_delay=1, reserved_priority=None, reserved_peer_delay=0.1
+    ):
+        """
+        with reserved_priority set, each peer gets an extra batch slot reserved to items with
+        priority <= reserved_priority. the reserved slots have their own fetch workers and are the only ones
+        taking those items, so they are never stuck behind the batches of lower priority items.
+        """
 
         self._is_closing = False
         self._inv_item_future_queue = asyncio.PriorityQueue(maxsize=inv_item_future_q_maxsize)
+        # ties between entries of the same item, e.g. a cancelled request and its retry, never compare the futures
+        self._sequence = itertools.count()
+        self._peer_epochs = dict()
+        self._epoch = 0
+        self._on_batch_callbacks = []
+        self._reserved_priority = reserved_priority
+        self._inv_item_priorities = dict()
+        self._inv_item_peers = dict()
+        self._hedged_inv_items = dict()
+        self._on_hedge_win_callbacks = []
+
+        def is_live(peer, epoch):
+            return self._peer_epochs.get(peer) == epoch
 
         async def batch_getdata_fetches(peer_batch_tuple, q):
-            peer, desired_batch_size = peer_batch_tuple
+            peer, desired_batch_size, epoch, max_priority = peer_batch_tuple
+            if not is_live(peer, epoch):
+                return
             batch = []
             skipped = []
             logger.info("peer %s trying to build batch up to size %d", peer, desired_batch_size)
             while len(batch) == 0 or (
                     len(batch) < desired_batch_size and not self._inv_item_future_queue.empty()):
+                if (skipped or max_priority is not None) and self._inv_item_future_queue.empty():
+                    break
                 item = await self._inv_item_future_queue.get()
-                (priority, inv_item, f, peers_tried) = item
+                (priority, _, inv_item, f, peers_tried) = item
                 if f.done():
                     continue
-                if peer in peers_tried:
+                if max_priority is not None and priority > max_priority:
+                    skipped.append(item)
+                    break
+                if max_priority is None and self._reserved_priority is not None \
+                        and priority <= self._reserved_priority:
+                    skipped.append(item)
+                    continue
+                if peer in peers_tried and not peers_tried.issuperset(self._peer_epochs):
                     skipped.append(item)
                 else:
                     batch.append(item)
-            if len(batch) > 0:
-                await q.put((peer, batch, desired_batch_size))
             for item in skipped:
-                if not item[2].done:
+                if not item[3].done():
                     await self._inv_item_future_queue.put(item)
+            if len(batch) > 0:
+                await q.put((peer, batch, desired_batch_size, epoch, max_priority))
+            else:
+                # nothing this slot can take: park it for a while
+                asyncio.get_event_loop().call_later(
+                    idle_peer_delay if max_priority is None else reserved_peer_delay,
+                    self._get_batch_queue(max_priority).put_nowait, peer_batch_tuple
+                )
 
         async def fetch_batch(peer_batch, q):
             loop = asyncio.get_event_loop()
-            peer, batch, prior_max = peer_batch
-            inv_items = [inv_item for (priority, inv_item, f, peers_tried) in batch]
-            peer.send_msg("getdata", items=inv_items)
+            peer, batch, prior_max, epoch, max_priority = peer_batch
+            inv_items = [inv_item for (priority, _, inv_item, f, peers_tried) in batch]
+            futures = [f for (priority, _, bh, f, peers_tried) in batch]
+            try:
+                peer.send_msg("getdata", items=inv_items)
+            except Exception as e:
+                logger.info("peer %s failed on getdata (%s), removing it", peer, e)
+                self.remove_peer(peer)
+                for item in batch:
+                    if not item[3].done():
+                        await self._inv_item_future_queue.put(item)
+                return
+            for inv_item in inv_items:
+                self._inv_item_peers.setdefault(str(inv_item), set()).add(peer)
             start_time = loop.time()
-            futures = [f for (priority, bh, f, peers_tried) in batch]
             await asyncio.wait(futures, timeout=target_batch_time)
             end_time = loop.time()
             batch_time = end_time - start_time
@@ -75,41 +124,103 @@ class InvBatcher:
             new_batch_size = min(prior_max * 4, int(target_batch_time * item_per_unit_time + 0.5))
             new_batch_size = min(max(1, new_batch_size), max_batch_size)
             logger.info("new batch size for %s is %d", peer, new_batch_size)
-            for (priority, inv_item, f, peers_tried) in batch:
+            for (priority, _, inv_item, f, peers_tried) in batch:
                 if not f.done():
                     peers_tried.add(peer)
-                    await self._inv_item_future_queue.put((priority, inv_item, f, peers_tried))
-            await self._peer_batch_queue.put((peer, new_batch_size))
+                    await self._inv_item_future_queue.put((priority, next(self._sequence), inv_item, f, peers_tried))
+            size = sum([len(f.result()) for f in futures if f.done() and not f.cancelled() and f.result()])
+            for callback in self._on_batch_callbacks:
+                callback(peer, completed_count, len(futures) - completed_count, batch_time, size)
+            if is_live(peer, epoch):
+                await self._get_batch_queue(max_priority).put((peer, new_batch_size, epoch, max_priority))
 
         self._peer_batch_queue = MappingQueue(
             dict(callback_f=batch_getdata_fetches),
-            dict(callback_f=fetch_batch, input_q_maxsize=2),
+            dict(callback_f=fetch_batch, input_q_maxsize=2, worker_count=fetch_workers),
         )
+        self._reserved_batch_queue = MappingQueue(
+            dict(callback_f=batch_getdata_fetches),
+            dict(callback_f=fetch_batch, input_q_maxsize=2, worker_count=fetch_workers),
+        ) if reserved_priority is not None else None
 
         self._inv_item_hash_to_future = dict()
 
+    def _get_batch_queue(self, max_priority):
+        return self._peer_batch_queue if max_priority is None else self._reserved_batch_queue
+
+    @property
+    def peers(self):
+        return list(self._peer_epochs)
+
+    def add_on_batch_callback(self, callback):
+        self._on_batch_callbacks.append(callback)
+
+    def add_on_hedge_win_callback(self, callback):
+        self._on_hedge_win_callbacks.append(callback)
+
     async def add_peer(self, peer, initial_batch_size=1):
+        if peer in self._peer_epochs:
+            return
+        self._epoch += 1
+        self._peer_epochs[peer] = self._epoch
         peer.set_request_callback("block", self.handle_block_event)
         peer.set_request_callback("merkleblock", self.handle_block_event)
-        await self._peer_batch_queue.put((peer, initial_batch_size))
-        await self._peer_batch_queue.put((peer, initial_batch_size))
+        await self._peer_batch_queue.put((peer, initial_batch_size, self._epoch, None))
+        await self._peer_batch_queue.put((peer, initial_batch_size, self._epoch, None))
+        if self._reserved_priority is not None:
+            await self._reserved_batch_queue.put((peer, initial_batch_size, self._epoch, self._reserved_priority))
+
+    def remove_peer(self, peer):
+        """
+        the peer batches already in flight complete, no new batches are built for it
+        """
+        self._peer_epochs.pop(peer, None)
+
+    async def prioritize(self, inv_item: InvItem, priority):
+        """
+        an item already queued with a lower priority is queued again: the first response resolves both
+        """
+        f = self._inv_item_hash_to_future.get(str(inv_item))
+        if f and not f.done() and priority < self._inv_item_priorities.get(str(inv_item), priority):
+            self._inv_item_priorities[str(inv_item)] = priority
+            await self._inv_item_future_queue.put((priority, next(self._sequence), inv_item, f, set()))
+
+    async def hedge(self, inv_item: InvItem) -> bool:
+        """
+        an item already sent to some peers is queued again once, for a different peer
+        """
+        f = self._inv_item_hash_to_future.get(str(inv_item))
+        peers = self._inv_item_peers.get(str(inv_item))
+        if not f or f.done() or not peers or str(inv_item) in self._hedged_inv_items:
+            return False
+        self._hedged_inv_items[str(inv_item)] = set(peers)
+        await self._inv_item_future_queue.put(
+            (self._inv_item_priorities[str(inv_item)], next(self._sequence), inv_item, f, set(peers))
+        )
+        return True
 
     async def inv_item_to_future(self, inv_item: InvItem, priority=0):
-        f = self._inv_item_hash_to_future.get(inv_item)
-        if not f:
+        f = self._inv_item_hash_to_future.get(str(inv_item))
+        if f and not f.done():
+            await self.prioritize(inv_item, priority)
+        else:
             f = asyncio.Future()
             self._inv_item_hash_to_future[str(inv_item)] = f
+            self._inv_item_priorities[str(inv_item)] = priority
 
             def remove_later(f):
 
                 def remove():
-                    if str(inv_item) in self._inv_item_hash_to_future:
+                    if self._inv_item_hash_to_future.get(str(inv_item)) is f:
                         del self._inv_item_hash_to_future[str(inv_item)]
+                        self._inv_item_priorities.pop(str(inv_item), None)
+                        self._inv_item_peers.pop(str(inv_item), None)
+                        self._hedged_inv_items.pop(str(inv_item), None)
 
                 asyncio.get_event_loop().call_later(5, remove)
 
             f.add_done_callback(remove_later)
-            item = (priority, inv_item, f, set())
+            item = (priority, next(self._sequence), inv_item, f, set())
             await self._inv_item_future_queue.put(item)
         return f
 
@@ -128,9 +239,15 @@ class InvBatcher:
             f = self._inv_item_hash_to_future[str(inv_item)]
             if not f.done():
                 f.set_result(block_bytes)
+                hedged_peers = self._hedged_inv_items.get(str(inv_item))
+                if hedged_peers is not None and peer not in hedged_peers:
+                    for callback in self._on_hedge_win_callbacks:
+                        callback(inv_item)
         else:
             logger.warning("missing future for block %s", block_hash)
 
     def stop(self):
         self._peer_batch_queue.stop()
+        if self._reserved_batch_queue:
+            self._reserved_batch_queue.stop()
 
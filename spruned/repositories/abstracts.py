@@ -29,9 +29,65 @@ class BlockchainRepositoryAbstract(metaclass=abc.ABCMeta):
         pass
 
     @abc.abstractmethod
-    def get_transaction(self, txid) -> (None, Dict):
+    def get_transaction(self, txid, record_access=True) -> (None, Dict):
+        pass
+
+    @abc.abstractmethod
+    def get_block_bytes(self, blockhash, record_access=True) -> (None, memoryview):
+        pass
+
+    @abc.abstractmethod
+    def save_decoded_transactions(self, blockhash, data: bytes, blocksize: int):
+        pass
+
+    @abc.abstractmethod
+    def get_decoded_transactions(self, blockhash) -> (bytes, int):
+        pass
+
+    @abc.abstractmethod
+    def get_block_object(self, blockhash):
+        pass
+
+    @abc.abstractmethod
+    def get_cached_block_object(self, blockhash):
+        pass
+
+    @abc.abstractmethod
+    def cache_block_object(self, blockhash, block_object, blocksize: int):
+        pass
+
+    @abc.abstractmethod
+    def get_cached_verbose_block(self, blockhash) -> (None, Dict):
+        pass
+
+    @abc.abstractmethod
+    def cache_verbose_block(self, blockhash, block: Dict):
+        pass
+
+    @abc.abstractmethod
+    def get_block_codec(self, blockhash) -> (None, int):
+        pass
+
+    @abc.abstractmethod
+    def save_compressed_block(self, blockhash, codec: int, data: bytes) -> (None, int):
         pass
 
     @abc.abstractmethod
     def remove_block(self, blockhash: str):
         pass
+
+    @abc.abstractmethod
+    def get_spend(self, txid, index: int) -> (None, Dict):
+        pass
+
+    @abc.abstractmethod
+    def save_confirmed_transaction(self, txid, transaction_bytes: bytes, blockhash, merkle_proof: Dict):
+        pass
+
+    @abc.abstractmethod
+    def get_confirmed_transaction(self, txid) -> (None, Dict):
+        pass
+
+    @abc.abstractmethod
+    def remove_confirmed_transaction(self, txid):
+        pass
@@ -0,0 +1,161 @@
+import lzma
+import mmap
+import os
+import struct
+import zlib
+
+from spruned.application.logging_factory import Logger
+
+BLOCK_LOCATION = struct.Struct('<IQIB')
+
+RAW, ZLIB, LZMA = 0, 1, 2
+CODECS = {
+    'zlib': ZLIB,
+    'lzma': LZMA
+}
+
+
+def compress(codec: int, data: bytes) -> bytes:
+    if codec == ZLIB:
+        return zlib.compress(data, 9)
+    elif codec == LZMA:
+        return lzma.compress(data)
+    raise ValueError('Unknown codec: %s' % codec)
+
+
+def decompress(codec: int, data: bytes) -> bytes:
+    if codec == ZLIB:
+        return zlib.decompress(data)
+    elif codec == LZMA:
+        return lzma.decompress(data)
+    raise ValueError('Unknown codec: %s' % codec)
+
+
+class BlockFiles:
+    """
+    append only storage of raw blocks.
+    blocks are written one after another into flat files, rotated once they exceed max_file_size.
+    the caller keeps the (file, offset, length, codec) location and reads back slices of the mmapped files,
+    compressed items are inflated on read.
+    """
+    FILE_NAME = 'blk%05d.dat'
+
+    def __init__(self, path: str, max_file_size: int = 128 * 1024 * 1024):
+        self.path = path
+        self.max_file_size = max_file_size
+        self._current = None
+        self._current_file = None
+        self._maps = {}
+        self._pending_removals = set()
+
+    @staticmethod
+    def pack_location(file_id: int, offset: int, length: int, codec: int = RAW) -> bytes:
+        return BLOCK_LOCATION.pack(file_id, offset, length, codec)
+
+    @staticmethod
+    def unpack_location(data: bytes) -> (int, int, int, int):
+        return BLOCK_LOCATION.unpack(data[:BLOCK_LOCATION.size])
+
+    def _file_path(self, file_id: int) -> str:
+        return os.path.join(self.path, self.FILE_NAME % file_id)
+
+    def get_files(self):
+        if not os.path.exists(self.path):
+            return []
+        files = []
+        for name in os.listdir(self.path):
+            if name.startswith('blk') and name.endswith('.dat'):
+                files.append(int(name[3:-4]))
+        return sorted(files)
+
+    def get_file_size(self, file_id: int) -> int:
+        try:
+            return os.path.getsize(self._file_path(file_id))
+        except FileNotFoundError:
+            return 0
+
+    @property
+    def current_file_id(self) -> int:
+        if self._current is None:
+            files = self.get_files()
+            self._current = files and files[-1] or 0
+        return self._current
+
+    def _get_writer(self):
+        if self._current_file is None:
+            os.makedirs(self.path, exist_ok=True)
+            self._current_file = open(self._file_path(self.current_file_id), 'ab')
+        if self._current_file.tell() >= self.max_file_size:
+            self._current_file.close()
+            self._current += 1
+            self._current_file = open(self._file_path(self._current), 'ab')
+            Logger.repository.debug('Rotated block files, now writing %s', self.FILE_NAME % self._current)
+            for file_id in sorted(self._pending_removals):
+                self.remove_file(file_id)
+        return self._current_file
+
+    def append(self, data: bytes) -> (int, int, int):
+        writer = self._get_writer()
+        self._pending_removals.discard(self._current)
+        offset = writer.tell()
+        writer.write(data)
+        writer.flush()
+        return self._current, offset, len(data)
+
+    def _get_map(self, file_id: int, end: int):
+        _map = self._maps.get(file_id)
+        if _map is None or len(_map) < end:
+            prev = _map
+            try:
+                with open(self._file_path(file_id), 'rb') as f:
+                    _map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (FileNotFoundError, ValueError):
+                return
+            self._maps[file_id] = _map
+            self._close_map(prev)
+        return _map
+
+    @staticmethod
+    def _close_map(_map):
+        try:
+            _map and _map.close()
+        except BufferError:
+            # slices still referenced, the mapping goes away with them
+            pass
+
+    def read(self, file_id: int, offset: int, length: int, codec: int = RAW) -> (None, memoryview, bytes):
+        _map = self._get_map(file_id, offset + length)
+        if _map is None or len(_map) < offset + length:
+            return
+        if codec != RAW:
+            return decompress(codec, _map[offset:offset + length])
+        return memoryview(_map)[offset:offset + length]
+
+    def remove_file(self, file_id: int):
+        """
+        the current file is removed once rotated, unless more blocks are appended to it meanwhile
+        """
+        if file_id == self.current_file_id:
+            self._pending_removals.add(file_id)
+            return False
+        self._pending_removals.discard(file_id)
+        self._close_map(self._maps.pop(file_id, None))
+        try:
+            os.remove(self._file_path(file_id))
+        except FileNotFoundError:
+            pass
+        Logger.repository.debug('Removed block file %s', self.FILE_NAME % file_id)
+        return True
+
+    def close(self):
+        self._current_file and self._current_file.close()
+        self._current_file = None
+        for _map in self._maps.values():
+            self._close_map(_map)
+        self._maps = {}
+
+    def erase(self):
+        self.close()
+        for file_id in self.get_files():
+            os.remove(self._file_path(file_id))
+        self._current = None
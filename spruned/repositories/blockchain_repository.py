@@ -1,4 +1,7 @@
 import binascii
+import io
+import struct
+from collections import OrderedDict
 from typing import Dict, List
 
 from pycoin.block import Block
@@ -7,21 +10,38 @@ from spruned.application.database import ldb_batch
 from spruned.application.logging_factory import Logger
 from spruned.daemon import exceptions
 from spruned.repositories.abstracts import BlockchainRepositoryAbstract
+from spruned.repositories.block_files import BlockFiles, BLOCK_LOCATION, RAW
+from spruned.repositories.hot_cache import HotCache, BLOCK_OBJECT, VERBOSE_BLOCK, BLOCK_BYTES, \
+    estimate_block_object_size, estimate_verbose_block_size
 
 TRANSACTION_PREFIX = b'\x00'
 BLOCK_INDEX_PREFIX = b'\x02'
 DB_VERSION = b'\x04'
+BLOCK_FILE_PREFIX = b'\x06'
+DECODED_TRANSACTIONS_PREFIX = b'\x08'
+CONFIRMED_TRANSACTION_PREFIX = b'\x0a'
+SPEND_PREFIX = b'\x0c'
+CONFIRMED_TRANSACTION = struct.Struct('<I32sIH')
 
 
 class BlockchainRepository(BlockchainRepositoryAbstract):
-    current_version = 3
+    current_version = 7
 
-    def __init__(self, session, storage_name, dbpath):
+    def __init__(
+            self, session, storage_name, dbpath, block_files: BlockFiles = None, hot_cache: HotCache = None,
+            confirmed_transactions_size: int = 16 * 1024 * 1024
+    ):
         self.storage_name = storage_name
         self.session = session
         self.dbpath = dbpath
+        self.block_files = block_files
+        self.hot_cache = hot_cache or HotCache()
+        self.confirmed_transactions_size = confirmed_transactions_size
+        self._confirmed_transactions = None
+        self._confirmed_transactions_total = 0
         self._cache = None
         self.volatile = {}
+        self.stored_watermark = None
 
     def erase(self):
         from spruned.application.database import init_ldb_storage, erase_ldb_storage
@@ -29,6 +49,9 @@ class BlockchainRepository(BlockchainRepositoryAbstract):
         from spruned.builder import cache
         self.session.close()
         erase_ldb_storage()
+        self.block_files.erase()
+        self.hot_cache.clear()
+        self._confirmed_transactions = None
         inject_attribute(
             init_ldb_storage(), 'session', self, cache
         )
@@ -44,6 +67,15 @@ class BlockchainRepository(BlockchainRepositoryAbstract):
     def set_cache(self, cache):
         self._cache = cache
 
+    def _record_access(self, blockhash: (None, bytes, str), hit: bool):
+        if not self._cache:
+            return
+        key = blockhash and self.get_key(blockhash, prefix=BLOCK_INDEX_PREFIX)
+        if hit:
+            self._cache.record_hit(key)
+        else:
+            self._cache.record_miss(key)
+
     def get_key(self, name: (bytes, str), prefix=b''):
         if isinstance(prefix, str):
             prefix = prefix.encode()
@@ -58,18 +90,29 @@ class BlockchainRepository(BlockchainRepositoryAbstract):
     @ldb_batch
     def save_block(self, block: Dict, tracker=None) -> Dict:
         block['size'] = len(block['block_bytes'])
-        block['block_object'] = block.get('block_object', Block.from_bin(block.get('block_bytes')))
-
+        block_object = block.get('block_object') or self.hot_cache.get(BLOCK_OBJECT, block['block_hash'])
+        if not block_object or (block_object.txs and not hasattr(block_object.txs[0], 'offset_in_block')):
+            block_object = Block.parse(io.BytesIO(block['block_bytes']), include_offsets=True)
+        block['block_object'] = block_object
+        self.cache_block_object(block['block_hash'], block_object, block['size'])
         blockhash = binascii.unhexlify(block['block_hash'].encode())
+        if self.get_block_index(blockhash):
+            return block
+        file_id, offset, length = self.block_files.append(block['block_bytes'])
         txids = list()
-        for transaction in block['block_object'].txs:
+        offsets = [tx.offset_in_block for tx in block_object.txs] + [length]
+        for i, transaction in enumerate(block_object.txs):
             self.save_transaction({
                 'txid': transaction.id(),
-                'transaction_bytes': transaction.as_bin(),
+                'location': (file_id, offset + offsets[i], offsets[i + 1] - offsets[i]),
                 'block_hash': blockhash
             })
             txids.append(binascii.unhexlify(transaction.id()))
-        self._save_block_index(blockhash, block['size'], txids)
+            transaction.is_coinbase() or self._save_spends(transaction, blockhash)
+        self._save_block_index(blockhash, (file_id, offset, length), length, txids)
+        self._incr_block_file_refs(file_id, 1, length)
+        if self.stored_watermark and self.stored_watermark['below_hash'] == block['block_hash']:
+            self.stored_watermark = None
         tracker and tracker.track(
             self.get_key(block['block_hash'], prefix=BLOCK_INDEX_PREFIX),
             len(block['block_bytes'])
@@ -77,10 +120,50 @@ class BlockchainRepository(BlockchainRepositoryAbstract):
         return block
 
     @ldb_batch
-    def _save_block_index(self, blockhash: bytes, blocksize: int, txids: List[bytes]):
+    def _save_block_index(self, blockhash: bytes, location: tuple, blocksize: int, txids: List[bytes]):
         key = self.get_key(blockhash, prefix=BLOCK_INDEX_PREFIX)
-        size = blocksize.to_bytes(4, 'little')
-        self.session.put(self.storage_name + b'.' + key, size + b''.join(txids))
+        self.session.put(
+            self.storage_name + b'.' + key,
+            BlockFiles.pack_location(*location) + blocksize.to_bytes(4, 'little') + b''.join(txids)
+        )
+
+    @staticmethod
+    def _unpack_block_index(block_index: bytes) -> (tuple, int, bytes):
+        location = BlockFiles.unpack_location(block_index)
+        size = int.from_bytes(block_index[BLOCK_LOCATION.size:BLOCK_LOCATION.size + 4], 'little')
+        return location, size, block_index[BLOCK_LOCATION.size + 4:]
+
+    def _get_block_file_refs_key(self, file_id: int) -> bytes:
+        return self.storage_name + b'.' + self.get_key(file_id.to_bytes(4, 'little'), prefix=BLOCK_FILE_PREFIX)
+
+    def _get_block_file_refs(self, file_id: int) -> (int, int):
+        """
+        blocks stored into a file, and their size in bytes
+        """
+        data = self.session.get(self._get_block_file_refs_key(file_id))
+        if not data:
+            return 0, 0
+        return int.from_bytes(data[:4], 'little'), int.from_bytes(data[4:12], 'little')
+
+    def _incr_block_file_refs(self, file_id: int, value: int, size: int) -> int:
+        key = self._get_block_file_refs_key(file_id)
+        refs, live = self._get_block_file_refs(file_id)
+        refs, live = refs + value, max(0, live + size)
+        if refs > 0:
+            self.session.put(key, refs.to_bytes(4, 'little') + live.to_bytes(8, 'little'))
+        else:
+            self.session.delete(key)
+        return refs
+
+    def remove_unreferenced_block_files(self):
+        """
+        block files with no stored blocks left, i.e. released while being written
+        """
+        for file_id in self.block_files.get_files():
+            if file_id != self.block_files.current_file_id and not self.session.get(
+                    self._get_block_file_refs_key(file_id)
+            ):
+                self.block_files.remove_file(file_id)
 
     def get_block_index(self, blockhash: str):
         key = self.get_key(blockhash, prefix=BLOCK_INDEX_PREFIX)
@@ -95,19 +178,19 @@ class BlockchainRepository(BlockchainRepositoryAbstract):
 
     @ldb_batch
     def save_transaction(self, transaction: Dict) -> Dict:
-        data = transaction['transaction_bytes'] + transaction['block_hash']
+        data = BlockFiles.pack_location(*transaction['location']) + transaction['block_hash']
         key = self.get_key(transaction['txid'], prefix=TRANSACTION_PREFIX)
         self.session.put(self.storage_name + b'.' + key, data)
         return transaction
 
-    def get_txids_by_block_hash(self, blockhash: str) -> (List[str], int):
+    def get_txids_by_block_hash(self, blockhash: str, record_access=True) -> (List[str], int):
         block_index = self.get_block_index(blockhash)
+        record_access and self._record_access(blockhash, bool(block_index))
         if not block_index:
             return [], None
         i = 0
         txids = []
-        size = block_index[:4]
-        block_index = block_index[4:]
+        _, size, block_index = self._unpack_block_index(block_index)
         while 1:
             txid = binascii.hexlify(block_index[i:i + 32]).decode()
             if not txid:
@@ -116,50 +199,310 @@ class BlockchainRepository(BlockchainRepositoryAbstract):
                 break
             txids.append(txid)
             i += 32
-        return txids, int.from_bytes(size, 'little')
+        return txids, size
 
     def get_transactions_by_block_hash(self, blockhash: str) -> (List[Dict], int):
         block_index = self.get_block_index(blockhash)
         if not block_index:
             return [], None
         i = 0
-        size = block_index[:4]
-        block_index = block_index[4:]
+        _, size, block_index = self._unpack_block_index(block_index)
         transactions = []
         while 1:
             txid = block_index[i:i+32]
             if not txid:
                 break
-            transaction = self.get_transaction(txid)
+            transaction = self.get_transaction(txid, record_access=False)
             if not transaction:
                 if transactions:
                     Logger.repository.warning('Corrupted storage for blockhash %s, deleting' % blockhash)
                     self.remove_block(blockhash)
+                    self._record_access(blockhash, False)
                     return [], None
                 break
             transactions.append(transaction)
             i += 32
-        return transactions, int.from_bytes(size, 'little')
+        self._record_access(blockhash, bool(transactions))
+        return transactions, size
+
+    def get_block_bytes(self, blockhash: (bytes, str), record_access=True) -> (None, memoryview, bytes):
+        """
+        a memoryview over the block file for raw blocks, the inflated bytes for compressed ones.
+        the read is reported to the cache agent, unless record_access is False.
+        """
+        block_index = self.get_block_index(blockhash)
+        location = block_index and BlockFiles.unpack_location(block_index)
+        data = location and location[3] != RAW and self.hot_cache.get(BLOCK_BYTES, blockhash)
+        if location and not data:
+            data = self.block_files.read(*location)
+            if data is not None and location[3] != RAW:
+                self.hot_cache.put(BLOCK_BYTES, blockhash, data, len(data))
+        if block_index and data is None:
+            Logger.repository.warning('Missing block file data for blockhash %s, deleting' % blockhash)
+            self.remove_block(blockhash)
+        record_access and self._record_access(blockhash, data is not None)
+        return data or None
 
-    def get_transaction(self, txid: (bytes, str)) -> (None, Dict):
+    def get_transaction(self, txid: (bytes, str), record_access=True) -> (None, Dict):
         key = self.get_key(txid, prefix=TRANSACTION_PREFIX)
         data = self.session.get(self.storage_name + b'.' + key)
         if not data:
+            record_access and self._record_access(None, False)
+            return
+        file_id, offset, length, codec = BlockFiles.unpack_location(data)
+        if codec == RAW:
+            transaction_bytes = self.block_files.read(file_id, offset, length)
+        else:
+            block_bytes = self.get_block_bytes(data[-32:], record_access=False)
+            transaction_bytes = block_bytes and memoryview(block_bytes)[offset:offset + length]
+        record_access and self._record_access(data[-32:], transaction_bytes is not None)
+        if transaction_bytes is None:
             return
         return {
-            'transaction_bytes': data[:-32],
+            'transaction_bytes': transaction_bytes,
             'block_hash': data[-32:],
             'txid': txid
         }
 
     @ldb_batch
     def remove_block(self, blockhash: str):
-        txids, size = self.get_txids_by_block_hash(blockhash)
+        block_index = self.get_block_index(blockhash)
+        if not block_index:
+            return
+        self.stored_watermark = None
+        txids, size = self.get_txids_by_block_hash(blockhash, record_access=False)
+        self._remove_spends(blockhash)
         for txid in txids:
             key = self.get_key(txid, prefix=TRANSACTION_PREFIX)
             self._remove_item(key)
         self._remove_item(self.get_key(blockhash, prefix=BLOCK_INDEX_PREFIX))
+        self._remove_item(self.get_key(blockhash, prefix=DECODED_TRANSACTIONS_PREFIX))
+        self.hot_cache.invalidate(blockhash)
+        file_id, _, length, _ = BlockFiles.unpack_location(block_index)
+        if not self._incr_block_file_refs(file_id, -1, -length):
+            self.block_files.remove_file(file_id)
+
+    @staticmethod
+    def _get_outpoint(txid: (bytes, str), index: int) -> bytes:
+        if isinstance(txid, str):
+            txid = binascii.unhexlify(txid.encode())
+        return txid + index.to_bytes(4, 'little')
+
+    @ldb_batch
+    def _save_spends(self, transaction, blockhash: bytes):
+        value = binascii.unhexlify(transaction.id()) + blockhash
+        for tx_in in transaction.txs_in:
+            key = self.get_key(self._get_outpoint(tx_in.previous_hash[::-1], tx_in.previous_index), SPEND_PREFIX)
+            self.session.put(self.storage_name + b'.' + key, value)
+
+    @ldb_batch
+    def _remove_spends(self, blockhash: str):
+        """
+        the spends of a removed block, unless the outpoint is recorded as spent by another block
+        """
+        block_object = self.hot_cache.get(BLOCK_OBJECT, blockhash)
+        if not block_object:
+            block_bytes = self.get_block_bytes(blockhash, record_access=False)
+            if block_bytes is None:
+                return
+            block_object = Block.parse(io.BytesIO(block_bytes), include_offsets=True)
+        blockhash = self.get_key(blockhash)
+        for transaction in block_object.txs:
+            if transaction.is_coinbase():
+                continue
+            for tx_in in transaction.txs_in:
+                spend = self.get_spend(tx_in.previous_hash[::-1], tx_in.previous_index)
+                if spend and spend['block_hash'] == blockhash:
+                    self._remove_item(
+                        self.get_key(self._get_outpoint(tx_in.previous_hash[::-1], tx_in.previous_index), SPEND_PREFIX)
+                    )
+
+    def get_spend(self, txid: (bytes, str), index: int) -> (None, Dict):
+        """
+        the transaction spending the outpoint, among the stored blocks, and its block
+        """
+        key = self.get_key(self._get_outpoint(txid, index), prefix=SPEND_PREFIX)
+        data = self.session.get(self.storage_name + b'.' + key)
+        return data and {'txid': data[:32], 'block_hash': data[32:]}
+
+    def get_cached_block_object(self, blockhash: (bytes, str)) -> (None, Block):
+        block_object = self.hot_cache.get(BLOCK_OBJECT, blockhash)
+        block_object and self._record_access(blockhash, True)
+        return block_object
+
+    def cache_block_object(self, blockhash: (bytes, str), block_object: Block, blocksize: int):
+        self.hot_cache.put(
+            BLOCK_OBJECT, blockhash, block_object, estimate_block_object_size(block_object, blocksize)
+        )
+
+    def get_block_object(self, blockhash: (bytes, str)) -> (None, Block):
+        """
+        the parsed block, shared through the hot cache or parsed from the stored bytes
+        """
+        block_object = self.get_cached_block_object(blockhash)
+        if block_object:
+            return block_object
+        block_bytes = self.get_block_bytes(blockhash)
+        if block_bytes is None:
+            return
+        block_object = Block.parse(io.BytesIO(block_bytes), include_offsets=True)
+        self.cache_block_object(blockhash, block_object, len(block_bytes))
+        return block_object
+
+    def get_cached_verbose_block(self, blockhash: (bytes, str)) -> (None, Dict):
+        block = self.hot_cache.get(VERBOSE_BLOCK, blockhash)
+        block and self._record_access(blockhash, True)
+        return block
+
+    def cache_verbose_block(self, blockhash: (bytes, str), block: Dict):
+        self.hot_cache.put(VERBOSE_BLOCK, blockhash, block, estimate_verbose_block_size(block))
+
+    @ldb_batch
+    def save_decoded_transactions(self, blockhash: (bytes, str), data: bytes, blocksize: int):
+        """
+        the serialized verbose transactions of a stored block, along with the block size.
+        charged to the block cache entry and dropped with the block.
+        """
+        if not self.get_block_index(blockhash):
+            return
+        key = self.storage_name + b'.' + self.get_key(blockhash, prefix=DECODED_TRANSACTIONS_PREFIX)
+        if self.session.get(key):
+            return
+        value = blocksize.to_bytes(4, 'little') + data
+        self.session.put(key, value)
+        self._cache and self._cache.charge(self.get_key(blockhash, prefix=BLOCK_INDEX_PREFIX), len(value))
+
+    def get_decoded_transactions(self, blockhash: (bytes, str)) -> (bytes, int):
+        key = self.get_key(blockhash, prefix=DECODED_TRANSACTIONS_PREFIX)
+        data = self.session.get(self.storage_name + b'.' + key)
+        if not data:
+            return None, None
+        self._record_access(blockhash, True)
+        return data[4:], int.from_bytes(data[:4], 'little')
+
+    def get_block_codec(self, blockhash: (bytes, str)) -> (None, int):
+        block_index = self.get_block_index(blockhash)
+        return block_index and BlockFiles.unpack_location(block_index)[3]
+
+    @ldb_batch
+    def save_compressed_block(self, blockhash: (bytes, str), codec: int, data: bytes) -> (None, int):
+        """
+        replace the raw copy of a stored block with its compressed version.
+        transactions entries then point into the block, by offset, and are sliced out of the inflated block.
+        """
+        block_index = self.get_block_index(blockhash)
+        if not block_index or BlockFiles.unpack_location(block_index)[3] != RAW:
+            return
+        return self._relocate_block(self.get_key(blockhash), block_index, codec, data)[2]
+
+    @ldb_batch
+    def _relocate_block(self, blockhash: bytes, block_index: bytes, codec: int, data: bytes) -> tuple:
+        """
+        append the block data to the current file, and move the block and its transactions entries there
+        """
+        (file_id, offset, length, _codec), size, txids = self._unpack_block_index(block_index)
+        location = self.block_files.append(data)
+        for i in range(0, len(txids), 32):
+            key = self.storage_name + b'.' + self.get_key(txids[i:i + 32], prefix=TRANSACTION_PREFIX)
+            _, tx_offset, tx_length, _ = BlockFiles.unpack_location(self.session.get(key))
+            tx_offset -= offset if _codec == RAW else 0
+            self.save_transaction({
+                'txid': txids[i:i + 32],
+                'location': (location[0], tx_offset + (location[1] if codec == RAW else 0), tx_length, codec),
+                'block_hash': blockhash
+            })
+        self._save_block_index(blockhash, location + (codec,), size, [txids])
+        self._incr_block_file_refs(location[0], 1, location[2])
+        if not self._incr_block_file_refs(file_id, -1, -length):
+            self.block_files.remove_file(file_id)
+        return location
+
+    def compact_block_files(self, max_dead_ratio: float = 0.5) -> int:
+        """
+        a block file is held on disk until every block in it is released, while recompressed blocks leave
+        their raw copy behind and kept blocks are never evicted.
+        the blocks still stored into files mostly made of released bytes are moved to the current file,
+        so the files are removed.
+        """
+        files = set()
+        for file_id in self.block_files.get_files():
+            if file_id == self.block_files.current_file_id:
+                continue
+            size = self.block_files.get_file_size(file_id)
+            if size - self._get_block_file_refs(file_id)[1] > size * max_dead_ratio:
+                files.add(file_id)
+        if not files:
+            return 0
+        moved = 0
+        prefix = self.storage_name + b'.' + BLOCK_INDEX_PREFIX + b'.'
+        for key, block_index in list(self.session.iterator(prefix=prefix)):
+            file_id, offset, length, codec = BlockFiles.unpack_location(block_index)
+            if file_id not in files:
+                continue
+            data = self.block_files.read(file_id, offset, length)
+            if data is None:
+                continue
+            self._relocate_block(key[len(prefix):], block_index, codec, bytes(data))
+            moved += 1
+        Logger.repository.info('Compacted %s block files, %s blocks moved', len(files), moved)
+        return moved
 
     @ldb_batch
     def _remove_item(self, key):
         self.session.delete(self.storage_name + b'.' + key)
+
+    def _load_confirmed_transactions(self):
+        self._confirmed_transactions = OrderedDict()
+        self._confirmed_transactions_total = 0
+        prefix = self.storage_name + b'.' + CONFIRMED_TRANSACTION_PREFIX + b'.'
+        for key, value in self.session.iterator(prefix=prefix):
+            self._confirmed_transactions[key[len(prefix):]] = len(value)
+            self._confirmed_transactions_total += len(value)
+
+    @ldb_batch
+    def save_confirmed_transaction(
+            self, txid: (bytes, str), transaction_bytes: bytes, blockhash: (bytes, str), merkle_proof: Dict
+    ):
+        """
+        a transaction verified against its block header, along with the merkle branch.
+        the oldest read entries are dropped once the cache is over its size.
+        """
+        if self._confirmed_transactions is None:
+            self._load_confirmed_transactions()
+        key = self.get_key(txid)
+        data = CONFIRMED_TRANSACTION.pack(
+            merkle_proof['block_height'], self.get_key(blockhash), merkle_proof['pos'], len(merkle_proof['merkle'])
+        ) + b''.join(binascii.unhexlify(x) for x in merkle_proof['merkle']) + bytes(transaction_bytes)
+        if len(data) > self.confirmed_transactions_size:
+            return
+        self._confirmed_transactions_total += len(data) - self._confirmed_transactions.pop(key, 0)
+        self._confirmed_transactions[key] = len(data)
+        self.session.put(self.storage_name + b'.' + self.get_key(key, prefix=CONFIRMED_TRANSACTION_PREFIX), data)
+        while self._confirmed_transactions_total > self.confirmed_transactions_size:
+            self.remove_confirmed_transaction(next(iter(self._confirmed_transactions)))
+
+    def get_confirmed_transaction(self, txid: (bytes, str)) -> (None, Dict):
+        data = self.session.get(self.storage_name + b'.' + self.get_key(txid, prefix=CONFIRMED_TRANSACTION_PREFIX))
+        if not data:
+            return
+        height, blockhash, pos, branch_length = CONFIRMED_TRANSACTION.unpack(data[:CONFIRMED_TRANSACTION.size])
+        branch_end = CONFIRMED_TRANSACTION.size + branch_length * 32
+        if self._confirmed_transactions is not None and self.get_key(txid) in self._confirmed_transactions:
+            self._confirmed_transactions.move_to_end(self.get_key(txid))
+        return {
+            'transaction_bytes': data[branch_end:],
+            'block_hash': binascii.hexlify(blockhash).decode(),
+            'merkle_proof': {
+                'block_height': height,
+                'pos': pos,
+                'merkle': [
+                    binascii.hexlify(data[i:i + 32]).decode() for i in range(CONFIRMED_TRANSACTION.size, branch_end, 32)
+                ]
+            }
+        }
+
+    @ldb_batch
+    def remove_confirmed_transaction(self, txid: (bytes, str)):
+        if self._confirmed_transactions is not None:
+            self._confirmed_transactions_total -= self._confirmed_transactions.pop(self.get_key(txid), 0)
+        self._remove_item(self.get_key(txid, prefix=CONFIRMED_TRANSACTION_PREFIX))
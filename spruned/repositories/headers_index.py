@@ -0,0 +1,164 @@
+from array import array
+import struct
+from typing import Dict, List
+
+from spruned.application.tools import get_work
+from spruned.daemon import exceptions
+
+
+class HeadersIndex:
+    """
+    In-memory copy of the saved headers chain.
+
+    Headers and hashes are stored in two flat bytearrays, addressed by height
+    (80 and 32 bytes per height), while a dict maps each hash back to its height.
+    Every lookup is a slice or a dict hit, no SQL and no ORM objects involved.
+
+    Cumulative chainwork and median time past are kept per height as well, updated as headers are added.
+    The stored chainwork is relative to the first indexed header (backfilled headers get negative values),
+    so prepending headers never rewrites the ones above. It's served once the headers are backfilled to genesis.
+    """
+    HEADER_SIZE = 80
+    HASH_SIZE = 32
+    MEDIAN_TIME_SPAN = 11
+
+    def __init__(self):
+        self._headers = bytearray()
+        self._hashes = bytearray()
+        self._heights = dict()  # type: Dict[bytes, int]
+        self._chainworks = list()  # type: List[int]
+        self._mediantimes = array('I')
+        self._start_height = None
+        self._best_height = None
+
+    def __len__(self):
+        return len(self._heights)
+
+    @property
+    def start_height(self) -> (None, int):
+        return self._start_height
+
+    @property
+    def best_height(self) -> (None, int):
+        return self._best_height
+
+    def reset(self):
+        self._headers = bytearray()
+        self._hashes = bytearray()
+        self._heights = dict()
+        self._chainworks = list()
+        self._mediantimes = array('I')
+        self._start_height = self._best_height = None
+
+    def has_height(self, height: int) -> bool:
+        return self._best_height is not None and self._start_height <= height <= self._best_height
+
+    def append(self, height: int, blockhash: bytes, header_bytes: bytes, chainwork=None, mediantime=None) -> (int, int):
+        """
+        returns the stored chainwork and median time past, computed when not provided
+        """
+        if len(header_bytes) != self.HEADER_SIZE or len(blockhash) != self.HASH_SIZE:
+            raise exceptions.HeadersInconsistencyException
+        if self._best_height is None:
+            self._headers.extend(bytes(self.HEADER_SIZE * height))
+            self._hashes.extend(bytes(self.HASH_SIZE * height))
+            self._chainworks.extend([0] * height)
+            self._mediantimes.extend([0] * height)
+            self._start_height = height
+            prev_chainwork = 0
+        elif height != self._best_height + 1:
+            raise exceptions.HeadersInconsistencyException
+        else:
+            prev_chainwork = self._chainworks[height - 1]
+        self._headers.extend(header_bytes)
+        self._hashes.extend(blockhash)
+        self._heights[bytes(blockhash)] = height
+        self._best_height = height
+        if chainwork is None:
+            chainwork = prev_chainwork + get_work(self._get_bits(height))
+        self._chainworks.append(chainwork)
+        self._mediantimes.append(mediantime if mediantime is not None else self._compute_mediantime(height))
+        return chainwork, self._mediantimes[height]
+
+    def prepend(self, height: int, blockhash: bytes, header_bytes: bytes) -> int:
+        """
+        backfill the header right below the lowest indexed one, in place.
+        returns the stored chainwork. the median time past is left to refresh_mediantimes, once a batch is done.
+        """
+        if len(header_bytes) != self.HEADER_SIZE or len(blockhash) != self.HASH_SIZE:
+            raise exceptions.HeadersInconsistencyException
+        if self._best_height is None or height != self._start_height - 1:
+            raise exceptions.HeadersInconsistencyException
+        self._headers[height * self.HEADER_SIZE:(height + 1) * self.HEADER_SIZE] = header_bytes
+        self._hashes[height * self.HASH_SIZE:(height + 1) * self.HASH_SIZE] = blockhash
+        self._heights[bytes(blockhash)] = height
+        self._chainworks[height] = self._chainworks[height + 1] - get_work(self._get_bits(height + 1))
+        self._start_height = height
+        return self._chainworks[height]
+
+    def refresh_mediantimes(self, starts_from: int, ends_to: int) -> List[int]:
+        """
+        compute again the median time past from <starts_from> to <ends_to> (excluded)
+        """
+        ends_to = min(ends_to, self._best_height + 1)
+        for height in range(starts_from, ends_to):
+            self._mediantimes[height] = self._compute_mediantime(height)
+        return self._mediantimes[starts_from:ends_to].tolist()
+
+    def truncate(self, height: int):
+        """
+        remove all the headers from <height> to the tip
+        """
+        if self._best_height is None or height > self._best_height:
+            return
+        if height <= self._start_height:
+            self.reset()
+            return
+        for h in range(height, self._best_height + 1):
+            self._heights.pop(self.get_hash(h), None)
+        del self._headers[height * self.HEADER_SIZE:]
+        del self._hashes[height * self.HASH_SIZE:]
+        del self._chainworks[height:]
+        del self._mediantimes[height:]
+        self._best_height = height - 1
+
+    def get_hash(self, height: int) -> (None, bytes):
+        if not self.has_height(height):
+            return
+        return bytes(self._hashes[height * self.HASH_SIZE:(height + 1) * self.HASH_SIZE])
+
+    def get_header(self, height: int) -> (None, bytes):
+        if not self.has_height(height):
+            return
+        return bytes(self._headers[height * self.HEADER_SIZE:(height + 1) * self.HEADER_SIZE])
+
+    def get_height(self, blockhash: bytes) -> (None, int):
+        return self._heights.get(blockhash)
+
+    def get_bits(self, height: int) -> (None, int):
+        if not self.has_height(height):
+            return
+        return self._get_bits(height)
+
+    def get_chainwork(self, height: int) -> (None, int):
+        """
+        cumulative work since genesis, None until the headers are backfilled down to it (fast sync)
+        """
+        if not self.has_height(height) or self._start_height:
+            return
+        return self._chainworks[height] - self._chainworks[0] + get_work(self._get_bits(0))
+
+    def get_mediantime(self, height: int) -> (None, int):
+        if not self.has_height(height):
+            return
+        return self._mediantimes[height]
+
+    def _get_bits(self, height: int) -> int:
+        return struct.unpack_from('<I', self._headers, height * self.HEADER_SIZE + 72)[0]
+
+    def _compute_mediantime(self, height: int) -> int:
+        timestamps = sorted(
+            struct.unpack_from('<I', self._headers, h * self.HEADER_SIZE + 68)[0]
+            for h in range(max(self._start_height, height - self.MEDIAN_TIME_SPAN + 1), height + 1)
+        )
+        return timestamps[len(timestamps) // 2]
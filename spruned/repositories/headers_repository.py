@@ -1,124 +1,194 @@
 from typing import List, Dict
 
 import binascii
+import time
 
-from sqlalchemy import func
+from sqlalchemy import select, bindparam
 from sqlalchemy.exc import IntegrityError
 from spruned.application.abstracts import HeadersRepository
 from spruned.application.logging_factory import Logger
-from spruned.application.tools import verify_pow
+from spruned.application.tools import verify_pow, get_difficulty
 from spruned.daemon import exceptions
 from spruned.application import database
+from spruned.repositories.headers_index import HeadersIndex
+from spruned.repositories.hot_cache import HotCache
 
 
 class HeadersSQLiteRepository(HeadersRepository):
-    def __init__(self, session):
+    def __init__(self, session, index_factory=HeadersIndex, hot_cache: HotCache = None):
         self.session = session
         self._cache = None
+        self.hot_cache = hot_cache
+        self._index_factory = index_factory
+        self._index = None
 
     def set_cache(self, cache):
         self._cache = cache
 
-    @staticmethod
-    def _header_model_to_dict(header: database.Header, nextblockhash: (None, str), prevblockhash: (None, str)) -> Dict:
+    @property
+    def index(self) -> HeadersIndex:
+        if self._index is None:
+            self.load_index()
+        return self._index
+
+    def load_index(self):
+        """
+        load the saved headers chain in memory, reads are served from here.
+        if the saved headers have holes, only the run that reaches the tip is indexed.
+        """
+        start = time.time()
+        index = self._index_factory()
+        session = self.session()
+        query = select([
+            database.Header.blockheight, database.Header.blockhash, database.Header.data,
+            database.Header.chainwork, database.Header.mediantime
+        ]).order_by(database.Header.blockheight.asc())
+        for blockheight, blockhash, data, chainwork, mediantime in session.execute(query):
+            if index.best_height is not None and blockheight != index.best_height + 1:
+                Logger.repository.error(
+                    'Headers index: missing headers between %s and %s', index.best_height, blockheight
+                )
+                index.reset()
+                chainwork = mediantime = None
+            index.append(blockheight, blockhash, data, self._decode_chainwork(chainwork), mediantime)
+        self._index = index
+        Logger.repository.info(
+            'Headers index loaded: %s headers in %ss', len(index), '{:.4f}'.format(time.time() - start)
+        )
+        return index
+
+    def _get_header_dict(self, blockheight: int, with_links=True) -> (None, Dict):
+        index = self.index
+        blockhash = index.get_hash(blockheight)
+        if blockhash is None:
+            return
         res = {
-            'block_height': header.blockheight,
-            'block_hash': binascii.hexlify(header.blockhash).decode(),
-            'header_bytes': header.data,
-            'next_block_hash': nextblockhash and binascii.hexlify(nextblockhash).decode(),
-            'prev_block_hash': prevblockhash and binascii.hexlify(prevblockhash).decode()
+            'block_height': blockheight,
+            'block_hash': binascii.hexlify(blockhash).decode(),
+            'header_bytes': index.get_header(blockheight)
         }
-        if not res['prev_block_hash']:
-            res.pop('prev_block_hash')
-        if not res['next_block_hash']:
-            res.pop('next_block_hash')
+        if with_links:
+            prevblockhash = index.get_hash(blockheight - 1)
+            nextblockhash = index.get_hash(blockheight + 1)
+            if prevblockhash:
+                res['prev_block_hash'] = binascii.hexlify(prevblockhash).decode()
+            if nextblockhash:
+                res['next_block_hash'] = binascii.hexlify(nextblockhash).decode()
         return res
 
     def get_best_blockhash(self) -> str:
-        session = self.session()
-        _id = session.query(func.max(database.Header.id)).one_or_none()
-        best_header = _id and session.query(database.Header).filter_by(id=_id[0]).one_or_none()
-        best_blockhash = best_header and best_header.blockhash
-        return best_blockhash and binascii.hexlify(best_blockhash).decode()
+        best_height = self.index.best_height
+        return best_height is not None and binascii.hexlify(self.index.get_hash(best_height)).decode() or None
 
     def get_best_header(self):
-        best_blockhash = self.get_best_blockhash()
-        return best_blockhash and self.get_block_header(best_blockhash)
+        best_height = self.index.best_height
+        return best_height is not None and self._get_header_dict(best_height) or None
 
     def get_header_at_height(self, height: int):
-        blockhash = self.get_block_hash(height)
-        return self.get_block_header(blockhash)
+        return self._get_header_dict(height)
+
+    def get_lowest_header(self):
+        start_height = self.index.start_height
+        return start_height is not None and self._get_header_dict(start_height) or None
 
     def get_headers_since_height(self, height: int, limit=None):
-        session = self.session()
-        query = session.query(database.Header).filter(database.Header.blockheight >= height)\
-            .order_by(database.Header.blockheight.asc())
+        index = self.index
+        if index.best_height is None:
+            return []
+        starts_from = max(height, index.start_height)
+        ends_to = index.best_height + 1
         if limit is not None:
-            query = query.limit(limit)
-        headers = query.all()
-        res = []
-        howmany = len(headers)
-        for i, h in enumerate(headers):
-            if not i:
-                prevblockhash = h.blockheight != 0 and self.get_block_hash(h.blockheight-1, decode=False)
-            else:
-                prevblockhash = headers[i-1].blockhash
-            nextblockhash = i + 1 < howmany and headers[i + 1].blockhash or self.get_block_hash(
-                h.blockheight + 1, decode=False
-            )
-            res.append(
-                self._header_model_to_dict(
-                    h,
-                    nextblockhash=nextblockhash,
-                    prevblockhash=prevblockhash
-                )
-            )
-        return res
+            ends_to = min(ends_to, starts_from + limit)
+        return [self._get_header_dict(h) for h in range(starts_from, ends_to)]
 
-    @database.atomic
-    def save_header(self, blockhash: str, blockheight: int, headerbytes: bytes, prev_block_hash: str):
-        session = self.session()
+    def get_chain_stats(self, blockheight: int) -> (None, Dict):
+        """
+        chainwork, difficulty and median time past, as served by bitcoind.
+        chainwork is missing until the headers are backfilled to genesis.
+        """
+        index = self.index
+        if not index.has_height(blockheight):
+            return
+        stats = {
+            'difficulty': get_difficulty(index.get_bits(blockheight)),
+            'mediantime': index.get_mediantime(blockheight)
+        }
+        chainwork = index.get_chainwork(blockheight)
+        if chainwork is not None:
+            stats['chainwork'] = '%064x' % chainwork
+        return stats
 
-        def _save():
-            model = database.Header(
-                blockhash=binascii.unhexlify(blockhash),
-                blockheight=blockheight,
-                data=headerbytes
-            )
-            session.add(model)
-            try:
-                session.flush()
-            except IntegrityError:
-                raise exceptions.HeadersInconsistencyException
-            return model
+    @staticmethod
+    def _encode_chainwork(chainwork: int) -> bytes:
+        return chainwork.to_bytes(chainwork.bit_length() // 8 + 1, 'big', signed=True)
 
-        if blockheight == 0:
-            model = _save()
-            prev_block = None
-        else:
-            prev_block = session.query(database.Header).filter_by(blockheight=blockheight - 1).one()
-            if not prev_block or prev_block.blockhash != binascii.unhexlify(prev_block_hash):
-                raise exceptions.HeadersInconsistencyException
+    @staticmethod
+    def _decode_chainwork(chainwork: (None, bytes)) -> (None, int):
+        return chainwork and int.from_bytes(chainwork, 'big', signed=True)
 
-            model = _save()
-        return model and self._header_model_to_dict(
-            model, prevblockhash=prev_block and prev_block.blockhash, nextblockhash=None
+    def _rollback_index(self, blockheight: int):
+        """
+        drop the headers from <blockheight> added to the index by a failed write
+        """
+        best_height = self.index.best_height
+        best_height is not None and best_height >= blockheight and self.index.truncate(blockheight)
+
+    def _ensure_prev_block_hash(self, blockheight: int, prev_block_hash: str):
+        prev_block = self.index.get_hash(blockheight - 1)
+        if not prev_block or prev_block != binascii.unhexlify(prev_block_hash):
+            raise exceptions.HeadersInconsistencyException
+
+    @database.atomic
+    def save_header(self, blockhash: str, blockheight: int, headerbytes: bytes, prev_block_hash: str):
+        session = self.session()
+        if blockheight:
+            self._ensure_prev_block_hash(blockheight, prev_block_hash)
+        blockhash = binascii.unhexlify(blockhash)
+        chainwork, mediantime = self.index.append(blockheight, blockhash, headerbytes)
+        model = database.Header(
+            blockhash=blockhash,
+            blockheight=blockheight,
+            data=headerbytes,
+            chainwork=self._encode_chainwork(chainwork),
+            mediantime=mediantime
         )
+        session.add(model)
+        try:
+            session.flush()
+        except IntegrityError:
+            self._rollback_index(blockheight)
+            raise exceptions.HeadersInconsistencyException
+        return self._get_header_dict(blockheight)
 
     @database.atomic
     def save_headers(self, headers: List[Dict]):
+        try:
+            return self._save_headers(headers)
+        except Exception:
+            headers and self._rollback_index(headers[0]['block_height'])
+            raise
+
+    def _save_headers(self, headers: List[Dict]):
         session = self.session()
         for i, header in enumerate(headers):
             verify_pow(header['header_bytes'], binascii.unhexlify(header['block_hash']))
             if i == 0 and header['block_height'] != 0:
-                prev_block = session.query(database.Header).filter_by(blockheight=header['block_height'] - 1).one()
-                if prev_block.blockhash != binascii.unhexlify(header['prev_block_hash']):
+                try:
+                    self._ensure_prev_block_hash(header['block_height'], header['prev_block_hash'])
+                except exceptions.HeadersInconsistencyException:
                     Logger.repository.exception('Integrity Error on check prev block hash')
-                    raise exceptions.HeadersInconsistencyException
+                    raise
+            elif i and header['block_height'] != headers[i - 1]['block_height'] + 1:
+                Logger.repository.error('Integrity Error on save_headers, not contiguous headers')
+                raise exceptions.HeadersInconsistencyException
+            blockhash = binascii.unhexlify(header['block_hash'])
+            chainwork, mediantime = self.index.append(header['block_height'], blockhash, header['header_bytes'])
             model = database.Header(
-                blockhash=binascii.unhexlify(header['block_hash']),
+                blockhash=blockhash,
                 blockheight=header['block_height'],
-                data=header['header_bytes']
+                data=header['header_bytes'],
+                chainwork=self._encode_chainwork(chainwork),
+                mediantime=mediantime
             )
             session.add(model)
         try:
@@ -129,46 +199,179 @@ class HeadersSQLiteRepository(HeadersRepository):
         return headers
 
     @database.atomic
-    def remove_headers_after_height(self, blockheight: int):
+    def ingest_headers(self, headers: List[Dict], check_pow=True) -> List[Dict]:
+        """
+        bulk path for the headers sync.
+        the whole batch is linked to the local tip in a single pass and written with one executemany,
+        no ORM objects are created.
+        """
+        if not headers:
+            return headers
+        try:
+            return self._ingest_headers(headers, check_pow)
+        except Exception:
+            self._rollback_index(headers[0]['block_height'])
+            raise
+
+    def _ingest_headers(self, headers: List[Dict], check_pow: bool, anchor=False) -> List[Dict]:
+        start = time.time()
+        index = self.index
         session = self.session()
-        headers = session.query(database.Header).filter(database.Header.blockheight >= blockheight).all()
+        blockheight = headers[0]['block_height']
+        if anchor:
+            prev_block_hash = blockheight and binascii.unhexlify(headers[0]['prev_block_hash']) or None
+        else:
+            prev_block_hash = blockheight and index.get_hash(blockheight - 1) or None
+        if blockheight and not prev_block_hash:
+            Logger.repository.error('Integrity Error on ingest_headers, missing parent for %s', blockheight)
+            raise exceptions.HeadersInconsistencyException
+        rows = []
         for header in headers:
-            session.delete(header)
+            blockhash = binascii.unhexlify(header['block_hash'])
+            if header['block_height'] != blockheight or \
+                    (blockheight and binascii.unhexlify(header['prev_block_hash']) != prev_block_hash):
+                Logger.repository.error('Integrity Error on ingest_headers, broken link at %s', blockheight)
+                raise exceptions.HeadersInconsistencyException
+            check_pow and verify_pow(header['header_bytes'], blockhash)
+            chainwork, mediantime = index.append(blockheight, blockhash, header['header_bytes'])
+            rows.append({
+                'blockheight': blockheight,
+                'blockhash': blockhash,
+                'data': header['header_bytes'],
+                'chainwork': self._encode_chainwork(chainwork),
+                'mediantime': mediantime
+            })
+            prev_block_hash = blockhash
+            blockheight += 1
+        try:
+            session.execute(database.Header.__table__.insert(), rows)
+        except IntegrityError:
+            Logger.repository.exception('Integrity Error on ingest_headers')
+            raise exceptions.HeadersInconsistencyException
+        elapsed = time.time() - start
+        Logger.repository.debug(
+            'Ingested %s headers (%s - %s) in %ss, %s headers/s',
+            len(rows), headers[0]['block_height'], headers[-1]['block_height'],
+            '{:.4f}'.format(elapsed), int(len(rows) / elapsed) if elapsed else len(rows)
+        )
+        return headers
+
+    @database.atomic
+    def backfill_headers(self, headers: List[Dict]) -> List[Dict]:
+        """
+        save a batch of headers ending right below the lowest saved header (checkpoint anchored sync).
+        with no saved headers, the batch becomes the saved chain.
+        """
+        if not headers:
+            return headers
+        index = self.index
+        if index.start_height is not None:
+            if headers[-1]['block_height'] != index.start_height - 1:
+                Logger.repository.error(
+                    'Integrity Error on backfill_headers, %s is not below %s',
+                    headers[-1]['block_height'], index.start_height
+                )
+                raise exceptions.HeadersInconsistencyException
+            lowest_header = index.get_header(index.start_height)
+            if lowest_header[4:36] != binascii.unhexlify(headers[-1]['block_hash'])[::-1]:
+                Logger.repository.error('Integrity Error on backfill_headers, broken link at %s', index.start_height)
+                raise exceptions.HeadersInconsistencyException
+        for i, header in enumerate(headers):
+            if i and (
+                header['block_height'] != headers[i - 1]['block_height'] + 1 or
+                header['prev_block_hash'] != headers[i - 1]['block_hash']
+            ):
+                Logger.repository.error(
+                    'Integrity Error on backfill_headers, broken link at %s', header['block_height']
+                )
+                raise exceptions.HeadersInconsistencyException
+        if index.start_height is None:
+            try:
+                return self._ingest_headers(headers, check_pow=False, anchor=True)
+            except Exception:
+                self._rollback_index(headers[0]['block_height'])
+                raise
+        session = self.session()
+        previous_start_height = index.start_height
+        rows = []
+        try:
+            for header in reversed(headers):
+                blockhash = binascii.unhexlify(header['block_hash'])
+                chainwork = index.prepend(header['block_height'], blockhash, header['header_bytes'])
+                rows.append({
+                    'blockheight': header['block_height'],
+                    'blockhash': blockhash,
+                    'data': header['header_bytes'],
+                    'chainwork': self._encode_chainwork(chainwork)
+                })
+            rows.reverse()
+            for row, mediantime in zip(rows, index.refresh_mediantimes(index.start_height, previous_start_height)):
+                row['mediantime'] = mediantime
+            session.execute(database.Header.__table__.insert(), rows)
+            refreshed = index.refresh_mediantimes(
+                previous_start_height, previous_start_height + index.MEDIAN_TIME_SPAN - 1
+            )
+            refreshed and session.execute(
+                database.Header.__table__.update().where(
+                    database.Header.blockheight == bindparam('b_blockheight')
+                ).values(mediantime=bindparam('b_mediantime')),
+                [
+                    {'b_blockheight': previous_start_height + i, 'b_mediantime': mediantime}
+                    for i, mediantime in enumerate(refreshed)
+                ]
+            )
+        except IntegrityError:
+            Logger.repository.exception('Integrity Error on backfill_headers')
+            self._index = None
+            raise exceptions.HeadersInconsistencyException
+        except Exception:
+            self._index = None
+            raise
+        return headers
+
+    @database.atomic
+    def remove_headers_after_height(self, blockheight: int):
+        session = self.session()
+        session.query(database.Header).filter(database.Header.blockheight >= blockheight)\
+            .delete(synchronize_session=False)
         session.flush()
+        if self.hot_cache and self.index.best_height is not None:
+            for height in range(blockheight, self.index.best_height + 1):
+                blockhash = self.index.get_hash(height)
+                blockhash and self.hot_cache.invalidate(blockhash)
+        self.index.truncate(blockheight)
 
     @database.atomic
     def remove_header_at_height(self, blockheight: int) -> Dict:
         session = self.session()
         header = session.query(database.Header).filter(database.Header.blockheight == blockheight).one()
-        removing_dict = self._header_model_to_dict(header, "", "")
+        removing_dict = {
+            'block_height': header.blockheight,
+            'block_hash': binascii.hexlify(header.blockhash).decode(),
+            'header_bytes': header.data
+        }
         session.delete(header)
         session.flush()
+        self.hot_cache and self.hot_cache.invalidate(removing_dict['block_hash'])
+        if blockheight == self.index.best_height:
+            self.index.truncate(blockheight)
+        else:
+            self._index = None
         return removing_dict
 
     def get_block_hash(self, blockheight: int, decode=True):
-        session = self.session()
-        header = session.query(database.Header).filter_by(blockheight=blockheight).one_or_none()
-        if not header:
+        blockhash = self.index.get_hash(blockheight)
+        if not blockhash:
             return
         if decode:
-            return binascii.hexlify(header.blockhash).decode()
-        return header.blockhash
+            return binascii.hexlify(blockhash).decode()
+        return blockhash
 
     def get_block_height(self, blockhash: str):
-        session = self.session()
-        header = session.query(database.Header).filter_by(blockhash=binascii.unhexlify(blockhash)).one_or_none()
-        return header and header.blockheight
+        return self.index.get_height(binascii.unhexlify(blockhash))
 
     def get_block_header(self, blockhash: str):
-        session = self.session()
-        header = session.query(database.Header).filter_by(blockhash=binascii.unhexlify(blockhash)).one_or_none()
-        if not header:
+        blockheight = self.index.get_height(binascii.unhexlify(blockhash))
+        if blockheight is None:
             return
-        prev_next = session.query(database.Header).filter(database.Header.id.in_((header.id-1, header.id+1))).all()
-        prevblockhash = nextblockhash = None
-        for h in prev_next:
-            if h.id == header.id - 1:
-                prevblockhash = h.blockhash
-            elif h.id == header.id + 1:
-                nextblockhash = h.blockhash
-        return self._header_model_to_dict(header, nextblockhash, prevblockhash)
+        return self._get_header_dict(blockheight)
@@ -0,0 +1,79 @@
+import binascii
+from collections import OrderedDict
+from typing import Dict
+
+BLOCK_OBJECT, VERBOSE_BLOCK, BLOCK_BYTES = 'block_object', 'verbose_block', 'block_bytes'
+KINDS = (BLOCK_OBJECT, VERBOSE_BLOCK, BLOCK_BYTES)
+
+
+def estimate_block_object_size(block_object, raw_size: int) -> int:
+    """
+    a parsed block is roughly three times its serialized size, plus the python objects of each transaction
+    """
+    return raw_size * 3 + len(block_object.txs) * 1024
+
+
+def estimate_verbose_block_size(block: Dict) -> int:
+    return 1024 + len(block.get('tx', [])) * 128
+
+
+class HotCache:
+    """
+    byte bounded in memory lru of the objects derived from recently touched blocks:
+    parsed blocks, verbose block dicts and inflated bytes of compressed blocks.
+    items are keyed by kind and blockhash, sizes are estimates.
+    """
+    def __init__(self, max_size: int = 32 * 1024 * 1024):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    @staticmethod
+    def _key(kind: str, blockhash: (bytes, str)) -> tuple:
+        if isinstance(blockhash, bytes):
+            blockhash = binascii.hexlify(blockhash).decode()
+        return kind, blockhash
+
+    def get(self, kind: str, blockhash: (bytes, str)):
+        key = self._key(kind, blockhash)
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def put(self, kind: str, blockhash: (bytes, str), value, size: int):
+        if size > self.max_size:
+            return
+        key = self._key(kind, blockhash)
+        prev = self._items.pop(key, None)
+        if prev:
+            self.size -= prev[1]
+        self._items[key] = (value, size)
+        self.size += size
+        while self.size > self.max_size:
+            _, (_, _size) = self._items.popitem(last=False)
+            self.size -= _size
+
+    def invalidate(self, blockhash: (bytes, str)):
+        for kind in KINDS:
+            item = self._items.pop(self._key(kind, blockhash), None)
+            if item:
+                self.size -= item[1]
+
+    def clear(self):
+        self._items.clear()
+        self.size = 0
+
+    def get_info(self) -> Dict:
+        return {
+            'entries': len(self._items),
+            'size': self.size,
+            'limit': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -80,6 +80,9 @@ class MempoolRepository:
             self._add_double_spend(data)
         return bool(not double_spend)
 
+    def is_spent(self, txid: str, index: int) -> bool:
+        return bool(self._outpoints.get('{}:{}'.format(txid, index)))
+
     def _add_outpoints(self, data: Dict):
         for outpoint in data["outpoints"]:
             if self._outpoints.get(outpoint):
@@ -1,9 +1,12 @@
 import asyncio
+from typing import Dict
 
 from spruned import settings
 from spruned.application.database import ldb_batch
 from spruned.application.logging_factory import Logger
+from spruned.repositories.block_files import BlockFiles
 from spruned.repositories.headers_repository import HeadersSQLiteRepository
+from spruned.repositories.hot_cache import HotCache
 from spruned.repositories.blockchain_repository import BlockchainRepository, TRANSACTION_PREFIX, BLOCK_INDEX_PREFIX, \
     DB_VERSION
 from spruned.repositories.mempool_repository import MempoolRepository
@@ -36,11 +39,15 @@ class Repository:
     def instance(cls):  # pragma: no cover
         from spruned.application import database
         from spruned.application.context import ctx
-        headers_repository = HeadersSQLiteRepository(database.sqlite)
+        hot_cache = HotCache(max_size=ctx.hot_cache_size * 1024000)
+        headers_repository = HeadersSQLiteRepository(database.sqlite, hot_cache=hot_cache)
         blocks_repository = BlockchainRepository(
             database.storage_ldb,
             settings.LEVELDB_BLOCKCHAIN_SLUG,
-            settings.LEVELDB_BLOCKCHAIN_ADDRESS
+            settings.LEVELDB_BLOCKCHAIN_ADDRESS,
+            block_files=BlockFiles(settings.BLOCK_FILES_ADDRESS),
+            hot_cache=hot_cache,
+            confirmed_transactions_size=ctx.tx_cache_size * 1024000
         )
         if ctx.mempool_size > 1000:
             Logger.mempool.error(
@@ -64,6 +71,7 @@ class Repository:
         try:
             await self.integrity_lock.acquire()
             self._ensure_no_stales_in_blockchain_repository()
+            self.blockchain.remove_unreferenced_block_files()
         finally:
             self.integrity_lock.release()
 
@@ -125,6 +133,42 @@ class Repository:
         self.headers.set_cache(cache)
         self.blockchain.set_cache(cache)
 
+    def get_stored_since_height(self) -> (None, int):
+        """
+        the height since which every block, up to the best one, is stored. None while a new best block is missing.
+        the watermark is extended here on new best blocks, the blockchain repository drops it when a block
+        is removed, or the one below the watermark is saved.
+        """
+        best_header = self.headers.get_best_header()
+        if not best_header:
+            return
+        watermark = self.blockchain.stored_watermark
+        if not watermark or self.headers.get_block_hash(watermark['top_height']) != watermark['top_hash']:
+            watermark = self._scan_stored_blocks(best_header['block_height'])
+        for header in self.headers.get_headers_since_height(watermark['top_height'] + 1):
+            if not self.blockchain.get_block_index(header['block_hash']):
+                break
+            watermark.update({'top_height': header['block_height'], 'top_hash': header['block_hash']})
+        self.blockchain.stored_watermark = watermark
+        return watermark['since_height'] if watermark['top_height'] == best_header['block_height'] else None
+
+    def _scan_stored_blocks(self, best_height: int) -> Dict:
+        """
+        the stored blocks below the best one, down to keep_blocks
+        """
+        height = best_height
+        while height > best_height - self.keep_blocks:
+            blockhash = self.headers.get_block_hash(height)
+            if not blockhash or not self.blockchain.get_block_index(blockhash):
+                break
+            height -= 1
+        return {
+            'since_height': height + 1,
+            'below_hash': self.headers.get_block_hash(height),
+            'top_height': best_height,
+            'top_hash': self.headers.get_block_hash(best_height)
+        }
+
     def get_extemped_blockhash(self):
         """
         avoid to delete headers in range
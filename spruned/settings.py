@@ -20,6 +20,7 @@ CHECK_NETWORK_HOST = [
 ]
 SQLITE_DBNAME = ''
 LEVELDB_BLOCKCHAIN_ADDRESS = '/tmp/%s-test.session' % binascii.hexlify(os.urandom(8))
+BLOCK_FILES_ADDRESS = '/tmp/%s-test.blocks' % binascii.hexlify(os.urandom(8))
 LEVELDB_BLOCKCHAIN_SLUG = b'b'
 LEVELDB_CACHE_SLUG = b'c'
 
@@ -28,3 +29,4 @@ if not TESTING:
     LOGFILE = '%s/spruned.log' % ctx.datadir
     SQLITE_DBNAME = '%sheaders.db' % STORAGE_ADDRESS
     LEVELDB_BLOCKCHAIN_ADDRESS = '%sdatabase.session' % STORAGE_ADDRESS
+    BLOCK_FILES_ADDRESS = '%sblocks' % STORAGE_ADDRESS
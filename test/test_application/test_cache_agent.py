@@ -1,18 +1,25 @@
 import asyncio
 import pickle
 import time
+import zlib
 
 from unittest import TestCase
 from unittest.mock import Mock, create_autospec, call, ANY
 
-from spruned.application.cache import CacheAgent
+from spruned.application.cache import CacheAgent, INDEX_ENTRY, PINNED_RANGE
 from spruned.repositories.repository import Repository
 
 
+def entry(key, saved_at, size, raw_size=0, accessed_at=0, hits=0):
+    return b'c.' + key, INDEX_ENTRY.pack(saved_at, size, raw_size, accessed_at, hits)
+
+
 class TestCacheAgent(TestCase):
     def setUp(self):
         self.loop = asyncio.get_event_loop()
         self.session = Mock(closed=False)
+        self.session.get.return_value = None
+        self.session.iterator.return_value = []
         self.repository = create_autospec(Repository)
         self.repository.blockchain.session = self.session
         self.repository.blockchain.set_cache.return_value = None
@@ -26,93 +33,263 @@ class TestCacheAgent(TestCase):
         )
         self.basedata = {
             'keys': {
-                'cafe': {
+                b'cafe': {
                     'saved_at': 123,
                     'size': 16,
-                    'key': 'cafe'
+                    'key': b'cafe'
                 },
-                'babe': {
+                b'babe': {
                     'saved_at': 124,
                     'size': 32,
-                    'key': 'babe'
+                    'key': b'babe'
                 }
             },
             'total': 48
         }
+        self.entries = [entry(b'cafe', 123, 16), entry(b'babe', 124, 32)]
 
     def test_init_no_data(self):
-        self.session.get.return_value = None
         self.sut.init()
+        Mock.assert_called_once_with(self.session.iterator, prefix=b'c.')
+        self.assertEqual({'keys': {}, 'total': 0}, self.sut.index)
 
     def test_init_data(self):
-        dump = pickle.dumps([['cafe', 123, 16], ['babe', 124, 32]])
-        self.session.get.return_value = dump
+        self.session.iterator.return_value = self.entries
         self.sut.init()
-        self.assertEqual(self.sut._last_dump_size, 48)
         self.assertEqual(self.sut.index, self.basedata)
         self.assertEqual(self.sut.index['total'], 48)
 
+    def test_init_migrates_legacy_index(self):
+        self.session.get.side_effect = [pickle.dumps([[b'cafe', 123, 16], [b'babe', 124, 32]]), None]
+        self.sut.init()
+        self.assertEqual(self.sut.index, self.basedata)
+        Mock.assert_not_called(self.session.iterator)
+        Mock.assert_has_calls(self.session.put, calls=[call(*e) for e in self.entries], any_order=True)
+        Mock.assert_called_once_with(self.session.delete, b'cache_index')
+
     def test_save_data(self):
-        dump = pickle.dumps([['cafe', 123, 16], ['babe', 124, 32]])
-        self.session.get.return_value = dump
+        self.session.iterator.return_value = self.entries
         self.sut.init()
         self.sut.dump()
-        Mock.assert_called_once_with(self.session.put, b'cache_index', dump)
+        Mock.assert_not_called(self.session.put)
 
     def test_track(self):
-        dump = pickle.dumps([['cafe', 123, 16], ['babe', 124, 32]])
-        self.session.get.return_value = dump
+        self.session.iterator.return_value = self.entries
         self.sut.init()
         now = int(time.time())
-        self.sut.track('ffff', 64)
+        self.sut.track(b'ffff', 64)
         self.assertEqual(self.sut.index['total'], 112)
-        self.assertEqual(self.sut.index['keys']['ffff']['key'], 'ffff')
-        self.assertEqual(self.sut.index['keys']['ffff']['size'], 64)
-        self.assertTrue(now - 1 <= self.sut.index['keys']['ffff']['saved_at'] <= now + 1)
+        self.assertEqual(self.sut.index['keys'][b'ffff']['key'], b'ffff')
+        self.assertEqual(self.sut.index['keys'][b'ffff']['size'], 64)
+        self.assertTrue(now - 1 <= self.sut.index['keys'][b'ffff']['saved_at'] <= now + 1)
+        Mock.assert_called_once_with(
+            self.session.put, *entry(b'ffff', self.sut.index['keys'][b'ffff']['saved_at'], 64)
+        )
 
     def test_track_empty_index(self):
         now = int(time.time())
-        self.sut.track('ffff', 64)
+        self.sut.track(b'ffff', 64)
+        self.sut.track(b'ffff', 64)
         self.assertEqual(self.sut.index['total'], 64)
-        self.assertEqual(self.sut.index['keys']['ffff']['key'], 'ffff')
-        self.assertEqual(self.sut.index['keys']['ffff']['size'], 64)
-        self.assertTrue(now - 1 <= self.sut.index['keys']['ffff']['saved_at'] <= now + 1)
+        self.assertEqual(self.sut.index['keys'][b'ffff']['key'], b'ffff')
+        self.assertEqual(self.sut.index['keys'][b'ffff']['size'], 64)
+        self.assertTrue(now - 1 <= self.sut.index['keys'][b'ffff']['saved_at'] <= now + 1)
+
+    def test_charge(self):
+        self.session.iterator.return_value = self.entries
+        self.sut.init()
+        self.sut.charge(b'cafe', 100)
+        self.sut.charge(b'ffff', 100)
+        self.assertEqual(116, self.sut.index['keys'][b'cafe']['size'])
+        self.assertEqual(148, self.sut.index['total'])
+        Mock.assert_called_once_with(self.session.put, *entry(b'cafe', 123, 116))
 
     def test_check_ok(self):
-        dump = pickle.dumps([['cafe', 123, 16], ['babe', 124, 32]])
-        self.session.get.return_value = dump
+        self.session.iterator.return_value = self.entries
+        self.session.get.side_effect = [None, None, True, True]
         self.sut.init()
         self.loop.run_until_complete(self.sut.check())
         Mock.assert_not_called(self.session.put)
+        Mock.assert_not_called(self.session.delete)
 
-    def test_check_new_data_saved(self):
-        ldump = [['cafe', 123, 16], ['babe', 124, 32]]
-        self.session.get.side_effect = [pickle.dumps(ldump), True, True, True]
+    def test_check_purges_stales(self):
+        self.session.iterator.return_value = self.entries
+        self.session.get.side_effect = [None, None, True, None]
         self.sut.init()
-        self.sut.track('ffff', 64)
-        ldump.append(['ffff', self.sut.index['keys']['ffff']['saved_at'], 64])
         self.loop.run_until_complete(self.sut.check())
-        Mock.assert_called_once_with(self.session.put, b'cache_index', pickle.dumps(ldump))
+        self.assertEqual([b'cafe'], list(self.sut.index['keys']))
+        self.assertEqual(16, self.sut.index['total'])
+        Mock.assert_called_once_with(self.session.delete, b'c.babe')
 
     def test_check_new_data_saved_size_limit_exceeded(self):
         """
         this is the real naming convention for indexes
         :return:
         """
-        ldump = [[b'\x02.cafe', 123, 512*1024], [b'\x02.babe', 124, 400*1024]]
-        self.session.get.side_effect = [pickle.dumps(ldump), True, True, True, True]
+        self.session.iterator.return_value = [
+            entry(b'\x02.cafe', 123, 512*1024), entry(b'\x02.babe', 124, 400*1024)
+        ]
+        self.session.get.side_effect = [None, None, True, True, True, True]
         self.sut.init()
         self.sut.track(b'\x02.ffff', 640*1024)
-        ldump.append([b'\x02.ffff', self.sut.index['keys'][b'\x02.ffff']['saved_at'], 640*1024])
         self.loop.run_until_complete(self.sut.check())
         Mock.assert_has_calls(
-            self.session.put,
-            calls=[
-                call(b'cache_index', ANY),
-                call(b'cache_index', ANY)
-            ]
+            self.repository.blockchain.remove_block,
+            calls=[call(b'cafe'), call(b'babe')]
+        )
+        Mock.assert_has_calls(
+            self.session.delete,
+            calls=[call(b'c.\x02.cafe'), call(b'c.\x02.babe')]
+        )
+        self.assertEqual([b'\x02.ffff'], list(self.sut.index['keys']))
+
+    def test_compress(self):
+        sut = CacheAgent(self.repository, 1, self.loop, self.delayer, compression='zlib')
+        raw = b'\x01' * 1000
+        self.session.iterator.return_value = [
+            entry(b'\x02.' + b'\xca' * 32, 123, 1000), entry(b'\x02.' + b'\xbe' * 32, 124, 1000)
+        ]
+        sut.init()
+        self.repository.get_extemped_blockhash.return_value = ['be' * 32]
+        self.repository.blockchain.get_block_codec.return_value = 0
+        self.repository.blockchain.get_block_bytes.return_value = memoryview(raw)
+        self.repository.blockchain.save_compressed_block.return_value = 20
+        self.loop.run_until_complete(sut.compress())
+        Mock.assert_called_once_with(self.repository.blockchain.get_block_bytes, b'\xca' * 32, record_access=False)
+        Mock.assert_called_once_with(self.repository.blockchain.save_compressed_block, b'\xca' * 32, 1, ANY)
+        self.assertEqual(raw, zlib.decompress(self.repository.blockchain.save_compressed_block.call_args[0][2]))
+        Mock.assert_called_once_with(self.session.put, *entry(b'\x02.' + b'\xca' * 32, 123, 20, raw_size=1000))
+        self.assertEqual(
+            {
+                'entries': 2, 'size': 1020, 'raw_size': 2000, 'limit': 1024000, 'compression_ratio': 1.9608,
+                'policy': 'lru', 'hits': 0, 'misses': 0, 'hit_rate': 0.0, 'untracked_hits': 0
+            },
+            sut.get_info()
+        )
+
+    def test_compress_keeps_charged_size(self):
+        sut = CacheAgent(self.repository, 1, self.loop, self.delayer, compression='zlib')
+        self.session.iterator.return_value = [entry(b'\x02.' + b'\xca' * 32, 123, 1000)]
+        sut.init()
+        sut.charge(b'\x02.' + b'\xca' * 32, 3000)
+        self.repository.get_extemped_blockhash.return_value = []
+        self.repository.blockchain.get_block_codec.return_value = 0
+        self.repository.blockchain.get_block_bytes.return_value = memoryview(b'\x01' * 1000)
+        self.repository.blockchain.save_compressed_block.return_value = 20
+        self.loop.run_until_complete(sut.compress())
+        self.assertEqual({'size': 3020, 'raw_size': 4000}, {
+            k: v for k, v in sut.index['keys'][b'\x02.' + b'\xca' * 32].items() if k in ('size', 'raw_size')
+        })
+        self.assertEqual(3020, sut.get_info()['size'])
+
+    def test_compress_disabled(self):
+        self.session.iterator.return_value = [entry(b'\x02.' + b'\xca' * 32, 123, 1000)]
+        self.sut.init()
+        self.loop.run_until_complete(self.sut.compress())
+        Mock.assert_not_called(self.repository.blockchain.get_block_bytes)
+        self.assertEqual(1.0, self.sut.get_info()['compression_ratio'])
+
+    def test_record_access(self):
+        self.session.iterator.return_value = [entry(b'cafe', 123, 16), entry(b'babe', 124, 32, raw_size=64)]
+        self.session.get.side_effect = [None, None, True, True]
+        self.sut.init()
+        self.sut.record_hit(b'cafe')
+        self.sut.record_hit(b'cafe')
+        self.sut.record_hit(b'dead')
+        self.sut.record_miss(b'dead')
+        self.assertEqual(2, self.sut.index['keys'][b'cafe']['hits'])
+        self.assertEqual(
+            {'policy': 'lru', 'hits': 2, 'misses': 1, 'hit_rate': 0.6667, 'untracked_hits': 1},
+            {
+                k: v for k, v in self.sut.get_info().items()
+                if k in ('policy', 'hits', 'misses', 'hit_rate', 'untracked_hits')
+            }
+        )
+        self.loop.run_until_complete(self.sut.check())
+        accessed_at = self.sut.index['keys'][b'cafe']['accessed_at']
+        saved = entry(b'cafe', 123, 16, accessed_at=accessed_at, hits=2)
+        Mock.assert_called_once_with(self.session.put, *saved)
+        self.sut.index = None
+        self.session.get.side_effect = None
+        self.session.iterator.return_value = [saved, entry(b'babe', 124, 32, raw_size=64)]
+        self.sut.init()
+        self.assertEqual(
+            {'saved_at': 123, 'size': 16, 'key': b'cafe', 'accessed_at': accessed_at, 'hits': 2},
+            self.sut.index['keys'][b'cafe']
         )
+        self.assertEqual({'saved_at': 124, 'size': 32, 'key': b'babe', 'raw_size': 64}, self.sut.index['keys'][b'babe'])
+
+    def test_check_size_limit_exceeded_evicts_least_recently_read(self):
+        self.session.iterator.return_value = [
+            entry(b'\x02.cafe', 123, 512*1024), entry(b'\x02.babe', 124, 400*1024), entry(b'\x02.ffff', 125, 640*1024)
+        ]
+        self.session.get.side_effect = [None, None, True, True, True]
+        self.sut.init()
+        self.sut.record_hit(b'\x02.cafe')
+        self.loop.run_until_complete(self.sut.check())
         Mock.assert_has_calls(
             self.repository.blockchain.remove_block,
-            calls=[call(b'cafe')]
+            calls=[call(b'babe'), call(b'ffff')]
+        )
+        self.assertEqual([b'\x02.cafe'], list(self.sut.index['keys']))
+
+    def test_pin_unpin(self):
+        self.repository.headers.get_block_hash.return_value = None
+        self.sut.init()
+        self.sut.pin(10, 20)
+        self.sut.pin(30, 40)
+        self.sut.pin(21, 25)
+        self.assertEqual([[10, 25], [30, 40]], self.sut.pins)
+        self.sut.unpin(15, 32)
+        self.assertEqual([[10, 14], [33, 40]], self.sut.pins)
+        self.assertEqual(
+            call(b'cache_pins', PINNED_RANGE.pack(10, 14) + PINNED_RANGE.pack(33, 40)), self.session.put.call_args
+        )
+        self.session.get.side_effect = [None, PINNED_RANGE.pack(10, 14) + PINNED_RANGE.pack(33, 40)]
+        self.sut.index = None
+        self.sut.init()
+        self.assertEqual([[10, 14], [33, 40]], self.sut.pins)
+
+    def test_can_pin(self):
+        self.session.iterator.return_value = [entry(b'\x02.' + bytes([h]) * 32, 123, 200000) for h in range(2)]
+        self.sut.init()
+        self.repository.headers.get_block_hash.side_effect = lambda h: (bytes([h]) * 32).hex()
+        self.assertTrue(self.sut.can_pin(0, 4))
+        self.assertFalse(self.sut.can_pin(0, 5))
+        self.sut.pin(0, 3)
+        self.assertTrue(self.sut.can_pin(4, 4))
+        self.assertFalse(self.sut.can_pin(4, 5))
+        self.sut.index = {'keys': {}, 'total': 0}
+        self.assertFalse(self.sut.can_pin(4, 4))
+
+    def test_check_skips_pinned_blocks(self):
+        self.session.iterator.return_value = [
+            entry(b'\x02.' + b'\xca' * 32, 123, 512*1024), entry(b'\x02.' + b'\xbe' * 32, 124, 640*1024)
+        ]
+        self.session.get.side_effect = [None, PINNED_RANGE.pack(1, 1), True, True]
+        self.repository.headers.get_block_height.side_effect = lambda x: 1 if x == 'ca' * 32 else 2
+        self.repository.headers.get_block_hash.side_effect = lambda x: 'ca' * 32
+        self.sut.init()
+        self.loop.run_until_complete(self.sut.check())
+        Mock.assert_called_once_with(self.repository.blockchain.remove_block, b'\xbe' * 32)
+        self.assertEqual([{'start_height': 1, 'end_height': 1, 'size': 512*1024, 'missing': 0}], self.sut.get_pins())
+
+    def test_fetch_pinned(self):
+        p2p = Mock()
+        sut = CacheAgent(self.repository, 1, self.loop, self.delayer, p2p=p2p)
+        sut.init()
+        self.repository.headers.get_block_hash.side_effect = lambda x: '%064x' % x
+        self.repository.blockchain.get_block_index.side_effect = lambda x: x == '%064x' % 2
+
+        async def get_blocks(*blockhashes):
+            return {blockhash: {'block_hash': blockhash} for blockhash in blockhashes}
+        p2p.get_blocks.side_effect = get_blocks
+        sut.pins = [[1, 4]]
+        self.loop.run_until_complete(sut.fetch_pinned(batch_size=2))
+        self.assertEqual(
+            [call('%064x' % 1), call('%064x' % 3, '%064x' % 4)], p2p.get_blocks.call_args_list
+        )
+        self.assertEqual(
+            [call({'block_hash': '%064x' % x}, tracker=sut) for x in (1, 3, 4)],
+            self.repository.blockchain.save_block.call_args_list
         )
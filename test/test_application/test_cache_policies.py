@@ -0,0 +1,58 @@
+from unittest import TestCase
+
+from spruned.application.cache_policies import EvictionPolicy, LRUPolicy, LFUPolicy, ARCPolicy
+
+
+def item(key, saved_at, size=10, accessed_at=None, hits=0):
+    res = {'key': key, 'saved_at': saved_at, 'size': size}
+    if accessed_at:
+        res.update({'accessed_at': accessed_at, 'hits': hits})
+    return res
+
+
+class TestCachePolicies(TestCase):
+    def setUp(self):
+        self.items = [
+            item(b'a', 1, accessed_at=50, hits=1),
+            item(b'b', 2),
+            item(b'c', 3, accessed_at=10, hits=5),
+            item(b'd', 4)
+        ]
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            EvictionPolicy()
+
+    def test_lru(self):
+        sut = LRUPolicy()
+        self.assertEqual([b'b', b'd', b'c', b'a'], [x['key'] for x in sut.get_victims(self.items, 40)])
+
+    def test_lfu(self):
+        sut = LFUPolicy()
+        self.assertEqual([b'b', b'd', b'a', b'c'], [x['key'] for x in sut.get_victims(self.items, 40)])
+
+    def test_hits_and_misses(self):
+        sut = LRUPolicy()
+        sut.on_hit(b'b', self.items[1])
+        sut.on_hit(b'x', None)
+        sut.on_miss(b'y')
+        self.assertEqual(1, self.items[1]['hits'])
+        self.assertIn('accessed_at', self.items[1])
+        self.assertEqual({'policy': 'lru', 'hits': 2, 'misses': 1, 'hit_rate': 0.6667}, sut.get_info())
+
+    def test_arc_adapts_to_ghost_hits(self):
+        sut = ARCPolicy()
+        victims = sut.get_victims(self.items, 40)
+        self.assertEqual([b'b', b'd'], [next(victims)['key'], next(victims)['key']])
+        for x in self.items[1], self.items[3]:
+            sut.on_evict(x)
+        sut.on_evict(self.items[2])
+        self.assertEqual([b'b', b'd'], list(sut.b1))
+        self.assertEqual([b'c'], list(sut.b2))
+        sut.on_miss(b'b')
+        self.assertEqual(10, sut.target)
+        self.assertEqual([b'd'], list(sut.b1))
+        victims = [x['key'] for x in sut.get_victims(self.items, 40)]
+        self.assertEqual([b'b', b'c', b'a', b'd'], victims)
+        sut.on_miss(b'c')
+        self.assertEqual(0, sut.target)
@@ -0,0 +1,38 @@
+import asyncio
+import random
+from unittest import TestCase
+from unittest.mock import Mock
+from spruned.application.jsonrpc_server import JSONRPCServer
+from spruned.application.utils.jsonrpc_client import JSONClient
+from test.utils import async_coro
+
+
+class TestJSONRPCServerGetnetworkstats(TestCase):
+    def setUp(self):
+        bindport = random.randint(31337, 41337)
+        self.sut = JSONRPCServer('127.0.0.1', bindport, 'testuser', 'testpassword')
+        self.vo_service = Mock()
+        self.sut.set_vo_service(self.vo_service)
+        self.client = JSONClient(b'testuser', b'testpassword', '127.0.0.1', bindport)
+        self.loop = asyncio.get_event_loop()
+
+    def test_getnetworkstats(self):
+        stats = {
+            'electrum': {
+                'calls': {'calls': 10, 'coalesced_calls': 2, 'inflight_calls': 0},
+                'hedges': {'requests': 8, 'hedged': 1, 'wins': 1, 'hedge_rate': 0.125, 'win_rate': 1.0}
+            },
+            'p2p': {
+                'fetches': {'interactive': {'requests': 1, 'failures': 0, 'avg_time': 0.5, 'max_time': 0.5}},
+                'hedges': {'requests': 1, 'hedged': 0, 'wins': 0, 'hedge_rate': 0.0, 'win_rate': 0}
+            }
+        }
+        self.vo_service.getnetworkstats.side_effect = [async_coro(stats)]
+
+        async def test():
+            await self.sut.start()
+            return await self.client.call('getnetworkstats')
+
+        res = self.loop.run_until_complete(test())
+        self.assertEqual(res, {'id': 1, 'result': stats, 'error': None, 'jsonrpc': '2.0'})
+        Mock.assert_called_once_with(self.vo_service.getnetworkstats)
@@ -0,0 +1,87 @@
+import asyncio
+import random
+from unittest import TestCase
+from unittest.mock import Mock, call
+from spruned.application import exceptions
+from spruned.application.jsonrpc_server import JSONRPCServer
+from spruned.application.utils.jsonrpc_client import JSONClient
+from test.utils import async_coro
+
+
+class TestJSONRPCServerPinblocks(TestCase):
+    def setUp(self):
+        bindport = random.randint(31337, 41337)
+        self.sut = JSONRPCServer('127.0.0.1', bindport, 'testuser', 'testpassword')
+        self.vo_service = Mock()
+        self.sut.set_vo_service(self.vo_service)
+        self.client = JSONClient(b'testuser', b'testpassword', '127.0.0.1', bindport)
+        self.loop = asyncio.get_event_loop()
+
+    def test_pinblocks_success(self):
+        pins = [{'start_height': 10, 'end_height': 20, 'size': 0, 'missing': 11}]
+        self.vo_service.pinblocks.side_effect = [async_coro(pins)]
+        self.vo_service.unpinblocks.side_effect = [async_coro([])]
+
+        async def test():
+            await self.sut.start()
+            response1 = await self.client.call('pinblocks', params=[10, '20'])
+            response2 = await self.client.call('unpinblocks', params=[10, 20])
+            return response1, response2
+
+        res, res2 = self.loop.run_until_complete(test())
+        self.assertEqual(res, {'id': 1, 'result': pins, 'error': None, 'jsonrpc': '2.0'})
+        self.assertEqual(res2, {'id': 1, 'result': [], 'error': None, 'jsonrpc': '2.0'})
+        Mock.assert_has_calls(self.vo_service.pinblocks, calls=[call(10, 20)])
+        Mock.assert_has_calls(self.vo_service.unpinblocks, calls=[call(10, 20)])
+
+    def test_pinblocks_errors(self):
+        self.vo_service.pinblocks.return_value = async_coro(None)
+
+        async def test():
+            await self.sut.start()
+            response1 = await self.client.call('pinblocks', params=[20, 10])
+            response2 = await self.client.call('pinblocks', params=[10, 'non_int'])
+            response3 = await self.client.call('pinblocks', params=[10, 1000000])
+            return response1, response2, response3
+
+        res, res2, res3 = self.loop.run_until_complete(test())
+        self.assertEqual(
+            res,
+            {'error': {'code': -8, 'message': 'Invalid heights range'}, 'id': 1, 'jsonrpc': '2.0', 'result': None}
+        )
+        self.assertEqual(
+            res2,
+            {'error': {'code': -5, 'message': 'Error parsing JSON:10 non_int'}, 'id': 1, 'jsonrpc': '2.0', 'result': None}
+        )
+        self.assertEqual(
+            res3,
+            {'error': {'code': -8, 'message': 'Block height out of range'}, 'id': 1, 'jsonrpc': '2.0', 'result': None}
+        )
+        Mock.assert_called_once_with(self.vo_service.pinblocks, 10, 1000000)
+
+    def test_pinblocks_more_errors(self):
+        self.vo_service.pinblocks.side_effect = [async_coro(None), exceptions.CacheLimitExceededException]
+
+        async def test():
+            await self.sut.start()
+            response1 = await self.client.call('pinblocks', params=[10, None])
+            response2 = await self.client.call('pinblocks', params=[10, 20])
+            response3 = await self.client.call('pinblocks', params=[10, 30])
+            return response1, response2, response3
+
+        res, res2, res3 = self.loop.run_until_complete(test())
+        self.assertEqual(
+            res,
+            {'error': {'code': -5, 'message': 'Error parsing JSON:10 None'}, 'id': 1, 'jsonrpc': '2.0', 'result': None}
+        )
+        self.assertEqual(
+            res2,
+            {'error': {'code': -8, 'message': 'Block height out of range'}, 'id': 1, 'jsonrpc': '2.0', 'result': None}
+        )
+        self.assertEqual(
+            res3,
+            {
+                'error': {'code': -8, 'message': 'Pinned blocks would exceed the cache size'},
+                'id': 1, 'jsonrpc': '2.0', 'result': None
+            }
+        )
@@ -21,8 +21,8 @@ class TestMempoolObserver(TestCase):
         self.repository.mempool = self.mempool_repository
         self.batcher_factory = Mock()
         self.pool = P2PConnectionPool(batcher=lambda: batcher_factory(self))
-        self.connection = Mock(connected=True, score=99)
-        self.connection2 = Mock(connected=True, score=99)
+        self.connection = Mock(connected=True, score=99, cost=None)
+        self.connection2 = Mock(connected=True, score=99, cost=None)
         self.pool.connections.append(self.connection)
         self.pool.connections.append(self.connection2)
         self.p2p_interface = P2PInterface(self.pool)
@@ -42,9 +42,17 @@ class TestMempoolObserver(TestCase):
             '92976b7c2103a1b26313f430c4b15bb1fdce663207659d8cac749a0e53d70eff01874496feff2103c96d495bfdd5ba4145e3e'
             '046fee45e84a8a48ad05bd8dbb395c011a32cf9f88053ae00000000'
         )
+        # outpoints are keyed by the hex txid, whatever type the parser gives the previous hash
+        tx.txs_in[0].previous_hash = bytes(tx.txs_in[0].previous_hash)
         self.loop.run_until_complete(self.sut.on_transaction(connection, {'tx': tx}))
         self.assertEqual(tx.w_id(), [x for x in self.mempool_repository.get_txids()][0])
-        self.repository.blockchain.get_transactions_by_block_hash.return_value = [], None
+        self.assertTrue(
+            self.mempool_repository.is_spent('9d62beff5a560134e7704094f0bdcd1cd31bb67ccb592257cf5626d79f642a11', 1)
+        )
+        self.assertFalse(
+            self.mempool_repository.is_spent('9d62beff5a560134e7704094f0bdcd1cd31bb67ccb592257cf5626d79f642a11', 0)
+        )
+        self.repository.blockchain.get_block_object.return_value = None
 
         block = Block(1, b'0'*32, merkle_root=merkle([tx.hash()]), timestamp=123456789, difficulty=3000000, nonce=1*137)
         block.txs.append(tx)
@@ -75,7 +83,7 @@ class TestMempoolObserver(TestCase):
             mempool_response
         )
         self.repository.blockchain.save_block.side_effect = lambda a: {'block_object': Block.from_bin(a['block_bytes'])}
-        self.repository.blockchain.get_transactions_by_block_hash.return_value = [], None
+        self.repository.blockchain.get_block_object.return_value = None
         self.loop.run_until_complete(self.sut.on_block_header(block_header))
         self.assertEqual(self.mempool_repository.get_raw_mempool(True), {})
         self.assertEqual([x for x in self.mempool_repository.get_txids()], [])
@@ -0,0 +1,94 @@
+import asyncio
+from unittest import TestCase
+from unittest.mock import Mock, call
+
+from spruned.application.prefetcher import BlocksPrefetcher
+
+
+class TestBlocksPrefetcher(TestCase):
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+        self.repository = Mock()
+        self.repository.headers.get_block_hash.side_effect = lambda h: 'hash%s' % h
+        self.saved = set()
+        self.repository.blockchain.get_block_index.side_effect = lambda h: h in self.saved
+
+        def save_block(block, tracker=None):
+            self.saved.add(block['block_hash'])
+            return dict(block, saved=True)
+        self.repository.blockchain.save_block.side_effect = save_block
+        self.p2p = Mock()
+        self.downloads = []
+
+        async def get_blocks(*blockhashes):
+            self.downloads.append(blockhashes)
+            return {h: {'block_hash': h} for h in blockhashes}
+        self.p2p.get_blocks.side_effect = get_blocks
+        self.cache = Mock()
+        self.sut = BlocksPrefetcher(
+            self.repository, self.p2p, cache_agent=self.cache, depth=3, budget=4, loop=self.loop
+        )
+
+    def _request(self, *heights):
+        for height in heights:
+            self.sut.on_block_request({'block_height': height})
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+
+    def test_ascending(self):
+        self._request(10, 11)
+        Mock.assert_not_called(self.p2p.get_blocks)
+        self._request(12)
+        self.assertEqual([('hash13', 'hash14', 'hash15')], self.downloads)
+        Mock.assert_has_calls(
+            self.repository.blockchain.save_block,
+            calls=[call({'block_hash': 'hash13'}, tracker=self.cache)]
+        )
+
+    def test_descending_skips_stored_blocks(self):
+        self.saved.add('hash7')
+        self._request(10, 9, 8)
+        self.assertEqual([('hash6', 'hash5')], self.downloads)
+
+    def test_interleaved_streams(self):
+        self._request(10, 500, 11, 501, 12, 502)
+        self.assertEqual([('hash13', 'hash14', 'hash15'), ('hash503', 'hash504', 'hash505')], self.downloads)
+
+    def test_random_access(self):
+        self._request(10, 20, 30, 40, 20)
+        Mock.assert_not_called(self.p2p.get_blocks)
+
+    def test_wait_for_pending_block_and_cancel_idle(self):
+        future = self.loop.create_future()
+
+        async def get_blocks(*blockhashes):
+            return await future
+        self.p2p.get_blocks.side_effect = get_blocks
+        self._request(1, 2, 3)
+        self.assertEqual(['hash4', 'hash5', 'hash6'], sorted(self.sut._pending))
+        waiter = self.loop.create_task(self.sut.wait_for('hash4'))
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        future.set_result({'hash4': {'block_hash': 'hash4'}})
+        self.assertEqual({'block_hash': 'hash4', 'saved': True}, self.loop.run_until_complete(waiter))
+        self.assertIsNone(self.loop.run_until_complete(self.sut.wait_for('hash4')))
+
+        future = self.loop.create_future()
+        self._request(4)
+        task = self.sut._streams[0]['task']
+        self.assertFalse(task.done())
+        self.sut._streams[0]['seen_at'] = 0
+        self._request(100)
+        self.assertTrue(task.cancelled())
+        self.assertEqual({}, self.sut._pending)
+
+    def test_budget(self):
+        future = self.loop.create_future()
+
+        async def get_blocks(*blockhashes):
+            self.downloads.append(blockhashes)
+            return await future
+        self.p2p.get_blocks.side_effect = get_blocks
+        self._request(10, 500, 11, 501, 12, 502)
+        self.assertEqual([('hash13', 'hash14', 'hash15'), ('hash503',)], self.downloads)
+        future.cancel()
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.assertEqual({}, self.sut._pending)
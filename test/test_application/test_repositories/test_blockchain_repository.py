@@ -0,0 +1,344 @@
+import binascii
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock, call
+
+from pycoin.block import Block
+from pycoin.encoding import double_sha256
+from pycoin.merkle import merkle
+from pycoin.tx.Tx import Tx
+
+from spruned.repositories.block_files import BlockFiles, compress, ZLIB
+from spruned.repositories.blockchain_repository import BlockchainRepository
+
+
+class DictSession:
+    def __init__(self):
+        self.data = {}
+
+    def put(self, key, value):
+        self.data[key] = value
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def iterator(self, prefix=b''):
+        return iter(sorted((k, v) for k, v in self.data.items() if k.startswith(prefix)))
+
+
+TX = binascii.unhexlify(
+    '01000000010000000000000000000000000000000000000000000000000000000000000000ffffffff0704ffff001d0104ffffffff'
+    '0100f2052a0100000043410496b538e853519c726a2c91e61ec11600ae1390813a627c66fb8be7947be63c52da7589379515d4e0'
+    'a604f8141781e62294721166bf621e73a82cbf2342c858eeac00000000'
+)
+HEADER = binascii.unhexlify(
+    '010000006fe28c0ab6f1b372c1a6a246ae63f74f931e8365e15a089c68d6190000000000982051fd1e4ba744bbbe680e1fee1467'
+    '7ba1a3c3540bf7b1cdb606e857233e0e61bc6649ffff001d01e36299'
+)
+
+
+def make_block(nonce: int, txs: int=2):
+    transactions = [(nonce * 16 + i + 1).to_bytes(4, 'little') + TX[4:] for i in range(txs)]
+    merkle_root = merkle([Tx.from_bin(tx).hash() for tx in transactions], double_sha256)
+    header = HEADER[:36] + merkle_root + HEADER[68:-4] + nonce.to_bytes(4, 'little')
+    block_bytes = header + bytes([txs]) + b''.join(transactions)
+    return {
+        'block_hash': Block.from_bin(block_bytes).id(),
+        'block_bytes': block_bytes
+    }, transactions
+
+
+class TestBlockFiles(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.sut = BlockFiles(self.path, max_file_size=100)
+
+    def tearDown(self):
+        self.sut.close()
+        shutil.rmtree(self.path)
+
+    def test_append_rotate_read(self):
+        self.assertEqual((0, 0, 80), self.sut.append(b'\x01' * 80))
+        self.assertEqual((0, 80, 30), self.sut.append(b'\x02' * 30))
+        self.assertEqual((1, 0, 10), self.sut.append(b'\x03' * 10))
+        self.assertEqual([0, 1], self.sut.get_files())
+        self.assertEqual(b'\x02' * 30, self.sut.read(0, 80, 30))
+        self.assertEqual(b'\x03' * 10, self.sut.read(1, 0, 10))
+        self.assertIsNone(self.sut.read(1, 5, 10))
+
+    def test_remove_file(self):
+        self.sut.append(b'\x01' * 120)
+        self.sut.append(b'\x02' * 10)
+        view = self.sut.read(0, 0, 120)
+        self.assertFalse(self.sut.remove_file(1))
+        self.assertTrue(self.sut.remove_file(0))
+        self.assertEqual([1], self.sut.get_files())
+        self.assertEqual(b'\x01' * 120, view)
+        self.assertIsNone(self.sut.read(0, 0, 120))
+
+    def test_remove_current_file_on_rotation(self):
+        self.sut.append(b'\x01' * 50)
+        self.assertFalse(self.sut.remove_file(0))
+        self.sut.append(b'\x02' * 60)
+        self.assertFalse(self.sut.remove_file(0))
+        self.sut.append(b'\x03' * 10)
+        self.assertEqual([1], self.sut.get_files())
+
+    def test_current_file_kept_if_written_again(self):
+        self.sut.append(b'\x01' * 50)
+        self.assertFalse(self.sut.remove_file(0))
+        self.sut.append(b'\x02' * 60)
+        self.sut.append(b'\x03' * 10)
+        self.assertEqual([0, 1], self.sut.get_files())
+
+    def test_remap_closes_previous_map(self):
+        self.sut.append(b'\x01' * 10)
+        self.assertEqual(b'\x01' * 10, bytes(self.sut.read(0, 0, 10)))
+        _map = self.sut._maps[0]
+        self.sut.append(b'\x02' * 10)
+        self.assertEqual(b'\x02' * 10, bytes(self.sut.read(0, 10, 10)))
+        self.assertTrue(_map.closed)
+
+    def test_resume_on_last_file(self):
+        self.sut.append(b'\x01' * 120)
+        self.sut.append(b'\x02' * 10)
+        self.sut.close()
+        sut = BlockFiles(self.path, max_file_size=100)
+        self.assertEqual((1, 10, 5), sut.append(b'\x03' * 5))
+        sut.close()
+
+
+class TestBlockchainRepository(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.block_files = BlockFiles(self.path, max_file_size=400)
+        self.session = DictSession()
+        self.sut = BlockchainRepository(self.session, b'b', '', block_files=self.block_files)
+
+    def tearDown(self):
+        self.block_files.close()
+        shutil.rmtree(self.path)
+
+    def test_save_and_serve_block(self):
+        block, transactions = make_block(1)
+        tracker = Mock()
+        self.sut.save_block(block, tracker=tracker)
+        self.assertEqual(block['block_bytes'], self.sut.get_block_bytes(block['block_hash']))
+        txids, size = self.sut.get_txids_by_block_hash(block['block_hash'])
+        self.assertEqual(len(block['block_bytes']), size)
+        self.assertEqual([tx.id() for tx in block['block_object'].txs], txids)
+        for txid, tx_bytes in zip(txids, transactions):
+            transaction = self.sut.get_transaction(txid)
+            self.assertIsInstance(transaction['transaction_bytes'], memoryview)
+            self.assertEqual(tx_bytes, transaction['transaction_bytes'])
+            self.assertEqual(block['block_hash'], binascii.hexlify(transaction['block_hash']).decode())
+        transactions, size = self.sut.get_transactions_by_block_hash(block['block_hash'])
+        self.assertEqual(2, len(transactions))
+        Mock.assert_called_once_with(tracker.track, b'\x02.' + binascii.unhexlify(block['block_hash']), size)
+
+    def test_save_block_twice(self):
+        block, _ = make_block(1)
+        self.sut.save_block(block)
+        self.sut.save_block(dict(block))
+        self.assertEqual([0], self.block_files.get_files())
+        self.assertEqual(len(block['block_bytes']), self.block_files.append(b'')[1])
+
+    def test_remove_blocks_and_files(self):
+        blocks = [make_block(i)[0] for i in range(4)]
+        for block in blocks:
+            self.sut.save_block(block)
+        self.assertEqual([0, 1], self.block_files.get_files())
+        txids, _ = self.sut.get_txids_by_block_hash(blocks[0]['block_hash'])
+        self.sut.remove_block(blocks[0]['block_hash'])
+        self.assertIsNone(self.sut.get_block_bytes(blocks[0]['block_hash']))
+        self.assertIsNone(self.sut.get_transaction(txids[0]))
+        self.assertEqual([0, 1], self.block_files.get_files())
+        for block in blocks[1:3]:
+            self.sut.remove_block(block['block_hash'])
+        self.assertEqual([1], self.block_files.get_files())
+        self.assertEqual(blocks[3]['block_bytes'], self.sut.get_block_bytes(blocks[3]['block_hash']))
+
+    def test_compressed_block(self):
+        blocks = [make_block(i)[0] for i in range(2)]
+        for block in blocks:
+            self.sut.save_block(block)
+        txids, size = self.sut.get_txids_by_block_hash(blocks[0]['block_hash'])
+        transaction = bytes(self.sut.get_transaction(txids[1])['transaction_bytes'])
+        compressed = compress(ZLIB, blocks[0]['block_bytes'])
+        self.assertEqual(
+            len(compressed), self.sut.save_compressed_block(blocks[0]['block_hash'], ZLIB, compressed)
+        )
+        self.assertIsNone(self.sut.save_compressed_block(blocks[0]['block_hash'], ZLIB, compressed))
+        self.assertEqual(ZLIB, self.sut.get_block_codec(blocks[0]['block_hash']))
+        self.assertEqual(blocks[0]['block_bytes'], self.sut.get_block_bytes(blocks[0]['block_hash']))
+        self.assertEqual((txids, size), self.sut.get_txids_by_block_hash(blocks[0]['block_hash']))
+        self.assertEqual(transaction, self.sut.get_transaction(txids[1])['transaction_bytes'])
+        self.assertEqual([0, 1], self.block_files.get_files())
+        self.sut.save_compressed_block(blocks[1]['block_hash'], ZLIB, compress(ZLIB, blocks[1]['block_bytes']))
+        self.assertEqual([1], self.block_files.get_files())
+        self.sut.remove_block(blocks[0]['block_hash'])
+        self.assertIsNone(self.sut.get_transaction(txids[1]))
+        self.assertEqual(blocks[1]['block_bytes'], self.sut.get_block_bytes(blocks[1]['block_hash']))
+
+    def test_compact_block_files(self):
+        blocks = [make_block(i)[0] for i in range(3)]
+        for block in blocks:
+            self.sut.save_block(block)
+        self.assertEqual([0, 1], self.block_files.get_files())
+        self.sut.save_compressed_block(blocks[0]['block_hash'], ZLIB, compress(ZLIB, blocks[0]['block_bytes']))
+        self.assertEqual(0, self.sut.compact_block_files())
+        txids, _ = self.sut.get_txids_by_block_hash(blocks[1]['block_hash'])
+        transaction = bytes(self.sut.get_transaction(txids[1])['transaction_bytes'])
+        self.assertEqual(1, self.sut.compact_block_files(max_dead_ratio=0.4))
+        self.assertEqual([1, 2], self.block_files.get_files())
+        for block in blocks:
+            self.assertEqual(block['block_bytes'], self.sut.get_block_bytes(block['block_hash']))
+        self.assertEqual(transaction, bytes(self.sut.get_transaction(txids[1])['transaction_bytes']))
+        self.assertEqual(0, self.sut.get_block_codec(blocks[1]['block_hash']))
+        self.assertEqual((2, self.block_files.get_file_size(1)), self.sut._get_block_file_refs(1))
+        self.assertEqual((1, self.block_files.get_file_size(2)), self.sut._get_block_file_refs(2))
+
+    def test_stored_watermark(self):
+        blocks = [make_block(i)[0] for i in range(3)]
+        self.sut.save_block(blocks[0])
+        self.sut.stored_watermark = {'below_hash': blocks[1]['block_hash']}
+        self.sut.save_block(blocks[2])
+        self.assertIsNotNone(self.sut.stored_watermark)
+        self.sut.save_block(blocks[1])
+        self.assertIsNone(self.sut.stored_watermark)
+        self.sut.stored_watermark = {'below_hash': None}
+        self.sut.remove_block(blocks[0]['block_hash'])
+        self.assertIsNone(self.sut.stored_watermark)
+
+    def test_remove_unreferenced_block_files(self):
+        blocks = [make_block(i)[0] for i in range(3)]
+        for block in blocks:
+            self.sut.save_block(block)
+        self.assertEqual([0, 1], self.block_files.get_files())
+        for block in blocks:
+            self.sut.remove_block(block['block_hash'])
+        self.assertEqual([1], self.block_files.get_files())
+        # restarted before the current file was rotated
+        self.block_files.close()
+        self.block_files = self.sut.block_files = BlockFiles(self.path, max_file_size=400)
+        self.block_files.append(b'\x00' * 400)
+        self.sut.remove_unreferenced_block_files()
+        self.assertEqual([1], self.block_files.get_files())
+        self.block_files.append(b'\x00')
+        self.sut.remove_unreferenced_block_files()
+        self.assertEqual([2], self.block_files.get_files())
+
+    def test_decoded_transactions(self):
+        block, _ = make_block(1)
+        self.sut.save_decoded_transactions(block['block_hash'], b'[]', 10)
+        self.assertEqual((None, None), self.sut.get_decoded_transactions(block['block_hash']))
+        self.sut.save_block(block)
+        self.sut.save_decoded_transactions(block['block_hash'], b'[{"txid": "aa"}]', len(block['block_bytes']))
+        self.assertEqual(
+            (b'[{"txid": "aa"}]', len(block['block_bytes'])), self.sut.get_decoded_transactions(block['block_hash'])
+        )
+        self.sut.remove_block(block['block_hash'])
+        self.assertEqual((None, None), self.sut.get_decoded_transactions(block['block_hash']))
+
+    def test_decoded_transactions_charged_to_cache(self):
+        block, _ = make_block(1)
+        cache = Mock()
+        self.sut.set_cache(cache)
+        self.sut.save_block(block)
+        self.sut.save_decoded_transactions(block['block_hash'], b'[{"txid": "aa"}]', len(block['block_bytes']))
+        self.sut.save_decoded_transactions(block['block_hash'], b'[{"txid": "aa"}]', len(block['block_bytes']))
+        Mock.assert_called_once_with(
+            cache.charge, self.sut.get_key(block['block_hash'], prefix=b'\x02'), 4 + len(b'[{"txid": "aa"}]')
+        )
+
+    def test_record_access(self):
+        cache = Mock()
+        self.sut.set_cache(cache)
+        block, _ = make_block(1)
+        self.sut.save_block(block)
+        key = b'\x02.' + binascii.unhexlify(block['block_hash'])
+        txids, _ = self.sut.get_txids_by_block_hash(block['block_hash'])
+        self.sut.get_block_bytes(block['block_hash'])
+        self.sut.get_transaction(txids[0])
+        self.sut.get_transactions_by_block_hash(block['block_hash'])
+        self.assertEqual([call(key)] * 4, cache.record_hit.call_args_list)
+        self.sut.get_block_bytes(block['block_hash'], record_access=False)
+        self.sut.remove_block(block['block_hash'])
+        self.assertEqual(4, cache.record_hit.call_count)
+        Mock.assert_not_called(cache.record_miss)
+        self.sut.get_block_bytes(block['block_hash'])
+        self.sut.get_transaction(txids[0])
+        self.assertEqual([call(key), call(None)], cache.record_miss.call_args_list)
+
+    def test_hot_cache(self):
+        block, _ = make_block(1)
+        self.sut.save_block(block)
+        self.assertIs(block['block_object'], self.sut.get_block_object(block['block_hash']))
+        self.sut.hot_cache.clear()
+        block_object = self.sut.get_block_object(block['block_hash'])
+        self.assertEqual(block['block_object'].id(), block_object.id())
+        self.assertIs(block_object, self.sut.get_cached_block_object(block['block_hash']))
+        self.sut.cache_verbose_block(block['block_hash'], {'tx': []})
+        self.sut.remove_block(block['block_hash'])
+        self.assertIsNone(self.sut.get_cached_block_object(block['block_hash']))
+        self.assertIsNone(self.sut.get_cached_verbose_block(block['block_hash']))
+
+    def test_compressed_block_bytes_are_inflated_once(self):
+        block, transactions = make_block(1)
+        self.sut.save_block(block)
+        self.sut.save_compressed_block(block['block_hash'], ZLIB, compress(ZLIB, block['block_bytes']))
+        txids, _ = self.sut.get_txids_by_block_hash(block['block_hash'])
+        self.assertEqual(transactions[0], self.sut.get_transaction(txids[0])['transaction_bytes'])
+        self.block_files.read = Mock()
+        self.assertEqual(transactions[1], self.sut.get_transaction(txids[1])['transaction_bytes'])
+        self.assertEqual(block['block_bytes'], self.sut.get_block_bytes(block['block_hash']))
+        Mock.assert_not_called(self.block_files.read)
+
+    def test_confirmed_transactions(self):
+        self.sut.confirmed_transactions_size = 2 * (42 + len(TX)) + 96
+        proof = {'block_height': 1, 'merkle': ['aa' * 32, 'bb' * 32], 'pos': 3}
+        for i in range(3):
+            self.sut.save_confirmed_transaction('%064x' % i, TX, 'cc' * 32, dict(proof, merkle=proof['merkle'][:i]))
+        self.assertIsNone(self.sut.get_confirmed_transaction('%064x' % 0))
+        self.assertEqual(
+            {
+                'transaction_bytes': TX,
+                'block_hash': 'cc' * 32,
+                'merkle_proof': {'block_height': 1, 'merkle': ['aa' * 32], 'pos': 3}
+            },
+            self.sut.get_confirmed_transaction('%064x' % 1)
+        )
+        self.sut.save_confirmed_transaction('%064x' % 3, TX, 'cc' * 32, proof)
+        self.assertIsNone(self.sut.get_confirmed_transaction('%064x' % 2))
+        self.assertIsNotNone(self.sut.get_confirmed_transaction('%064x' % 1))
+        self.sut.remove_confirmed_transaction('%064x' % 1)
+        self.assertIsNone(self.sut.get_confirmed_transaction('%064x' % 1))
+        sut = BlockchainRepository(self.session, b'b', '', block_files=self.block_files)
+        sut._load_confirmed_transactions()
+        self.assertEqual(42 + 64 + len(TX), sut._confirmed_transactions_total)
+
+    def test_spends(self):
+        block, transactions = make_block(1, txs=3)
+        spending = TX[:5] + binascii.unhexlify(Tx.from_bin(transactions[0]).id())[::-1] + \
+            (1).to_bytes(4, 'little') + TX[41:]
+        block_bytes = block['block_bytes'][:80] + b'\x04' + block['block_bytes'][81:] + spending
+        merkle_root = merkle([Tx.from_bin(tx).hash() for tx in transactions + [spending]], double_sha256)
+        block_bytes = block_bytes[:36] + merkle_root + block_bytes[68:]
+        block = {'block_hash': Block.from_bin(block_bytes).id(), 'block_bytes': block_bytes}
+        self.sut.save_block(block)
+        txid = Tx.from_bin(transactions[0]).id()
+        self.assertEqual(
+            {
+                'txid': binascii.unhexlify(Tx.from_bin(spending).id()),
+                'block_hash': binascii.unhexlify(block['block_hash'])
+            },
+            self.sut.get_spend(txid, 1)
+        )
+        self.assertIsNone(self.sut.get_spend(txid, 0))
+        self.sut.hot_cache.clear()
+        self.sut.remove_block(block['block_hash'])
+        self.assertIsNone(self.sut.get_spend(txid, 1))
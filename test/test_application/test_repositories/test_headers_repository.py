@@ -3,10 +3,12 @@ import unittest
 import binascii
 
 from spruned import settings
+from spruned.repositories.headers_index import HeadersIndex
 from spruned.repositories.headers_repository import HeadersSQLiteRepository
 from spruned.application.database import sqlite
 from spruned.daemon import exceptions
-from test.utils import make_headers
+from spruned.daemon.electrod.electrod_chunks import HeadersChunkValidator
+from test.utils import make_headers, make_chunk
 
 
 class TestHeadersRepository(unittest.TestCase):
@@ -85,6 +87,12 @@ class TestHeadersRepository(unittest.TestCase):
         header3 = self.sut.get_header_at_height(3)
         self.assertEqual(header3.pop('next_block_hash'), headers[4]['block_hash'])
         self.assertEqual(header3, headers[3])
+        self.assertEqual(
+            self.sut.get_chain_stats(1),
+            {'chainwork': '%064x' % 0x200020002, 'difficulty': 1.0, 'mediantime': 1231469665}
+        )
+        self.assertEqual(self.sut.get_chain_stats(4)['chainwork'], '%064x' % 0x500050005)
+        self.assertEqual(HeadersSQLiteRepository(sqlite).get_chain_stats(4), self.sut.get_chain_stats(4))
 
         headers2 = [
             {
@@ -192,3 +200,96 @@ class TestHeadersRepository(unittest.TestCase):
                 "497783c8ecca2cf61a4f002ec8898024230787f399cb575d949ffff001d3a5de07f"),
                 "0000000099c744455f58e6c6e98b671e1bf7f37346bfd4cf5d0274ad8ee660cb"
             )
+
+    def test_headers_repository_index(self):
+        """
+        reads are served by the in-memory index, which is rebuilt from the db at startup
+        """
+        self.sut.remove_headers_after_height(0)
+        headers = make_headers(0, 10)
+        for header in headers:
+            self.sut.index.append(
+                header['block_height'], binascii.unhexlify(header['block_hash']), header['header_bytes']
+            )
+        self.assertEqual(len(self.sut.index), 10)
+        self.assertEqual(self.sut.index.get_height(binascii.unhexlify(headers[3]['block_hash'])), 3)
+        self.assertEqual(self.sut.index.get_header(3), headers[3]['header_bytes'])
+        self.sut.index.truncate(7)
+        self.assertEqual(self.sut.index.best_height, 6)
+        self.assertIsNone(self.sut.index.get_hash(7))
+        self.assertIsNone(self.sut.index.get_height(binascii.unhexlify(headers[8]['block_hash'])))
+        with self.assertRaises(exceptions.HeadersInconsistencyException):
+            self.sut.index.append(8, binascii.unhexlify(headers[8]['block_hash']), headers[8]['header_bytes'])
+
+        self.sut.load_index()
+        self.assertIsNone(self.sut.get_best_header())
+        genesis = {
+            'block_hash': '000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f',
+            'block_height': 0,
+            'header_bytes': binascii.unhexlify(
+                '0100000000000000000000000000000000000000000000000000000000000000000000'
+                '003ba3edfd7a7b12b27ac72c3e67768f617fc81bc3888a51323a9fb8aa4b1e5e4a29ab5f49ffff001d1dac2b7c'
+            ),
+        }
+        self.sut.save_header(genesis['block_hash'], 0, genesis['header_bytes'], None)
+        other = HeadersSQLiteRepository(sqlite)
+        self.assertEqual(other.get_best_header(), genesis)
+        self.assertEqual(other.get_block_header(genesis['block_hash']), genesis)
+        self.assertEqual(other.get_headers_since_height(-10), [genesis])
+        self.assertIsNone(other.get_block_hash(1))
+
+    def test_headers_repository_ingest_headers(self):
+        self.sut.remove_headers_after_height(0)
+        headers = make_headers(0, 4032)
+        self.assertEqual(self.sut.ingest_headers(headers[:2016], check_pow=False), headers[:2016])
+        self.assertEqual(self.sut.ingest_headers(headers[2016:], check_pow=False), headers[2016:])
+        self.assertEqual(self.sut.get_best_header()['block_hash'], headers[-1]['block_hash'])
+        self.assertEqual(HeadersSQLiteRepository(sqlite).get_header_at_height(2016)['block_hash'],
+                         headers[2016]['block_hash'])
+
+        orphans = make_headers(4032, 4034, '00' * 32)
+        with self.assertRaises(exceptions.HeadersInconsistencyException):
+            self.sut.ingest_headers(orphans, check_pow=False)
+
+        broken = make_headers(4032, 4034, headers[-1]['block_hash'])
+        broken[1]['prev_block_hash'] = '00' * 32
+        with self.assertRaises(exceptions.HeadersInconsistencyException):
+            self.sut.ingest_headers(broken, check_pow=False)
+        self.assertEqual(self.sut.index.best_height, 4031)
+        self.assertEqual(HeadersSQLiteRepository(sqlite).index.best_height, 4031)
+
+    def test_headers_repository_backfill_headers(self):
+        self.sut.remove_headers_after_height(0)
+        headers = HeadersChunkValidator({}).validate(make_chunk(30), 0)
+        self.assertEqual(self.sut.backfill_headers(headers[20:]), headers[20:])
+        self.assertEqual(self.sut.get_lowest_header()['block_height'], 20)
+        self.assertNotIn('chainwork', self.sut.get_chain_stats(25))
+        self.assertIsNone(self.sut.index.get_chainwork(25))
+        self.assertIsNone(self.sut.get_header_at_height(19))
+        self.assertEqual(self.sut.ingest_headers(make_headers(30, 32, headers[-1]['block_hash'])[:1],
+                                                 check_pow=False)[0]['block_height'], 30)
+        with self.assertRaises(exceptions.HeadersInconsistencyException):
+            self.sut.backfill_headers(headers[5:15])
+        with self.assertRaises(exceptions.HeadersInconsistencyException):
+            self.sut.backfill_headers(make_headers(10, 20, headers[9]['block_hash']))
+
+        self.assertEqual(self.sut.backfill_headers(headers[10:20]), headers[10:20])
+        self.assertEqual(self.sut.backfill_headers(headers[:10]), headers[:10])
+        self.assertEqual(self.sut.get_lowest_header()['block_height'], 0)
+        self.assertIn('chainwork', self.sut.get_chain_stats(25))
+        self.assertEqual(self.sut.get_header_at_height(19)['next_block_hash'], headers[20]['block_hash'])
+        self.assertEqual(self.sut.get_block_height(headers[7]['block_hash']), 7)
+        index = HeadersSQLiteRepository(sqlite).index
+        self.assertEqual((index.start_height, index.best_height), (0, 30))
+        expected = HeadersIndex()
+        for header in headers + [self.sut.get_header_at_height(30)]:
+            expected.append(header['block_height'], binascii.unhexlify(header['block_hash']), header['header_bytes'])
+        for height in range(31):
+            self.assertEqual(
+                (index.get_chainwork(height), index.get_mediantime(height)),
+                (expected.get_chainwork(height), expected.get_mediantime(height))
+            )
+            self.assertEqual(
+                (self.sut.index.get_chainwork(height), self.sut.index.get_mediantime(height)),
+                (expected.get_chainwork(height), expected.get_mediantime(height))
+            )
@@ -0,0 +1,36 @@
+from unittest import TestCase
+
+from spruned.repositories.hot_cache import HotCache, BLOCK_OBJECT, VERBOSE_BLOCK
+
+
+class TestHotCache(TestCase):
+    def setUp(self):
+        self.sut = HotCache(max_size=100)
+
+    def test_get_put(self):
+        self.assertIsNone(self.sut.get(BLOCK_OBJECT, 'aa'))
+        self.sut.put(BLOCK_OBJECT, 'aa', 'block', 10)
+        self.assertEqual('block', self.sut.get(BLOCK_OBJECT, b'\xaa'))
+        self.assertIsNone(self.sut.get(VERBOSE_BLOCK, 'aa'))
+        self.sut.put(BLOCK_OBJECT, 'aa', 'block', 20)
+        self.assertEqual({'entries': 1, 'size': 20, 'limit': 100, 'hits': 1, 'misses': 2}, self.sut.get_info())
+
+    def test_evicts_least_recently_used(self):
+        self.sut.put(BLOCK_OBJECT, 'aa', 'a', 40)
+        self.sut.put(BLOCK_OBJECT, 'bb', 'b', 40)
+        self.sut.get(BLOCK_OBJECT, 'aa')
+        self.sut.put(VERBOSE_BLOCK, 'cc', 'c', 40)
+        self.assertIsNone(self.sut.get(BLOCK_OBJECT, 'bb'))
+        self.assertEqual('a', self.sut.get(BLOCK_OBJECT, 'aa'))
+        self.assertEqual(80, self.sut.size)
+        self.sut.put(BLOCK_OBJECT, 'dd', 'd', 101)
+        self.assertIsNone(self.sut.get(BLOCK_OBJECT, 'dd'))
+
+    def test_invalidate(self):
+        self.sut.put(BLOCK_OBJECT, 'aa', 'a', 10)
+        self.sut.put(VERBOSE_BLOCK, 'aa', {}, 10)
+        self.sut.put(BLOCK_OBJECT, 'bb', 'b', 10)
+        self.sut.invalidate(b'\xaa')
+        self.assertEqual(10, self.sut.size)
+        self.assertIsNone(self.sut.get(VERBOSE_BLOCK, 'aa'))
+        self.assertEqual('b', self.sut.get(BLOCK_OBJECT, 'bb'))
@@ -137,3 +137,9 @@ class TestMempoolRepository(TestCase):
             'usage': 0
         }
         self.assertEqual(self.sut.get_mempool_info(), expected)
+
+    def test_is_spent(self):
+        self.sut.add_seen('txid1', 'test')
+        self.sut.add_transaction('txid1', self._get_transaction('txid1', 100, ['cafe:1']))
+        self.assertTrue(self.sut.is_spent('cafe', 1))
+        self.assertFalse(self.sut.is_spent('cafe', 0))
@@ -67,3 +67,39 @@ class TestRepository(TestCase):
         self.blocks.get_key.side_effect = lambda x, y: b'block_prefix.' + BLOCK_INDEX_PREFIX + b'.' + x.encode()
         self.cache.get_index.return_value = None
         Mock.assert_not_called(self.blocks.remove_block)
+
+    def test_get_stored_since_height(self):
+        chain = {h: 'block%s' % h for h in range(10, 17)}
+        stored = {'block%s' % h for h in range(12, 17)}
+        self.blocks.stored_watermark = None
+        self.headers.get_best_header.side_effect = lambda: {'block_height': max(chain), 'block_hash': chain[max(chain)]}
+        self.headers.get_block_hash.side_effect = chain.get
+        self.headers.get_headers_since_height.side_effect = lambda height: [
+            {'block_height': h, 'block_hash': chain[h]} for h in range(height, max(chain) + 1)
+        ]
+        self.blocks.get_block_index.side_effect = lambda blockhash: blockhash in stored and b'index' or None
+
+        self.assertEqual(12, self.sut.get_stored_since_height())
+        self.assertEqual('block11', self.blocks.stored_watermark['below_hash'])
+        lookups = self.blocks.get_block_index.call_count
+        self.assertEqual(12, self.sut.get_stored_since_height())
+        self.assertEqual(lookups, self.blocks.get_block_index.call_count)
+
+        # a new best block, missing and then saved
+        chain[17] = 'block17'
+        self.assertIsNone(self.sut.get_stored_since_height())
+        stored.add('block17')
+        self.assertEqual(12, self.sut.get_stored_since_height())
+        self.assertEqual(lookups + 2, self.blocks.get_block_index.call_count)
+
+        # the blocks out of keep_blocks are not looked up
+        self.blocks.stored_watermark = None
+        stored.update({'block10', 'block11'})
+        self.assertEqual(13, self.sut.get_stored_since_height())
+
+        # a reorg drops the watermark top
+        self.blocks.stored_watermark = None
+        self.sut.get_stored_since_height()
+        chain[17] = 'block17b'
+        self.assertEqual(18, self.sut.get_stored_since_height())
+        self.assertEqual('block17b', self.blocks.stored_watermark['top_hash'])
@@ -0,0 +1,89 @@
+import binascii
+import json
+from unittest import TestCase
+
+from spruned.application.networks.bitcoin import mainnet, testnet
+from spruned.application.tx_decoder import decode_transaction, script_to_asm, get_script_type, \
+    serialize_transactions
+
+
+class TestTxDecoder(TestCase):
+    def test_decode_segwit_transaction(self):
+        tx = binascii.unhexlify(
+            '01000000000101531213685738c91df5ceb1537605b4e17d0e623c34ead12b9e285495cd5da9b80000000000ffffffff0248d'
+            '00500000000001976a914fa511ca56ee17f57b8190ad490c4e5bf7ef0e34b88ac951e00000000000016001458e05b9b412c3b'
+            '4f35bdb54f47376beaeb8f81aa024830450221008a6edb6ce73676d4065ffb810f3945b3c3554025d3d7545bfca7185aaff62'
+            '0cc022066e2f0640aeb0775e4b47701472b28d1018b4ab8fd688acbdcd757b75c2731b6012103dfc2e6847645ca8057120780'
+            'e5ae6fa84be76b39465cd2a5158d1fffba78b22600000000'
+        )
+        res = decode_transaction(tx, mainnet)
+        self.assertEqual('dbae729fc6cce1bc922e66f4f12eb2b43ef57406bf5a0818eb2e73696b713b91', res['txid'])
+        self.assertEqual('8df5deee08f092260a10e83263e671df7bf4bed031f79fd2081a1c08e9582b3d', res['hash'])
+        self.assertEqual((226, 144), (res['size'], res['vsize']))
+        self.assertEqual(binascii.hexlify(tx).decode(), res['hex'])
+        self.assertEqual(
+            {
+                'txid': 'b8a95dcd9554289e2bd1ea343c620e7de1b4057653b1cef51dc9385768131253',
+                'vout': 0,
+                'scriptSig': {'asm': '', 'hex': ''},
+                'txinwitness': [
+                    '30450221008a6edb6ce73676d4065ffb810f3945b3c3554025d3d7545bfca7185aaff620cc022066e2f0640aeb0775e'
+                    '4b47701472b28d1018b4ab8fd688acbdcd757b75c2731b601',
+                    '03dfc2e6847645ca8057120780e5ae6fa84be76b39465cd2a5158d1fffba78b226'
+                ],
+                'sequence': 4294967295
+            },
+            res['vin'][0]
+        )
+        self.assertEqual(
+            {
+                'value': '0.00381000',
+                'n': 0,
+                'scriptPubKey': {
+                    'asm': 'OP_DUP OP_HASH160 fa511ca56ee17f57b8190ad490c4e5bf7ef0e34b OP_EQUALVERIFY OP_CHECKSIG',
+                    'hex': '76a914fa511ca56ee17f57b8190ad490c4e5bf7ef0e34b88ac',
+                    'reqSigs': 1,
+                    'type': 'pubkeyhash',
+                    'addresses': ['1PpZ6iFNrxw5LoCgv8MZAgrySeULtGzsku']
+                }
+            },
+            res['vout'][0]
+        )
+        self.assertEqual('witness_v0_keyhash', res['vout'][1]['scriptPubKey']['type'])
+        self.assertEqual(['bc1qtrs9hx6p9sa57ddak485wdmtat4clqd29840tw'], res['vout'][1]['scriptPubKey']['addresses'])
+        serialized = serialize_transactions([res])
+        self.assertIn(b'"value": 0.00381000', serialized)
+        self.assertEqual(res['txid'], json.loads(serialized.decode())[0]['txid'])
+
+    def test_script_sig_asm(self):
+        signature = '30450221008a6edb6ce73676d4065ffb810f3945b3c3554025d3d7545bfca7185aaff620cc022066e2f0640aeb0775e' \
+                    '4b47701472b28d1018b4ab8fd688acbdcd757b75c2731b6'
+        pubkey = '03dfc2e6847645ca8057120780e5ae6fa84be76b39465cd2a5158d1fffba78b226'
+        script = binascii.unhexlify('48' + signature + '01' + '21' + pubkey)
+        self.assertEqual('%s[ALL] %s' % (signature, pubkey), script_to_asm(script, attempt_sighash_decode=True))
+        self.assertEqual('%s01 %s' % (signature, pubkey), script_to_asm(script))
+        self.assertEqual('0 1 1 -1 16 OP_CHECKSEQUENCEVERIFY', script_to_asm(binascii.unhexlify('00510201004f60b2')))
+        self.assertEqual('OP_RETURN [error]', script_to_asm(binascii.unhexlify('6a4c')))
+
+    def test_script_types(self):
+        multisig = binascii.unhexlify(
+            '52210343e12e54cadfa2b908338c0c3bb15934c977069bb87abea5a45dd7e539c1efad2102be82fd3f24b0a5b82f5046075fc'
+            'a1a14c9917815cf095949a2249c9cd2dde45f21037d6f48f518610e6ff1b88b6354b199837e734a02ffdff8cd2bd81042fa68'
+            '2f2153ae'
+        )
+        self.assertEqual(
+            (
+                'multisig', 2,
+                ['mmnPohq6aaye9AjTxoiE1uTiF3TtfM9yJs', 'mrKoN6qYqmSCF2sjNPhjT1xQhX5ZNtTG1h',
+                 'moHBj9J8MmGF9FBNkPJSRd872DczfKEjbU']
+            ),
+            get_script_type(multisig, testnet)
+        )
+        self.assertEqual(
+            ('scripthash', 1, ['3P14159f73E4gFr7JterCCQh9QjiTjiZrG']),
+            get_script_type(binascii.unhexlify('a914e9c3dd0c07aac76179ebc76a6c78d4d67c6c160a87'), mainnet)
+        )
+        self.assertEqual(
+            ('nulldata', 0, []), get_script_type(binascii.unhexlify('6a0b68656c6c6f20776f726c64'), mainnet)
+        )
+        self.assertEqual(('nonstandard', 0, []), get_script_type(binascii.unhexlify('51'), mainnet))
@@ -10,8 +10,9 @@ from pycoin.block import Block
 from spruned import settings
 
 from spruned.application.cache import CacheAgent
-from spruned.application.exceptions import ServiceException, InvalidPOWException
+from spruned.application.exceptions import ServiceException, InvalidPOWException, CacheLimitExceededException
 from spruned.application.spruned_vo_service import SprunedVOService
+from spruned.application.tools import SerializedJSON
 from spruned.daemon.exceptions import ElectrodMissingResponseException
 from test.utils import async_coro
 
@@ -22,6 +23,10 @@ class TestVOService(unittest.TestCase):
         self.electrod = Mock()
         self.p2p = Mock()
         self.repository = Mock()
+        self.repository.blockchain.get_cached_block_object.return_value = None
+        self.repository.blockchain.get_cached_verbose_block.return_value = None
+        self.repository.blockchain.get_confirmed_transaction.return_value = None
+        self.repository.blockchain.get_transaction.return_value = None
         self.cache = create_autospec(CacheAgent)
         self.sut = SprunedVOService(
             self.electrod, self.p2p, cache_agent=self.cache, repository=self.repository
@@ -36,14 +41,20 @@ class TestVOService(unittest.TestCase):
             'block_height': 513979,
             'prev_block_hash': '0000000000000000004c3270bc11b00779e2a9ce2cdbc67a26a339abec01d06a'
         }
+        self.chain_stats = {
+            'chainwork': '0000000000000000000000000000000000000000014c2b9a4fb1b4a3b37ab2a7d0a6fa4a',
+            'difficulty': 3462542391191.563,
+            'mediantime': 1521310124
+        }
+        self.repository.headers.get_chain_stats.return_value = self.chain_stats
         self.response_header = {
             'bits': '391481763',
-            'chainwork': '00' * 32,
+            'chainwork': self.chain_stats['chainwork'],
             'confirmations': 2,
-            'difficulty': 0,
+            'difficulty': self.chain_stats['difficulty'],
             'hash': '000000000000000000376267d342878f869cb68192ff5d73f5f1953ae83e3e1e',
             'height': 513979,
-            'mediantime': 1521312803,
+            'mediantime': self.chain_stats['mediantime'],
             'merkleroot': '23d4c463811650d9860b4c191d416a11aca4d3047847f96a828d4d576a3a0448',
             'nextblockhash': None,
             'nonce': 2500253276,
@@ -64,12 +75,49 @@ class TestVOService(unittest.TestCase):
         )
         self.assertEqual(block, None)
 
-    def test_getblock_full_verbose(self):
+    def test_getblock_full_verbose_not_found(self):
         self.repository.headers.get_block_header.return_value = None
-        with self.assertRaises(NotImplementedError):
-            self.loop.run_until_complete(
-                self.sut.getblock('00000000839a8e6886ab5951d76f411475428afc90947ee320161bbf18eb6048', 2)
-            )
+        block = self.loop.run_until_complete(
+            self.sut.getblock('00000000839a8e6886ab5951d76f411475428afc90947ee320161bbf18eb6048', 2)
+        )
+        self.assertIsNone(block)
+
+    def test_getblock_full_verbose_cached(self):
+        self.repository.headers.get_best_header.return_value = {'block_height': 513980}
+        self.repository.headers.get_block_header.return_value = self.header
+        self.repository.blockchain.get_decoded_transactions.return_value = b'[{"txid": "cafe"}]', 285
+        block = self.loop.run_until_complete(self.sut.getblock(self.header['block_hash'], 2))
+        self.assertIsInstance(block['tx'], SerializedJSON)
+        self.assertEqual(b'[{"txid": "cafe"}]', block['tx'])
+        self.assertEqual(285, block['size'])
+        self.assertEqual(2, block['confirmations'])
+        Mock.assert_not_called(self.repository.blockchain.get_block_bytes)
+        Mock.assert_not_called(self.repository.blockchain.save_decoded_transactions)
+
+    def test_getblock_full_verbose_decode(self):
+        from spruned.application.networks.bitcoin import mainnet
+        hex_block = '010000006fe28c0ab6f1b372c1a6a246ae63f74f931e8365e15a089c68d6190000000000982051fd1e4ba744bbbe6' \
+                    '80e1fee14677ba1a3c3540bf7b1cdb606e857233e0e61bc6649ffff001d01e3629901010000000100000000000000' \
+                    '00000000000000000000000000000000000000000000000000ffffffff0704ffff001d0104ffffffff0100f2052a0' \
+                    '100000043410496b538e853519c726a2c91e61ec11600ae1390813a627c66fb8be7947be63c52da7589379515d4e0' \
+                    'a604f8141781e62294721166bf621e73a82cbf2342c858eeac00000000'
+        self.sut.context = Mock()
+        self.sut.context.get_network.return_value = mainnet
+        self.repository.headers.get_best_header.return_value = {'block_height': 513980}
+        self.repository.headers.get_block_header.return_value = self.header
+        self.repository.blockchain.get_decoded_transactions.return_value = None, None
+        self.repository.blockchain.get_block_bytes.return_value = memoryview(binascii.unhexlify(hex_block))
+        block = self.loop.run_until_complete(self.sut.getblock(self.header['block_hash'], 2))
+        transactions = json.loads(block['tx'].decode())
+        self.assertEqual(215, block['size'])
+        self.assertEqual('0e3e2357e806b6cdb1f70b54c3a3a17b6714ee1f0e68bebb44a74b1efd512098', transactions[0]['txid'])
+        self.assertEqual(50.0, transactions[0]['vout'][0]['value'])
+        self.assertEqual(
+            ['12c6DSiU4Rq3P4ZxziKxzrL5LmMBrzjrJX'], transactions[0]['vout'][0]['scriptPubKey']['addresses']
+        )
+        Mock.assert_called_once_with(
+            self.repository.blockchain.save_decoded_transactions, self.header['block_hash'], block['tx'], 215
+        )
 
     def test_getblock_verbose(self):
         header_hex = '010000006fe28c0ab6f1b372c1a6a246ae63f74f931e8365e15a089c68d6190000000000982051' \
@@ -81,11 +129,11 @@ class TestVOService(unittest.TestCase):
             "versionHex": "",
             "merkleroot": "0e3e2357e806b6cdb1f70b54c3a3a17b6714ee1f0e68bebb44a74b1efd512098",
             "time": 1231469665,
-            "mediantime": 1231469665,
+            'mediantime': self.chain_stats['mediantime'],
             "nonce": 2573394689,
             "bits": 486604799,
-            "difficulty": 0,
-            'chainwork': '00' * 32,
+            'difficulty': self.chain_stats['difficulty'],
+            'chainwork': self.chain_stats['chainwork'],
             "previousblockhash": "000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f",
             "nextblockhash": "000000006a625f06636b8bb6ac7b960a8d03705d1ace08b1a19da3fdcc99ddbd",
             "tx": [
@@ -114,11 +162,11 @@ class TestVOService(unittest.TestCase):
             "versionHex": "",
             "merkleroot": "0e3e2357e806b6cdb1f70b54c3a3a17b6714ee1f0e68bebb44a74b1efd512098",
             "time": 1231469665,
-            "mediantime": 1231469665,
+            'mediantime': self.chain_stats['mediantime'],
             "nonce": 2573394689,
             "bits": '486604799',
-            "difficulty": 0,
-            'chainwork': '00' * 32,
+            'difficulty': self.chain_stats['difficulty'],
+            'chainwork': self.chain_stats['chainwork'],
             "previousblockhash": "000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f",
             "nextblockhash": "000000006a625f06636b8bb6ac7b960a8d03705d1ace08b1a19da3fdcc99ddbd",
             "tx": [
@@ -127,6 +175,37 @@ class TestVOService(unittest.TestCase):
             "confirmations": 513980
         }
         self.assertEqual(block, block_json)
+        self.assertEqual(1, self.repository.blockchain.cache_verbose_block.call_count)
+
+        # chainwork not known yet, headers still backfilled
+        self.repository.headers.get_chain_stats.return_value = {
+            k: v for k, v in self.chain_stats.items() if k != 'chainwork'
+        }
+        block = self.loop.run_until_complete(
+            self.sut.getblock('00000000839a8e6886ab5951d76f411475428afc90947ee320161bbf18eb6048', 1)
+        )
+        block_json.pop('chainwork')
+        self.assertEqual(block, block_json)
+        self.assertEqual(1, self.repository.blockchain.cache_verbose_block.call_count)
+
+    def test_getblock_verbose_hot_cache(self):
+        cached = {'hash': self.header['block_hash'], 'height': 513979, 'nextblockhash': None, 'tx': ['aa'], 'size': 10}
+        self.repository.headers.get_block_header.return_value = dict(self.header, next_block_hash='bb')
+        self.repository.headers.get_best_header.return_value = {'block_height': 513980}
+        self.repository.blockchain.get_cached_verbose_block.return_value = cached
+        block = self.loop.run_until_complete(self.sut.getblock(self.header['block_hash'], 1))
+        self.assertEqual(dict(cached, nextblockhash='bb', confirmations=2), block)
+        self.assertIsNone(cached['nextblockhash'])
+        Mock.assert_not_called(self.repository.blockchain.get_txids_by_block_hash)
+
+    def test_get_block_object_shared_parse(self):
+        block_object = Mock()
+        self.repository.headers.get_block_header.return_value = self.header
+        self.repository.blockchain.get_cached_block_object.return_value = block_object
+        res = self.loop.run_until_complete(self.sut.get_block_object(self.header['block_hash']))
+        self.assertIs(block_object, res)
+        Mock.assert_not_called(self.repository.blockchain.get_block_bytes)
+        Mock.assert_not_called(self.p2p.get_block)
 
     def test_getblock_non_verbose(self):
         self.repository.headers.get_best_header.return_value = {'block_height': 1513040}
@@ -180,7 +259,10 @@ class TestVOService(unittest.TestCase):
                 )
             }
         ]
-        self.repository.blockchain.get_transactions_by_block_hash.return_value = res, 16
+        self.repository.blockchain.get_block_bytes.return_value = memoryview(
+            self.repository.headers.get_block_header.return_value['header_bytes'] + b'\x02' +
+            b''.join(tx['transaction_bytes'] for tx in res)
+        )
 
         block = self.loop.run_until_complete(
             self.sut.getblock('0000000000000338dac26bdf4d7bffd4f1b579307fd00b084a6b477c4d568e87', 0)
@@ -231,7 +313,7 @@ class TestVOService(unittest.TestCase):
 
         self.repository.headers.get_best_header.return_value = {'block_height': 513980}
         self.repository.headers.get_block_header.return_value = self.header
-        self.repository.blockchain.get_transactions_by_block_hash.return_value = [], None
+        self.repository.blockchain.get_block_bytes.return_value = None
         self.repository.blockchain.async_save_block.side_effect = [async_coro(True), async_coro(True)]
         self.p2p.get_block.side_effect = [
             async_coro(None),
@@ -249,10 +331,25 @@ class TestVOService(unittest.TestCase):
         )
         self.assertEqual(block, hex_block)
 
+    def test_getblock_prefetched(self):
+        self.sut.prefetcher = Mock()
+        block_object = Mock()
+        self.sut.prefetcher.wait_for.return_value = async_coro(
+            {'block_hash': self.header['block_hash'], 'block_bytes': b'\xca\xfe', 'block_object': block_object}
+        )
+        self.repository.headers.get_block_header.return_value = self.header
+        self.repository.blockchain.get_block_bytes.return_value = None
+        self.repository.blockchain.async_save_block.return_value = async_coro(True)
+        block = self.loop.run_until_complete(self.sut.getblock(self.header['block_hash'], 0))
+        self.assertEqual('cafe', block)
+        Mock.assert_called_once_with(self.sut.prefetcher.on_block_request, self.header)
+        Mock.assert_called_once_with(self.sut.prefetcher.wait_for, self.header['block_hash'])
+        Mock.assert_not_called(self.p2p.get_block)
+
     def test_getblock_p2p_non_verbose_network_error(self):
         self.repository.headers.get_best_header.return_value = {'block_height': 513980}
         self.repository.headers.get_block_header.return_value = self.header
-        self.repository.blockchain.get_transactions_by_block_hash.return_value = [], None
+        self.repository.blockchain.get_block_bytes.return_value = None
         self.p2p.get_block.side_effect = lambda *a, **kw: async_coro(None)
         with self.assertRaises(ServiceException):
             self.loop.run_until_complete(
@@ -299,6 +396,19 @@ class TestVOService(unittest.TestCase):
         )
         self.assertEqual(res, tx)
 
+    def test_getrawtransaction_verbose_concurrent(self):
+        self.repository.get_block_header.return_value = self.header
+        self.repository.blockchain.get_json_transaction.return_value = None
+        tx = {'hex': 'cafe', 'vout': [{'value': 0.1, 'n': 0}, {'value': 0, 'n': 1}]}
+        self.repository.get_best_header.return_value = {'block_height': 513980}
+        self.electrod.getrawtransaction.side_effect = lambda *a, **kw: async_coro(tx)
+        res = self.loop.run_until_complete(asyncio.gather(
+            self.sut.getrawtransaction('aa' * 32, verbose=True), self.sut.getrawtransaction('aa' * 32, verbose=True)
+        ))
+        expected = {'hex': 'cafe', 'vout': [{'value': '0.10000000', 'n': 0}, {'value': 0, 'n': 1}]}
+        self.assertEqual([expected, expected], res)
+        self.assertEqual({'hex': 'cafe', 'vout': [{'value': 0.1, 'n': 0}, {'value': 0, 'n': 1}]}, tx)
+
     def test_getrawtransaction_verbose_in_block(self):
         header_hex = '010000006fe28c0ab6f1b372c1a6a246ae63f74f931e8365e15a089c68d6190000000000982051' \
                      'fd1e4ba744bbbe680e1fee14677ba1a3c3540bf7b1cdb606e857233e0e61bc6649ffff001d01e36299'
@@ -309,11 +419,11 @@ class TestVOService(unittest.TestCase):
             "versionHex": "",
             "merkleroot": "0e3e2357e806b6cdb1f70b54c3a3a17b6714ee1f0e68bebb44a74b1efd512098",
             "time": 1231469665,
-            "mediantime": 1231469665,
+            'mediantime': self.chain_stats['mediantime'],
             "nonce": 2573394689,
             "bits": 486604799,
-            "difficulty": 0,
-            'chainwork': '00' * 32,
+            'difficulty': self.chain_stats['difficulty'],
+            'chainwork': self.chain_stats['chainwork'],
             "previousblockhash": "000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f",
             "nextblockhash": "000000006a625f06636b8bb6ac7b960a8d03705d1ace08b1a19da3fdcc99ddbd",
             "tx": [
@@ -347,7 +457,91 @@ class TestVOService(unittest.TestCase):
                 verbose=True
             )
         )
-        self.assertEqual(res, tx)
+        self.assertEqual(res, dict(tx, confirmations=513980))
+        Mock.assert_called_once_with(
+            self.repository.blockchain.save_confirmed_transaction,
+            '0e3e2357e806b6cdb1f70b54c3a3a17b6714ee1f0e68bebb44a74b1efd512098',
+            binascii.unhexlify(tx['hex']), tx['blockhash'], {'block_height': 1, 'merkle': [], 'pos': 0}
+        )
+
+    def test_getrawtransaction_confirmed_cached(self):
+        from spruned.application.networks.bitcoin import mainnet
+        self.sut.context = Mock()
+        self.sut.context.get_network.return_value = mainnet
+        txid = '0e3e2357e806b6cdb1f70b54c3a3a17b6714ee1f0e68bebb44a74b1efd512098'
+        tx_hex = '01000000010000000000000000000000000000000000000000000000000000000000000000ffffffff0704ffff00' \
+                 '1d0104ffffffff0100f2052a0100000043410496b538e853519c726a2c91e61ec11600ae1390813a627c66fb8be7' \
+                 '947be63c52da7589379515d4e0a604f8141781e62294721166bf621e73a82cbf2342c858eeac00000000'
+        header_hex = '010000006fe28c0ab6f1b372c1a6a246ae63f74f931e8365e15a089c68d6190000000000982051' \
+                     'fd1e4ba744bbbe680e1fee14677ba1a3c3540bf7b1cdb606e857233e0e61bc6649ffff001d01e36299'
+        self.repository.blockchain.get_confirmed_transaction.return_value = {
+            'transaction_bytes': binascii.unhexlify(tx_hex),
+            'block_hash': '00000000839a8e6886ab5951d76f411475428afc90947ee320161bbf18eb6048',
+            'merkle_proof': {'block_height': 1, 'merkle': [], 'pos': 0}
+        }
+        self.repository.headers.get_block_header.return_value = {
+            'block_hash': '00000000839a8e6886ab5951d76f411475428afc90947ee320161bbf18eb6048',
+            'block_height': 1,
+            'header_bytes': binascii.unhexlify(header_hex)
+        }
+        self.repository.headers.get_best_header.return_value = {'block_height': 10}
+        self.repository.blockchain.get_transaction.return_value = None
+        res = self.loop.run_until_complete(self.sut.getrawtransaction(txid, verbose=True))
+        self.assertEqual(txid, res['txid'])
+        self.assertEqual(tx_hex, res['hex'])
+        self.assertEqual('00000000839a8e6886ab5951d76f411475428afc90947ee320161bbf18eb6048', res['blockhash'])
+        self.assertEqual(10, res['confirmations'])
+        self.assertEqual((1231469665, 1231469665), (res['time'], res['blocktime']))
+        self.assertEqual('50.00000000', res['vout'][0]['value'])
+        res = self.loop.run_until_complete(self.sut.getrawtransaction(txid))
+        self.assertEqual(tx_hex, res)
+        Mock.assert_not_called(self.electrod.getrawtransaction)
+        Mock.assert_not_called(self.electrod.get_merkleproof)
+
+    def test_getrawtransaction_verbose_stored(self):
+        from spruned.application.networks.bitcoin import mainnet
+        self.sut.context = Mock()
+        self.sut.context.get_network.return_value = mainnet
+        txid = '0e3e2357e806b6cdb1f70b54c3a3a17b6714ee1f0e68bebb44a74b1efd512098'
+        blockhash = '00000000839a8e6886ab5951d76f411475428afc90947ee320161bbf18eb6048'
+        tx_hex = '01000000010000000000000000000000000000000000000000000000000000000000000000ffffffff0704ffff00' \
+                 '1d0104ffffffff0100f2052a0100000043410496b538e853519c726a2c91e61ec11600ae1390813a627c66fb8be7' \
+                 '947be63c52da7589379515d4e0a604f8141781e62294721166bf621e73a82cbf2342c858eeac00000000'
+        header_hex = '010000006fe28c0ab6f1b372c1a6a246ae63f74f931e8365e15a089c68d6190000000000982051' \
+                     'fd1e4ba744bbbe680e1fee14677ba1a3c3540bf7b1cdb606e857233e0e61bc6649ffff001d01e36299'
+        self.repository.blockchain.get_transaction.return_value = {
+            'transaction_bytes': memoryview(binascii.unhexlify(tx_hex)),
+            'block_hash': binascii.unhexlify(blockhash),
+            'txid': txid
+        }
+        self.repository.headers.get_block_header.return_value = {
+            'block_hash': blockhash,
+            'block_height': 1,
+            'header_bytes': binascii.unhexlify(header_hex)
+        }
+        self.repository.headers.get_best_header.return_value = {'block_height': 1}
+        res = self.loop.run_until_complete(self.sut.getrawtransaction(txid, verbose=True))
+        self.assertEqual(
+            (txid, tx_hex, blockhash, 1, 1231469665, 1231469665),
+            (res['txid'], res['hex'], res['blockhash'], res['confirmations'], res['time'], res['blocktime'])
+        )
+        Mock.assert_called_once_with(self.repository.headers.get_block_header, blockhash)
+        Mock.assert_not_called(self.electrod.getrawtransaction)
+        Mock.assert_not_called(self.repository.blockchain.get_confirmed_transaction)
+
+    def test_getrawtransaction_confirmed_cached_reorged(self):
+        tx = {'hex': 'cafe', 'vout': []}
+        self.repository.blockchain.get_confirmed_transaction.return_value = {
+            'transaction_bytes': b'\xca\xfe',
+            'block_hash': 'ff' * 32,
+            'merkle_proof': {'block_height': 1, 'merkle': [], 'pos': 0}
+        }
+        self.repository.headers.get_block_header.return_value = None
+        self.repository.blockchain.get_transaction.return_value = None
+        self.electrod.getrawtransaction.return_value = async_coro(tx)
+        res = self.loop.run_until_complete(self.sut.getrawtransaction('aa' * 32))
+        self.assertEqual('cafe', res)
+        Mock.assert_called_once_with(self.repository.blockchain.remove_confirmed_transaction, 'aa' * 32)
 
     def test_getrawtransaction_verbose_in_block_invalid_pow(self):
         header_hex = '010000006fe28c0ab6f1b372c1a6a246ae63f74f931e8365e15a089c68d6190000000000982051' \
@@ -359,11 +553,11 @@ class TestVOService(unittest.TestCase):
             "versionHex": "",
             "merkleroot": "0e3e2357e806b6cdb1f70b54c3a3a17b6714ee1f0e68bebb44a74b1efd512098",
             "time": 1231469665,
-            "mediantime": 1231469665,
+            'mediantime': self.chain_stats['mediantime'],
             "nonce": 2573394689,
             "bits": 486604799,
-            "difficulty": 0,
-            'chainwork': '00' * 32,
+            'difficulty': self.chain_stats['difficulty'],
+            'chainwork': self.chain_stats['chainwork'],
             "previousblockhash": "000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f",
             "nextblockhash": "000000006a625f06636b8bb6ac7b960a8d03705d1ace08b1a19da3fdcc99ddbd",
             "tx": [
@@ -462,9 +656,9 @@ class TestVOService(unittest.TestCase):
                 'blocks': 513979,
                 'headers': 513979,
                 'bestblockhash': '000000000000000000376267d342878f869cb68192ff5d73f5f1953ae83e3e1e',
-                'difficulty': 0,
-                'chainwork': '00' * 32,
-                'mediantime': 1521312803,
+                'difficulty': self.chain_stats['difficulty'],
+                'chainwork': self.chain_stats['chainwork'],
+                'mediantime': self.chain_stats['mediantime'],
                 'verificationprogress': 0,
                 'pruned': False,
                 'initialblockdownload': False
@@ -508,3 +702,70 @@ class TestVOService(unittest.TestCase):
                 }
             }
         )
+
+    def test_pinblocks(self):
+        self.repository.headers.get_best_header.return_value = None
+        self.assertIsNone(self.loop.run_until_complete(self.sut.pinblocks(10, 20)))
+        self.repository.headers.get_best_header.return_value = {'block_height': 15, 'block_hash': 'cc' * 32}
+        self.assertIsNone(self.loop.run_until_complete(self.sut.pinblocks(10, 20)))
+        self.repository.headers.get_best_header.return_value = {'block_height': 30, 'block_hash': 'cc' * 32}
+        self.cache.can_pin.return_value = False
+        with self.assertRaises(CacheLimitExceededException):
+            self.loop.run_until_complete(self.sut.pinblocks(10, 20))
+        Mock.assert_not_called(self.cache.pin)
+        self.cache.can_pin.return_value = True
+        self.cache.pin.return_value = []
+        self.assertEqual([], self.loop.run_until_complete(self.sut.pinblocks(10, 20)))
+        Mock.assert_called_once_with(self.cache.pin, 10, 20)
+
+    def test_gettxout_local(self):
+        tx = '01000000010000000000000000000000000000000000000000000000000000000000000000ffffffff0704ffff00' \
+             '1d0104ffffffff0100f2052a0100000043410496b538e853519c726a2c91e61ec11600ae1390813a627c66fb8be7' \
+             '947be63c52da7589379515d4e0a604f8141781e62294721166bf621e73a82cbf2342c858eeac00000000'
+        txid = '0e3e2357e806b6cdb1f70b54c3a3a17b6714ee1f0e68bebb44a74b1efd512098'
+        self.repository.keep_blocks = 200
+        self.repository.mempool = None
+        self.repository.blockchain.get_transaction.return_value = {
+            'transaction_bytes': binascii.unhexlify(tx), 'block_hash': b'\xaa' * 32, 'txid': txid
+        }
+        self.repository.headers.get_block_header.side_effect = lambda x: x == 'aa' * 32 and {
+            'block_hash': 'aa' * 32, 'block_height': 100
+        } or None
+        self.repository.headers.get_best_header.return_value = {'block_height': 102, 'block_hash': 'cc' * 32}
+        self.repository.get_stored_since_height.return_value = 101
+        self.repository.blockchain.get_spend.return_value = None
+        res = self.loop.run_until_complete(self.sut.gettxout(txid, 0))
+        self.assertEqual(('cc' * 32, 3, '50.00000000'), (res['bestblock'], res['confirmations'], res['value']))
+        Mock.assert_not_called(self.repository.blockchain.get_block_index)
+
+        self.repository.blockchain.get_spend.return_value = {'txid': b'\xdd' * 32, 'block_hash': b'\xaa' * 32}
+        self.assertIsNone(self.loop.run_until_complete(self.sut.gettxout(txid, 0)))
+
+        self.repository.blockchain.get_spend.return_value = None
+        self.repository.mempool = Mock()
+        self.repository.mempool.is_spent.return_value = True
+        self.assertIsNone(self.loop.run_until_complete(self.sut.gettxout(txid, 0)))
+        Mock.assert_called_once_with(self.repository.mempool.is_spent, txid, 0)
+        Mock.assert_not_called(self.electrod.listunspents_by_scripthash)
+
+    def test_gettxout_local_missing_block(self):
+        tx = '01000000010000000000000000000000000000000000000000000000000000000000000000ffffffff0704ffff00' \
+             '1d0104ffffffff0100f2052a0100000043410496b538e853519c726a2c91e61ec11600ae1390813a627c66fb8be7' \
+             '947be63c52da7589379515d4e0a604f8141781e62294721166bf621e73a82cbf2342c858eeac00000000'
+        txid = '0e3e2357e806b6cdb1f70b54c3a3a17b6714ee1f0e68bebb44a74b1efd512098'
+        self.repository.keep_blocks = 200
+        self.repository.blockchain.get_transaction.return_value = {
+            'transaction_bytes': binascii.unhexlify(tx), 'block_hash': b'\xaa' * 32, 'txid': txid
+        }
+        self.repository.headers.get_block_header.return_value = {'block_hash': 'aa' * 32, 'block_height': 100}
+        self.repository.headers.get_best_header.return_value = {'block_height': 101, 'block_hash': 'bb' * 32}
+        self.repository.get_stored_since_height.return_value = 102
+        self.electrod.listunspents_by_scripthash.return_value = async_coro([])
+        self.assertIsNone(self.loop.run_until_complete(self.sut.gettxout(txid, 0)))
+        Mock.assert_not_called(self.repository.blockchain.get_spend)
+        self.assertEqual(1, self.electrod.listunspents_by_scripthash.call_count)
+
+        self.repository.get_stored_since_height.return_value = None
+        self.electrod.listunspents_by_scripthash.return_value = async_coro([])
+        self.assertIsNone(self.loop.run_until_complete(self.sut.gettxout(txid, 0)))
+        Mock.assert_not_called(self.repository.blockchain.get_spend)
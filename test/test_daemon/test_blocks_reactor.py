@@ -1,6 +1,6 @@
 import asyncio
 from unittest import TestCase
-from unittest.mock import Mock, create_autospec, call
+from unittest.mock import Mock, create_autospec, call, ANY
 
 from spruned.daemon.bitcoin_p2p.p2p_interface import P2PInterface
 from spruned.daemon.tasks.blocks_reactor import BlocksReactor
@@ -9,6 +9,13 @@ from test.utils import async_coro
 
 
 class TestBlocksReactory(TestCase):
+    def _serve_blocks(self, *blocks):
+        async def get_blocks(*blockhashes, on_block=None):
+            for block in blocks:
+                on_block(block)
+            return {block['block_hash']: None for block in blocks}
+        self.interface.get_blocks.side_effect = get_blocks
+
     def setUp(self):
         self.interface = create_autospec(P2PInterface)
         self.repo = create_autospec(Repository)
@@ -20,20 +27,16 @@ class TestBlocksReactory(TestCase):
     def test_check_blockchain_local_behind_remote(self):
         self.sut.set_last_processed_block({'block_hash': 'cafe', 'block_height': 9})
         self.repo.headers.get_best_header.return_value = {'block_hash': 'babe', 'block_height': 10}
-        self.interface.get_blocks.return_value = async_coro({'babe': {'block_hash': 'babe', 'block_bytes': b'raw'}})
+        self._serve_blocks({'block_hash': 'babe', 'block_bytes': b'raw'})
         self.repo.headers.get_headers_since_height.return_value = [{'block_hash': 'babe', 'block_height': 10}]
         self.repo.blockchain.get_block_index.return_value = None
-        self.repo.blockchain.save_blocks.side_effect = lambda *x: x
         self.loop.run_until_complete(self.sut.check())
-        Mock.assert_called_once_with(
-            self.repo.blockchain.save_blocks, {'block_hash': 'babe', 'block_bytes': b'raw'}
-        )
         self.assertEqual(self.sut._last_processed_block, {'block_hash': 'babe', 'block_height': 10})
         Mock.assert_called_once_with(self.repo.headers.get_best_header)
-        Mock.assert_called_once_with(self.interface.get_blocks, 'babe')
+        Mock.assert_called_once_with(self.interface.get_blocks, 'babe', on_block=ANY)
         Mock.assert_called_once_with(self.repo.headers.get_headers_since_height, 9, limit=10)
         Mock.assert_called_once_with(self.repo.blockchain.get_block_index, 'babe')
-        Mock.assert_called_once_with(self.repo.blockchain.save_blocks, {'block_hash': 'babe', 'block_bytes': b'raw'})
+        Mock.assert_called_once_with(self.repo.blockchain.save_block, {'block_hash': 'babe', 'block_bytes': b'raw'})
 
     def test_check_blockchain_local_behind_remote_but_block_already_stored(self):
         self.sut.set_last_processed_block({'block_hash': 'cafe', 'block_height': 9})
@@ -41,29 +44,28 @@ class TestBlocksReactory(TestCase):
         self.interface.get_blocks.return_value = async_coro({'babe': {'block_hash': 'babe', 'block_bytes': b'raw'}})
         self.repo.headers.get_headers_since_height.return_value = [{'block_hash': 'babe', 'block_height': 10}]
         self.repo.blockchain.get_block_index.return_value = {'block_hash': 'babe', 'block_bytes': b'raw'}
-        self.repo.blockchain.save_blocks.side_effect = lambda *x: x
         self.loop.run_until_complete(self.sut.check())
         Mock.assert_called_once_with(self.repo.headers.get_best_header)
         Mock.assert_called_once_with(self.repo.headers.get_headers_since_height, 9, limit=10)
         Mock.assert_called_once_with(self.repo.blockchain.get_block_index, 'babe')
         Mock.assert_not_called(self.interface.get_blocks)
-        Mock.assert_not_called(self.repo.blockchain.save_blocks)
+        Mock.assert_not_called(self.repo.blockchain.save_block)
         self.assertEqual(self.sut._last_processed_block, {'block_hash': 'babe', 'block_height': 10})
 
     def test_check_blockchain_local_behind_remote_error_saving_block(self):
         self.sut.set_last_processed_block({'block_hash': 'cafe', 'block_height': 9})
         self.repo.headers.get_best_header.return_value = {'block_hash': 'babe', 'block_height': 10}
-        self.interface.get_blocks.return_value = async_coro({'babe': {'block_hash': 'babe', 'block_bytes': b'raw'}})
+        self._serve_blocks({'block_hash': 'babe', 'block_bytes': b'raw'})
         self.repo.headers.get_headers_since_height.return_value = [{'block_hash': 'babe', 'block_height': 10}]
         self.repo.blockchain.get_block_index.return_value = None
-        self.repo.blockchain.save_blocks.side_effect = ValueError
+        self.repo.blockchain.save_block.side_effect = ValueError
 
         self.loop.run_until_complete(self.sut.check())
         Mock.assert_called_once_with(
-            self.repo.blockchain.save_blocks, {'block_hash': 'babe', 'block_bytes': b'raw'}
+            self.repo.blockchain.save_block, {'block_hash': 'babe', 'block_bytes': b'raw'}
         )
         Mock.assert_called_once_with(self.repo.headers.get_best_header)
-        Mock.assert_called_once_with(self.interface.get_blocks, 'babe')
+        Mock.assert_called_once_with(self.interface.get_blocks, 'babe', on_block=ANY)
         Mock.assert_called_once_with(self.repo.headers.get_headers_since_height, 9, limit=10)
         Mock.assert_called_once_with(self.repo.blockchain.get_block_index, 'babe')
         self.assertEqual(self.sut._last_processed_block, {'block_hash': 'cafe', 'block_height': 9})
@@ -76,14 +78,7 @@ class TestBlocksReactory(TestCase):
         """
         self.sut.set_last_processed_block({'block_hash': 'cafe', 'block_height': 9})
         self.repo.headers.get_best_header.return_value = {'block_hash': 'babe', 'block_height': 20}
-        self.interface.get_blocks.return_value = async_coro(
-            {
-                'block17': {'block_hash': 'block17', 'block_bytes': b'raw'},
-                'block18': {'block_hash': 'block18', 'block_bytes': b'raw'},
-                'block19': {'block_hash': 'block19', 'block_bytes': b'raw'},
-                'block20': {'block_hash': 'block20', 'block_bytes': b'raw'}
-            }
-        )
+        self._serve_blocks(*({'block_hash': 'block%s' % i, 'block_bytes': b'raw'} for i in (18, 17, 20, 19)))
         self.repo.headers.get_headers_since_height.return_value = [
             {'block_hash': 'block16', 'block_height': 16},
             {'block_hash': 'block17', 'block_height': 17},
@@ -94,18 +89,10 @@ class TestBlocksReactory(TestCase):
         self.repo.blockchain.get_block_index.side_effect = [
             {'block_hash': 'block16', 'block_bytes': b'raw'}, None, None, None, None
         ]
-        self.repo.blockchain.save_blocks.side_effect = [
-            {'block_hash': 'block17', 'block_bytes': b'raw'},
-            {'block_hash': 'block18', 'block_bytes': b'raw'},
-            {'block_hash': 'block19', 'block_bytes': b'raw'},
-            {'block_hash': 'block20', 'block_bytes': b'raw'}
-        ]
-        self.repo.blockchain.save_blocks.side_effect = lambda *x: x
-
         self.loop.run_until_complete(self.sut.check())
 
         Mock.assert_called_once_with(self.repo.headers.get_best_header)
-        Mock.assert_called_once_with(self.repo.headers.get_headers_since_height, 15, limit=10)
+        Mock.assert_called_once_with(self.repo.headers.get_headers_since_height, 15, limit=5)
         Mock.assert_has_calls(
             self.repo.blockchain.get_block_index,
             calls=[
@@ -116,17 +103,32 @@ class TestBlocksReactory(TestCase):
                 call('block20')
             ]
         )
-        Mock.assert_called_once_with(self.interface.get_blocks, 'block17', 'block18', 'block19', 'block20')
-
         Mock.assert_called_once_with(
-            self.repo.blockchain.save_blocks,
-            {'block_hash': 'block17', 'block_bytes': b'raw'},
-            {'block_hash': 'block18', 'block_bytes': b'raw'},
-            {'block_hash': 'block19', 'block_bytes': b'raw'},
-            {'block_hash': 'block20', 'block_bytes': b'raw'}
+            self.interface.get_blocks, 'block17', 'block18', 'block19', 'block20', on_block=ANY
+        )
+        Mock.assert_has_calls(
+            self.repo.blockchain.save_block,
+            calls=[call({'block_hash': 'block%s' % i, 'block_bytes': b'raw'}) for i in (18, 17, 20, 19)]
         )
         self.assertEqual(self.sut._last_processed_block, {'block_hash': 'block20', 'block_height': 20})
 
+    def test_check_blockchain_partial_download(self):
+        self.sut.set_last_processed_block({'block_hash': 'cafe', 'block_height': 9})
+        self.repo.headers.get_best_header.return_value = {'block_hash': 'block12', 'block_height': 12}
+        self.repo.headers.get_headers_since_height.return_value = [
+            {'block_hash': 'block%s' % i, 'block_height': i} for i in range(9, 13)
+        ]
+        self.repo.blockchain.get_block_index.side_effect = [{'block_hash': 'block9'}, None, None, None]
+
+        async def get_blocks(*blockhashes, on_block=None):
+            on_block({'block_hash': 'block10', 'block_bytes': b'raw'})
+            on_block({'block_hash': 'block12', 'block_bytes': b'raw'})
+            raise ValueError
+        self.interface.get_blocks.side_effect = get_blocks
+        self.loop.run_until_complete(self.sut.check())
+        self.assertEqual(self.sut._last_processed_block, {'block_hash': 'block10', 'block_height': 10})
+        self.assertEqual(2, self.repo.blockchain.save_block.call_count)
+
     def test_check_corners_orphaned(self):
         self.sut.set_last_processed_block({'block_hash': 'cafe', 'block_height': 9})
         self.assertEqual(self.sut._last_processed_block, {'block_hash': 'cafe', 'block_height': 9})
@@ -162,12 +164,15 @@ class TestBlocksReactory(TestCase):
         self.repo.blockchain.get_block_index.side_effect = [
             {'block_hash': 'block2', 'block_bytes': b'raw'}, None, None, None, None
         ]
-        self.interface.get_block.side_effect = [
-            async_coro({'block_hash': 'block3', 'block_bytes': b'raw'}),
-            async_coro({'block_hash': 'block4', 'block_bytes': b'raw'}),
-            async_coro({'block_hash': 'block5', 'block_bytes': b'raw'}),
-            async_coro({'block_hash': 'block6', 'block_bytes': b'raw'}),
-        ]
+        downloads = []
+
+        async def get_blocks(*blockhashes, on_block=None):
+            downloads.append(blockhashes)
+            for blockhash in blockhashes[:3]:
+                on_block({'block_hash': blockhash, 'block_bytes': b'raw'})
+            if len(blockhashes) > 3:
+                raise ValueError
+        self.interface.get_blocks.side_effect = get_blocks
 
         self.loop.run_until_complete(
             asyncio.gather(
@@ -184,3 +189,5 @@ class TestBlocksReactory(TestCase):
                 call({'block_hash': 'block6', 'block_bytes': b'raw'})
             ]
         )
+        self.assertEqual([('block3', 'block4', 'block5', 'block6'), ('block6',)], downloads)
+        Mock.assert_called_with(self.interface.set_bootstrap_status, 100)
@@ -0,0 +1,169 @@
+import asyncio
+import binascii
+import struct
+import unittest
+from unittest.mock import Mock, create_autospec
+
+from spruned.daemon import exceptions
+from spruned.daemon.electrod.electrod_chunks import HeadersChunkValidator, HeadersChunksPipeline, \
+    verify_merkle_branch
+from spruned.daemon.electrod.electrod_interface import ElectrodInterface
+from test.utils import async_coro, make_chunk, make_headers, make_merkle_proof
+
+
+class TestHeadersChunkValidator(unittest.TestCase):
+    def setUp(self):
+        self.sut = HeadersChunkValidator({})
+
+    def test_validate_ok(self):
+        chunk = make_chunk(20)
+        headers = self.sut.validate(binascii.hexlify(chunk).decode(), 4032)
+        self.assertEqual(len(headers), 20)
+        for i, header in enumerate(headers):
+            self.assertEqual(header['block_height'], 4032 + i)
+            self.assertEqual(header['header_bytes'], chunk[i * 80:(i + 1) * 80])
+            self.assertEqual(header['bits'], 0x207fffff)
+            self.assertEqual(header['timestamp'], 1500000000 + i)
+            self.assertEqual(header['merkle_root'], '11' * 32)
+            i and self.assertEqual(header['prev_block_hash'], headers[i - 1]['block_hash'])
+        self.assertEqual(headers[0]['prev_block_hash'], '00' * 32)
+        self.assertEqual(self.sut.validate(chunk, 4032, prev_block_hash='00' * 32), headers)
+
+    def test_validate_broken_link(self):
+        chunk = make_chunk(10)
+        chunk = chunk[:400] + make_chunk(5, prev_block_hash=b'\x01' * 32)
+        with self.assertRaises(exceptions.NetworkHeadersInconsistencyException):
+            self.sut.validate(chunk, 0)
+        with self.assertRaises(exceptions.NetworkHeadersInconsistencyException):
+            self.sut.validate(make_chunk(2), 0, prev_block_hash='ff' * 32)
+
+    def test_validate_invalid_pow(self):
+        header = struct.pack('<I32s32sIII', 1, b'\x00' * 32, b'\x11' * 32, 1500000000, 0x1d00ffff, 0)
+        with self.assertRaises(exceptions.NetworkHeadersInconsistencyException):
+            self.sut.validate(header, 0)
+
+    def test_validate_checkpoint(self):
+        chunk = make_chunk(10)
+        headers = self.sut.validate(chunk, 2016)
+        sut = HeadersChunkValidator({2020: headers[4]['block_hash']})
+        self.assertEqual(sut.validate(chunk, 2016), headers)
+        sut = HeadersChunkValidator({2020: 'ff' * 32})
+        with self.assertRaises(exceptions.NetworkHeadersInconsistencyException):
+            sut.validate(chunk, 2016)
+
+    def test_validate_broken_data(self):
+        with self.assertRaises(exceptions.BrokenDataException):
+            self.sut.validate('nothex', 0)
+        with self.assertRaises(exceptions.BrokenDataException):
+            self.sut.validate(b'\x00' * 81, 0)
+
+
+class TestVerifyMerkleBranch(unittest.TestCase):
+    def test_verify_merkle_branch(self):
+        _, hashes = HeadersChunkValidator.unpack(make_chunk(11))
+        for index in (0, 5, 10):
+            branch, root = make_merkle_proof(hashes, index)
+            self.assertTrue(verify_merkle_branch(hashes[index], index, branch, root))
+            self.assertFalse(verify_merkle_branch(hashes[index], index ^ 2, branch, root))
+            self.assertFalse(verify_merkle_branch(hashes[index], index, branch[:-1], root))
+            self.assertFalse(verify_merkle_branch(hashes[index - 1], index, branch, root))
+        self.assertFalse(verify_merkle_branch(hashes[0], 0, ['zz'], root))
+
+
+class TestHeadersChunksPipeline(unittest.TestCase):
+    def setUp(self):
+        self.interface = create_autospec(ElectrodInterface)
+        self.connections = [Mock(hostname='a'), Mock(hostname='b'), Mock(hostname='c')]
+        self.interface.get_peers.return_value = self.connections
+        self.sut = HeadersChunksPipeline(self.interface, max_retries=2)
+        self.loop = asyncio.get_event_loop()
+        self.chunks = {i: make_headers(i * 10, (i + 1) * 10, i and '%02d' % i * 32 or None) for i in range(5)}
+        for i in range(4):
+            self.chunks[i][-1]['block_hash'] = '%02d' % (i + 1) * 32
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = []
+
+    def _get_headers_from_chunk(self, failures=None):
+        failures = failures or {}
+
+        async def get_headers_from_chunk(chunk_index, get_peer=True, connection=None):
+            self.requests.append((chunk_index, connection))
+            self.in_flight += 1
+            self.max_in_flight = max(self.in_flight, self.max_in_flight)
+            await asyncio.sleep(0.01 * (5 - chunk_index))
+            self.in_flight -= 1
+            if failures.get(chunk_index):
+                failure = failures[chunk_index].pop(0)
+                if isinstance(failure, Exception):
+                    raise failure
+                return connection, failure
+            return connection, self.chunks[chunk_index]
+        return get_headers_from_chunk
+
+    def test_pipeline_ok(self):
+        self.interface.get_headers_from_chunk.side_effect = self._get_headers_from_chunk()
+        committed = []
+        self.loop.run_until_complete(self.sut.run(0, 5, committed.append))
+        self.assertEqual(committed, [self.chunks[i] for i in range(5)])
+        self.assertEqual(self.max_in_flight, 3)
+        self.assertEqual({c for _, c in self.requests[:3]}, set(self.connections))
+
+    def test_pipeline_retry_on_another_server(self):
+        broken = make_headers(20, 30, 'ff' * 32)
+        self.interface.get_headers_from_chunk.side_effect = self._get_headers_from_chunk(
+            {
+                1: [exceptions.NetworkHeadersInconsistencyException()],
+                2: [broken],
+                3: [[]]
+            }
+        )
+        committed = []
+        self.loop.run_until_complete(self.sut.run(0, 5, committed.append))
+        self.assertEqual(committed, [self.chunks[i] for i in range(5)])
+        for chunk_index in (1, 2, 3):
+            connections = [c for i, c in self.requests if i == chunk_index]
+            self.assertEqual(len(connections), 2)
+            self.assertNotEqual(*connections)
+
+    def test_pipeline_retry_on_errors(self):
+        self.interface.get_headers_from_chunk.side_effect = self._get_headers_from_chunk(
+            {
+                1: [asyncio.TimeoutError()],
+                2: [ConnectionResetError()],
+                3: [exceptions.BrokenDataException()]
+            }
+        )
+        committed = []
+        self.loop.run_until_complete(self.sut.run(0, 5, committed.append))
+        self.assertEqual(committed, [self.chunks[i] for i in range(5)])
+        for chunk_index in (1, 2, 3):
+            connections = [c for i, c in self.requests if i == chunk_index]
+            self.assertEqual(len(connections), 2)
+            self.assertNotEqual(*connections)
+
+    def test_pipeline_give_up(self):
+        self.interface.get_headers_from_chunk.side_effect = self._get_headers_from_chunk(
+            {2: [None, None, None]}
+        )
+        committed = []
+        with self.assertRaises(exceptions.NoHeadersException):
+            self.loop.run_until_complete(self.sut.run(0, 5, committed.append))
+        self.assertEqual(committed, [self.chunks[0], self.chunks[1]])
+
+    def test_pipeline_commit_error(self):
+        self.interface.get_headers_from_chunk.side_effect = self._get_headers_from_chunk()
+        for connection in self.connections:
+            connection.disconnect.return_value = async_coro(None)
+
+        def commit(_):
+            raise exceptions.HeadersInconsistencyException
+
+        with self.assertRaises(exceptions.HeadersInconsistencyException):
+            self.loop.run_until_complete(self.sut.run(0, 5, commit))
+        Mock.assert_called_once_with(self.requests[0][1].disconnect)
+
+    def test_pipeline_no_peers(self):
+        self.interface.get_peers.return_value = []
+        with self.assertRaises(exceptions.NoPeersException):
+            self.loop.run_until_complete(self.sut.run(0, 5, Mock()))
@@ -116,6 +116,17 @@ class TestElectrodConnection(unittest.TestCase):
         )
         self.assertEqual(res, True)
 
+    def test_latency_by_method(self):
+        for _ in range(20):
+            self.client.RPC.return_value = async_coro(True)
+            self.loop.run_until_complete(self.sut.rpc_call('method', ()))
+            self.client.RPC.return_value = async_coro('ElectrumX 1.2')
+            self.loop.run_until_complete(self.sut.ping())
+        self.assertIsNotNone(self.sut.latency)
+        self.assertIsNotNone(self.sut.get_latency_p95('method'))
+        self.assertIsNone(self.sut.get_latency_p95('other_method'))
+        self.assertIsNone(self.sut.get_latency_p95('server.ping'))
+
     def test_rpc_call_error(self):
         self.delayer.return_value = 'delayed'
         self.client.RPC.return_value = ConnectionError
@@ -124,6 +135,17 @@ class TestElectrodConnection(unittest.TestCase):
         Mock.assert_called_once_with(self.electrod_loop.create_task, 'delayed')
         Mock.assert_called_once_with(self.delayer, coro_call('on_error'))
 
+    def test_rpc_call_cancelled(self):
+        self.client.RPC.return_value = asyncio.sleep(10)
+        task = self.loop.create_task(self.sut.rpc_call('method', ('cafe', 'babe')))
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            self.loop.run_until_complete(task)
+        self.assertEqual(self.sut.start_score, self.sut.score)
+        Mock.assert_not_called(self.delayer)
+        Mock.assert_not_called(self.electrod_loop.create_task)
+
     def test_ping_success(self):
         self.client.RPC.return_value = asyncio.gather(asyncio.sleep(1.1), async_coro('ElectrumX 1.2'))
         res = self.loop.run_until_complete(self.sut.ping())
@@ -134,6 +156,19 @@ class TestElectrodConnection(unittest.TestCase):
         res = self.loop.run_until_complete(self.sut.ping(timeout=1))
         self.assertIsNone(res)
 
+    def test_cost_by_pings(self):
+        self.client.RPC.return_value = async_coro(True)
+        self.loop.run_until_complete(self.sut.rpc_call('blockchain.block.headers', ()))
+        self.assertIsNotNone(self.sut.latency)
+        self.assertIsNone(self.sut.cost)
+        self.client.RPC.return_value = async_coro('ElectrumX 1.2')
+        self.loop.run_until_complete(self.sut.ping())
+        self.assertLess(self.sut.cost, 0.1)
+        self.assertLess(time.time() - self.sut.last_ping, 1)
+        self.client.RPC.return_value = asyncio.sleep(4)
+        self.loop.run_until_complete(self.sut.ping(timeout=0.1))
+        self.assertGreater(self.sut.cost, 0.03)
+
     def test_subscribe_and_fail(self):
         queue = Mock()
         queue.get.side_effect = [async_coro([{'height': '2'}]), ConnectionError]
@@ -185,3 +220,18 @@ class TestElectrodConnection(unittest.TestCase):
             Mock.assert_called_with(m, self.sut)
         Mock.assert_called_with(ecb, self.sut, error_type='error')
         self.assertEqual(self.sut.last_header, 'header')
+
+    def test_subscribe_scripthash(self):
+        self.client.protocol = True
+        queue = asyncio.Queue()
+        self.client.subscribe.return_value = async_coro('status1'), queue
+        self.client.RPC.return_value = async_coro('status2')
+        self.sut.loop = self.loop
+        on_status = Mock()
+        self.assertEqual('status1', self.loop.run_until_complete(self.sut.subscribe_scripthash('aa', on_status)))
+        self.assertEqual('status2', self.loop.run_until_complete(self.sut.subscribe_scripthash('bb', on_status)))
+        Mock.assert_called_once_with(self.client.subscribe, 'blockchain.scripthash.subscribe', 'aa')
+        Mock.assert_called_once_with(self.client.RPC, 'blockchain.scripthash.subscribe', 'bb')
+        self.loop.run_until_complete(queue.put(['bb', 'status3']))
+        self.loop.run_until_complete(asyncio.sleep(0))
+        Mock.assert_called_once_with(on_status, self.sut, 'bb', 'status3')
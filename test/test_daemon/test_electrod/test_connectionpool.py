@@ -1,6 +1,6 @@
 import asyncio
 import unittest
-from unittest.mock import Mock, call, ANY
+from unittest.mock import Mock, call, ANY, patch
 
 import time
 
@@ -64,11 +64,11 @@ class TestElectrodConnectionPool(unittest.TestCase):
     def test_connect_success(self):
         self.sut.loop = self.loop
         self.network_checker.return_value = async_coro(True)
-        conn1 = Mock(connected=False, score=0)
+        conn1 = Mock(connected=False, score=0, cost=None)
         conn1.connect = lambda: connect(conn1)
-        conn2 = Mock(connected=False, score=0)
+        conn2 = Mock(connected=False, score=0, cost=None)
         conn2.connect = lambda: connect(conn2)
-        conn3 = Mock(connected=False, score=0)
+        conn3 = Mock(connected=False, score=0, cost=None)
         conn3.connect = lambda: connect(conn3)
         self.connection_factory.side_effect = [conn1, conn2, conn3]
         on_connected_observer = Mock()
@@ -100,10 +100,10 @@ class TestElectrodConnectionPool(unittest.TestCase):
         self.sut.loop = self.loop
         self.network_checker.return_value = async_coro(True)
         self.sut._required_connections = 2
-        conn1 = Mock(score=10, connected=False, start_score=10)
+        conn1 = Mock(score=10, connected=False, start_score=10, cost=None, last_ping=time.time())
         conn1.connect = lambda: connect(conn1)
         conn1.disconnect = lambda: disconnect(conn1)
-        conn2 = Mock(score=10, connected=False, start_score=10)
+        conn2 = Mock(score=10, connected=False, start_score=10, cost=None, last_ping=time.time())
         conn1.score = 10
         conn2.connect = lambda: connect(conn2)
         conn2.disconnect = lambda: disconnect(conn2)
@@ -136,6 +136,15 @@ class TestElectrodConnectionPool(unittest.TestCase):
         self.assertEqual(c, 2)
         self.assertEqual(1, len([c for c in [conn1, conn2] if c.connected]))
 
+    def test_ping_connections(self):
+        connections = [Mock(connected=True, protocol=True, score=10, last_ping=t) for t in (0, time.time())]
+        for connection in connections:
+            connection.ping.return_value = async_coro(0.1)
+        self.sut._connections = connections
+        self.loop.run_until_complete(self.sut._ping_connections())
+        Mock.assert_called_once_with(connections[0].ping)
+        Mock.assert_not_called(connections[1].ping)
+
     def test_call_corners(self):
         with self.assertRaises(ValueError):
             self.loop.run_until_complete(self.sut.call('cafe', {'par': 'ams'}, get_peer=True, agreement=2))
@@ -149,7 +158,7 @@ class TestElectrodConnectionPool(unittest.TestCase):
 
     def test_call_success(self):
         response = 'some response'
-        conn = Mock(connected=True, protocol=True, score=10)
+        conn = Mock(connected=True, protocol=True, score=10, cost=None, get_latency_p95=Mock(return_value=None))
         self.sut._connections = [conn]
         conn.rpc_call.return_value = async_coro(response)
         res = self.loop.run_until_complete(self.sut.call('cafe', 'babe'))
@@ -160,11 +169,62 @@ class TestElectrodConnectionPool(unittest.TestCase):
         self.assertEqual(peer, conn)
         self.assertEqual(res, response)
 
+    def test_call_coalesced(self):
+        conn = Mock(connected=True, protocol=True, score=10, cost=None, get_latency_p95=Mock(return_value=None))
+        self.sut._connections = [conn]
+
+        async def rpc_call(method, params):
+            await asyncio.sleep(0.01)
+            return params[0]
+        conn.rpc_call.side_effect = rpc_call
+        res = self.loop.run_until_complete(asyncio.gather(
+            self.sut.call('cafe', 'babe'),
+            self.sut.call('cafe', 'babe'),
+            self.sut.call('cafe', 'beef'),
+            self.sut.call('cafe', 'babe', connection=conn)
+        ))
+        self.assertEqual(['babe', 'babe', 'beef', 'babe'], res)
+        self.assertEqual(3, conn.rpc_call.call_count)
+        self.assertEqual({'calls': 4, 'coalesced_calls': 1, 'inflight_calls': 0}, self.sut.get_calls_info())
+        self.loop.run_until_complete(self.sut.call('cafe', 'babe'))
+        self.assertEqual(4, conn.rpc_call.call_count)
+
+    def test_call_coalesced_copies(self):
+        conn = Mock(connected=True, protocol=True, score=10, cost=None, get_latency_p95=Mock(return_value=None))
+        self.sut._connections = [conn]
+
+        async def rpc_call(method, params):
+            await asyncio.sleep(0.01)
+            return {'vout': [{'value': 0.1}]}
+        conn.rpc_call.side_effect = rpc_call
+        res, res2, (peer, res3) = self.loop.run_until_complete(asyncio.gather(
+            self.sut.call('cafe', 'babe'), self.sut.call('cafe', 'babe'), self.sut.call('cafe', 'babe', get_peer=True)
+        ))
+        self.assertEqual(res, res2)
+        self.assertIsNot(res, res2)
+        self.assertIsNot(res['vout'][0], res2['vout'][0])
+        self.assertIs(conn, peer)
+        self.assertEqual(res, res3)
+
+    def test_call_coalesced_failure(self):
+        conn = Mock(connected=True, protocol=True, score=10, cost=None, get_latency_p95=Mock(return_value=None))
+        self.sut._connections = [conn]
+        self.sut.on_peer_error = Mock(return_value=async_coro(None))
+
+        async def rpc_call(method, params):
+            await asyncio.sleep(0.01)
+        conn.rpc_call.side_effect = rpc_call
+        res = self.loop.run_until_complete(asyncio.gather(
+            self.sut.call('cafe', 'babe'), self.sut.call('cafe', 'babe'), return_exceptions=True
+        ))
+        self.assertTrue(all(isinstance(r, exceptions.ElectrodMissingResponseException) for r in res))
+        self.assertEqual(1, conn.rpc_call.call_count)
+
     def test_call_success_multiple_agreement(self):
         response = 'some response'
-        conn = Mock(connected=True, protocol=True, score=10)
+        conn = Mock(connected=True, protocol=True, score=10, cost=None, get_latency_p95=Mock(return_value=None))
         conn.rpc_call.return_value = async_coro(response)
-        conn2 = Mock(connected=True, protocol=True, score=10)
+        conn2 = Mock(connected=True, protocol=True, score=10, cost=None, get_latency_p95=Mock(return_value=None))
         conn2.rpc_call.return_value = async_coro(response)
         self.sut._connections = [conn, conn2]
         res = self.loop.run_until_complete(self.sut.call('cafe', 'babe', agreement=2))
@@ -172,9 +232,9 @@ class TestElectrodConnectionPool(unittest.TestCase):
 
     def test_call_failure_not_enough_responses(self):
         response = 'some response'
-        conn = Mock(connected=True, protocol=True, score=10)
+        conn = Mock(connected=True, protocol=True, score=10, cost=None, get_latency_p95=Mock(return_value=None))
         conn.rpc_call.return_value = async_coro(response)
-        conn2 = Mock(connected=True, protocol=True, score=10)
+        conn2 = Mock(connected=True, protocol=True, score=10, cost=None, get_latency_p95=Mock(return_value=None))
         conn2.rpc_call.return_value = async_coro(None)
         self.sut._connections = [conn, conn2]
         with self.assertRaises(exceptions.ElectrodMissingResponseException):
@@ -191,9 +251,9 @@ class TestElectrodConnectionPool(unittest.TestCase):
     def test_call_failure_disagreement_on_responses(self):
         response = 'some response'
         response2 = 'another response'
-        conn = Mock(connected=True, protocol=True, score=10)
+        conn = Mock(connected=True, protocol=True, score=10, cost=None, get_latency_p95=Mock(return_value=None))
         conn.rpc_call.return_value = async_coro(response)
-        conn2 = Mock(connected=True, protocol=True, score=10)
+        conn2 = Mock(connected=True, protocol=True, score=10, cost=None, get_latency_p95=Mock(return_value=None))
         conn2.rpc_call.return_value = async_coro(response2)
         self.sut._connections = [conn, conn2]
         with self.assertRaises(exceptions.NoQuorumOnResponsesException):
@@ -208,8 +268,8 @@ class TestElectrodConnectionPool(unittest.TestCase):
         )
 
     def test_call_missing_response(self):
-        conn = Mock(connected=True, protocol=True, score=10)
-        conn2 = Mock(connected=True, protocol=True, score=10)
+        conn = Mock(connected=True, protocol=True, score=10, cost=None, get_latency_p95=Mock(return_value=None))
+        conn2 = Mock(connected=True, protocol=True, score=10, cost=None, get_latency_p95=Mock(return_value=None))
         conn.rpc_call.return_value = async_coro(None)
         conn2.rpc_call.return_value = async_coro(None)
         self.sut._connections = [conn, conn2]
@@ -234,7 +294,7 @@ class TestElectrodConnectionPool(unittest.TestCase):
             self.sut._pick_connection(fail_silent=True)
         )
         self.sut._peers = ['cafebabe']
-        self.sut._connections.append(Mock(hostname='cafebabe', connected=True, score=1))
+        self.sut._connections.append(Mock(hostname='cafebabe', connected=True, score=1, cost=None))
         with self.assertRaises(exceptions.NoServersException):
             self.sut._pick_peer()
         with self.assertRaises(exceptions.NoServersException):
@@ -246,7 +306,7 @@ class TestElectrodConnectionPool(unittest.TestCase):
         self.assertIsNone(res)
 
     def test_handle_peer_error_noscore(self):
-        conn = Mock(connected=True, score=0)
+        conn = Mock(connected=True, score=0, cost=None)
         conn.disconnect.return_value = 'disconnect'
         self.delayer.return_value = 'delayer'
         res = self.loop.run_until_complete(self.sut._handle_peer_error(conn))
@@ -255,7 +315,7 @@ class TestElectrodConnectionPool(unittest.TestCase):
         Mock.assert_called_with(self.delayer, 'disconnect')
 
     def test_handle_peer_error_ping_timeout(self):
-        conn = Mock(connected=True, score=10)
+        conn = Mock(connected=True, score=10, cost=None)
         conn.ping.return_value = async_coro(None)
         conn.disconnect.return_value = 'disconnect'
         self.delayer.return_value = 'delayer'
@@ -316,3 +376,61 @@ class TestElectrodConnectionPool(unittest.TestCase):
         self.network_checker.return_value = async_coro(True)
         self.loop.run_until_complete(self.sut.on_peer_error(peer, error_type='connect'))
         self.assertEqual(len(peer._errors), 1)
+
+    def test_pick_weighted(self):
+        fast = Mock(connected=True, score=10, cost=0.1)
+        slow = Mock(connected=True, score=10, cost=10)
+        unknown = Mock(connected=True, score=10, cost=None)
+        self.sut._connections = [fast, slow, unknown]
+        self.sut._exploration = 0
+        self.assertEqual([10, 0.1, 0.1], self.sut._get_connection_weights([fast, slow, unknown]))
+        picks = [self.sut._pick_connection() for _ in range(200)]
+        self.assertLess(picks.count(slow), 20)
+        self.assertGreater(picks.count(fast), 150)
+        self.assertEqual(3, len(set(self.sut._pick_multiple_connections(3))))
+        self.assertIsNone(self.sut._get_slowest_connection())
+        unknown.cost = 0.2
+        self.assertEqual(slow, self.sut._get_slowest_connection())
+        slow.cost = 0.3
+        self.assertIsNone(self.sut._get_slowest_connection())
+        self.sut._connections = []
+        self.assertIsNone(self.sut._pick_connection(fail_silent=True))
+
+    def test_pick_weighted_cumulative(self):
+        first = Mock(connected=True, score=10, cost=1)
+        second = Mock(connected=True, score=10, cost=1)
+        self.sut._exploration = 0
+        with patch('spruned.daemon.connectionpool_base_impl.random.random', return_value=0.0):
+            self.assertEqual(first, self.sut._pick_weighted_connection([first, second]))
+        with patch('spruned.daemon.connectionpool_base_impl.random.random', return_value=0.6):
+            self.assertEqual(second, self.sut._pick_weighted_connection([first, second]))
+        with patch('spruned.daemon.connectionpool_base_impl.random.random', return_value=0.9999999):
+            self.assertEqual(second, self.sut._pick_weighted_connection([first, second]))
+
+    def test_call_hedged(self):
+        cancelled = []
+
+        async def slow_call(*a):
+            try:
+                await asyncio.sleep(1)
+                return 'slow'
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+        slow = Mock(connected=True, score=10, cost=0.01, get_latency_p95=Mock(return_value=0.01))
+        slow.rpc_call.side_effect = slow_call
+        fast = Mock(connected=True, score=10, cost=100, get_latency_p95=Mock(return_value=None))
+        fast.rpc_call.side_effect = lambda *a: async_coro('fast')
+        self.sut._connections = [slow, fast]
+        self.sut._exploration = 0
+        self.sut._pick_connection = Mock(return_value=slow)
+        peer, res = self.loop.run_until_complete(self.sut.call('cafe', 'babe', get_peer=True))
+        self.assertEqual((fast, 'fast'), (peer, res))
+        self.assertEqual([1], cancelled)
+        self.assertEqual(
+            {'requests': 1, 'hedged': 1, 'wins': 1, 'hedge_rate': 1, 'win_rate': 1}, self.sut.hedges.get_info()
+        )
+        self.sut.hedges.burst = 0
+        res = self.loop.run_until_complete(self.sut.call('cafe', 'babe'))
+        self.assertEqual('slow', res)
+        self.assertEqual((2, 1), (self.sut.hedges.requests, self.sut.hedges.hedged))
@@ -2,10 +2,16 @@ import asyncio
 import unittest
 from unittest.mock import Mock, create_autospec, call
 import binascii
+import hashlib
+
+from spruned.application.tools import deserialize_header
 from spruned.daemon.electrod.electrod_connection import ElectrodConnectionPool, ElectrodConnection
 from spruned.daemon.electrod.electrod_interface import ElectrodInterface
-from spruned.daemon.exceptions import ElectrodMissingResponseException
-from test.utils import async_coro
+from spruned.daemon.electrod.electrod_unspents_cache import ScripthashUnspentsCache
+from spruned.daemon.exceptions import ElectrodMissingResponseException, NetworkHeadersInconsistencyException, \
+    BrokenDataException
+from spruned.daemon.electrod.electrod_chunks import HeadersChunkValidator
+from test.utils import async_coro, make_chunk, make_merkle_proof
 
 
 class TestElectrodInterface(unittest.TestCase):
@@ -144,55 +150,106 @@ class TestElectrodInterface(unittest.TestCase):
             calls=[
                 call('blockchain.transaction.get', 'cafebabe', 0),
                 call('blockchain.transaction.get', 'cafebabe', 1),
-                call('blockchain.block.headers', 1, 2016, get_peer=False),
+                call('blockchain.block.headers', 1, 2016, get_peer=False, connection=None),
                 call('blockchain.address.listunspent', 'address'),
                 call('blockchain.address.get_history', 'scripthash'),
             ]
         )
         Mock.assert_called_with(self.connectionpool.on_peer_error, peer)
 
+    def test_listunspents_by_scripthash_cached(self):
+        unspents_cache = create_autospec(ScripthashUnspentsCache)
+        unspents_cache.listunspents.return_value = async_coro([])
+        self.connectionpool.call.return_value = async_coro([])
+        sut = ElectrodInterface(self.connectionpool, self.electrod_loop, unspents_cache=unspents_cache)
+        self.loop.run_until_complete(sut.listunspents_by_scripthash('scripthash'))
+        self.loop.run_until_complete(sut.listunspents_by_scripthash('scripthash', fail_silent=True))
+        Mock.assert_called_once_with(unspents_cache.listunspents, 'scripthash')
+        Mock.assert_called_once_with(
+            self.connectionpool.call, 'blockchain.scripthash.listunspent', 'scripthash', get_peer=False, fail_silent=True
+        )
+
+    def test_get_network_stats(self):
+        pool = ElectrodConnectionPool(connections=3, peers=[], loop=self.electrod_loop)
+        unspents_cache = ScripthashUnspentsCache(pool, loop=self.electrod_loop)
+        unspents_cache.hits, unspents_cache.misses = 3, 1
+        sut = ElectrodInterface(pool, self.electrod_loop, unspents_cache=unspents_cache)
+        self.assertEqual(
+            {
+                'calls': {'calls': 0, 'coalesced_calls': 0, 'inflight_calls': 0},
+                'hedges': {'requests': 0, 'hedged': 0, 'wins': 0, 'hedge_rate': 0, 'win_rate': 0},
+                'unspents_cache': {'hits': 3, 'misses': 1}
+            },
+            sut.get_network_stats()
+        )
+
     def test_get_headers_in_range(self):
+        chunks = {1: make_chunk(2016)}
+        chunks[2] = make_chunk(1024, prev_block_hash=hashlib.sha256(hashlib.sha256(chunks[1][-80:]).digest()).digest())
 
-        async def get_headers(method, height, count, get_peer=False):
+        async def get_headers(method, height, count, get_peer=False, connection=None):
             # This test is about a range of headers that can be fulfilled only partially on the second round.
-
             self.assertEqual(method, 'blockchain.block.headers')
-            bitcoind_header = "00000020fe52010fa7c798b97621508b772142dfc7b594df7a3a3200000000000000000097db2dc9" \
-                              "4e2799bcdd7259f0876467b379fe44b69342df38a8ec2f350722f9a73367a95aa38955173732b883"
-            i = {1: 2016, 2: 1024}
-            return {'hex': bitcoind_header * i[height / 2016]}
+            return {'hex': binascii.hexlify(chunks[height // 2016]).decode()}
 
         self.connectionpool.call.side_effect = get_headers
         res = self.loop.run_until_complete(self.sut.get_headers_in_range_from_chunks(1, 3))
         Mock.assert_has_calls(
             self.connectionpool.call,
-            calls=[call('blockchain.block.headers', 1 * 2016, 2016, get_peer=False),
-                   call('blockchain.block.headers', 2 * 2016, 2016, get_peer=False)],
+            calls=[call('blockchain.block.headers', 1 * 2016, 2016, get_peer=False, connection=None),
+                   call('blockchain.block.headers', 2 * 2016, 2016, get_peer=False, connection=None)],
             any_order=True
         )
-        i = 0
-        for header in res:
-            self.assertEqual(header.get('block_height'), i+2016)
-            header['block_height'] = 513526
-            i += 1
-            header_from_chunk = {
-                'bits': 391481763,
-                'block_hash': '0000000000000000001e9a7d5bdb53bf19487d50d9e68e04b7254662d693a6ea',
-                'block_height': 513526,
-                'header_bytes': b'\x00\x00\x00 \xfeR\x01\x0f\xa7\xc7\x98\xb9v!P\x8bw!B\xdf'
-                b'\xc7\xb5\x94\xdfz:2\x00\x00\x00\x00\x00\x00\x00\x00\x00'
-                b"\x97\xdb-\xc9N'\x99\xbc\xddrY\xf0\x87dg\xb3y\xfeD\xb6"
-                b'\x93B\xdf8\xa8\xec/5\x07"\xf9\xa73g\xa9Z\xa3\x89U\x17'
-                b'72\xb8\x83',
-                'merkle_root': 'a7f92207352feca838df4293b644fe79b3676487f05972ddbc99274ec92ddb97',
-                'nonce': 2209886775,
-                'prev_block_hash': '000000000000000000323a7adf94b5c7df4221778b502176b998c7a70f0152fe',
-                'timestamp': 1521051443,
-                'version': 536870912
-            }
+        raw = chunks[1] + chunks[2]
+        for i, header in enumerate(res):
+            header_from_chunk = deserialize_header(raw[i * 80:(i + 1) * 80], fmt='hex')
+            header_from_chunk['block_hash'] = header_from_chunk.pop('hash')
+            header_from_chunk['block_height'] = i + 2016
+            header_from_chunk['header_bytes'] = raw[i * 80:(i + 1) * 80]
             self.assertEqual(header, header_from_chunk, msg='%s %s' % (header_from_chunk, header))
         self.assertEqual(len(res), 3040)
 
+    def test_get_headers_chunk_invalid(self):
+        peer = Mock()
+        peer.disconnect.return_value = async_coro(None)
+        chunk = make_chunk(10)
+        chunk = chunk[:80] + chunk[160:]
+        self.connectionpool.call.return_value = async_coro((peer, {'hex': binascii.hexlify(chunk).decode()}))
+        with self.assertRaises(NetworkHeadersInconsistencyException):
+            self.loop.run_until_complete(self.sut.get_headers_from_chunk(1))
+        Mock.assert_called_once_with(peer.disconnect)
+
+    def test_get_headers_chunk_broken(self):
+        peer = Mock()
+        peer.disconnect.return_value = async_coro(None)
+        chunk = make_chunk(10)[:-1]
+        self.connectionpool.call.return_value = async_coro((peer, {'hex': binascii.hexlify(chunk).decode()}))
+        with self.assertRaises(BrokenDataException):
+            self.loop.run_until_complete(self.sut.get_headers_from_chunk(1))
+        Mock.assert_called_once_with(peer.disconnect)
+
+    def test_get_headers_with_checkpoint_proof(self):
+        peer = Mock()
+        peer.disconnect.return_value = async_coro(None)
+        chunk = make_chunk(10)
+        _, hashes = HeadersChunkValidator.unpack(chunk)
+        branch, root = make_merkle_proof([b'\x01' * 32] * 4032 + hashes, 4041)
+        response = {'hex': binascii.hexlify(chunk).decode(), 'count': 10, 'max': 2016, 'root': root, 'branch': branch}
+        self.connectionpool.call.return_value = async_coro((peer, response))
+        _peer, headers, _root = self.loop.run_until_complete(
+            self.sut.get_headers_with_checkpoint_proof(4032, 10, cp_height=4041)
+        )
+        Mock.assert_called_once_with(self.connectionpool.call, 'blockchain.block.headers', 4032, 10, 4041, get_peer=True)
+        self.assertEqual((_peer, _root), (peer, root))
+        self.assertEqual([h['block_height'] for h in headers], list(range(4032, 4042)))
+        self.assertEqual(self.sut.checkpoint_height, 568150)
+
+        response = dict(response, root='00' * 32)
+        self.connectionpool.call.return_value = async_coro((peer, response))
+        with self.assertRaises(NetworkHeadersInconsistencyException):
+            self.loop.run_until_complete(self.sut.get_headers_with_checkpoint_proof(4032, 10, cp_height=4041))
+        Mock.assert_called_once_with(peer.disconnect)
+
     def test_get_chunks_no_chunk(self):
         self.connectionpool.call.return_value = async_coro(None)
         self.assertIsNone(self.loop.run_until_complete(self.sut.get_headers_from_chunk(1)))
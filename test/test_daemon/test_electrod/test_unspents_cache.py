@@ -0,0 +1,105 @@
+import asyncio
+import unittest
+from unittest.mock import Mock
+
+from spruned.daemon.electrod.electrod_unspents_cache import ScripthashUnspentsCache
+from test.utils import async_coro
+
+
+class TestScripthashUnspentsCache(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+        self.connection = Mock(connected=True)
+        self.connection.subscribe_scripthash.side_effect = lambda *a: async_coro('status')
+        self.connection.unsubscribe_scripthash.side_effect = lambda *a: async_coro(None)
+        self.connection.rpc_call.side_effect = lambda method, params: async_coro([{'tx_hash': params[0]}])
+        self.pool = Mock()
+        self.pool.pick_connection.return_value = self.connection
+        self.pool.call.side_effect = lambda method, scripthash, **kw: async_coro([{'tx_hash': scripthash}])
+        self.sut = ScripthashUnspentsCache(self.pool, max_subscriptions=2, loop=self.loop)
+
+    def test_cached_until_status_changes(self):
+        res = self.loop.run_until_complete(self.sut.listunspents('aa'))
+        self.assertEqual([{'tx_hash': 'aa'}], res)
+        self.assertEqual(res, self.loop.run_until_complete(self.sut.listunspents('aa')))
+        Mock.assert_called_once_with(self.connection.subscribe_scripthash, 'aa', self.sut.on_status)
+        Mock.assert_called_once_with(self.connection.rpc_call, 'blockchain.scripthash.listunspent', ('aa',))
+        Mock.assert_called_once_with(self.pool.pick_connection, fail_silent=True)
+        self.sut.on_status(self.connection, 'aa', 'status')
+        self.loop.run_until_complete(self.sut.listunspents('aa'))
+        self.assertEqual(1, self.connection.rpc_call.call_count)
+        self.sut.on_status(self.connection, 'aa', 'new_status')
+        self.loop.run_until_complete(self.sut.listunspents('aa'))
+        self.assertEqual(2, self.connection.rpc_call.call_count)
+        Mock.assert_not_called(self.pool.call)
+        self.assertEqual(1, self.connection.subscribe_scripthash.call_count)
+        self.assertEqual((2, 2), (self.sut.hits, self.sut.misses))
+
+    def test_status_change_while_fetching(self):
+        async def listunspent(method, params):
+            self.sut.on_status(self.connection, params[0], 'new_status')
+            return []
+        self.connection.rpc_call.side_effect = listunspent
+        self.loop.run_until_complete(self.sut.listunspents('aa'))
+        self.loop.run_until_complete(self.sut.listunspents('aa'))
+        self.assertEqual(2, self.connection.rpc_call.call_count)
+
+    def test_concurrent_calls_coalesced(self):
+        res = self.loop.run_until_complete(
+            asyncio.gather(self.sut.listunspents('aa'), self.sut.listunspents('aa'))
+        )
+        self.assertEqual([[{'tx_hash': 'aa'}]] * 2, res)
+        Mock.assert_called_once_with(self.connection.rpc_call, 'blockchain.scripthash.listunspent', ('aa',))
+        self.assertEqual({}, self.sut._inflight)
+
+    def test_subscribed_connection_fails(self):
+        self.connection.rpc_call.side_effect = lambda *a: async_coro(None)
+        res = self.loop.run_until_complete(self.sut.listunspents('aa'))
+        self.assertEqual([{'tx_hash': 'aa'}], res)
+        Mock.assert_called_once_with(self.pool.call, 'blockchain.scripthash.listunspent', 'aa')
+        self.loop.run_until_complete(asyncio.sleep(0))
+        Mock.assert_called_once_with(self.connection.unsubscribe_scripthash, 'aa')
+        self.assertEqual((None, {}), (self.sut._connection, dict(self.sut._entries)))
+        connection = Mock(connected=True)
+        connection.subscribe_scripthash.side_effect = lambda *a: async_coro('status')
+        connection.rpc_call.side_effect = lambda method, params: async_coro([])
+        self.pool.pick_connection.return_value = connection
+        self.loop.run_until_complete(self.sut.listunspents('aa'))
+        self.assertEqual([], self.loop.run_until_complete(self.sut.listunspents('aa')))
+        Mock.assert_called_once_with(connection.rpc_call, 'blockchain.scripthash.listunspent', ('aa',))
+        self.assertEqual(1, self.pool.call.call_count)
+
+    def test_subscriptions_bound(self):
+        for scripthash in ('aa', 'bb', 'aa', 'cc'):
+            self.loop.run_until_complete(self.sut.listunspents(scripthash))
+        self.loop.run_until_complete(asyncio.sleep(0))
+        Mock.assert_called_once_with(self.connection.unsubscribe_scripthash, 'bb')
+        self.assertEqual(['aa', 'cc'], list(self.sut._entries))
+
+    def test_connection_lost(self):
+        self.loop.run_until_complete(self.sut.listunspents('aa'))
+        self.connection.connected = False
+        connection = Mock(connected=True)
+        connection.subscribe_scripthash.side_effect = lambda *a: async_coro('status')
+        connection.rpc_call.side_effect = lambda method, params: async_coro([])
+        self.pool.pick_connection.return_value = connection
+        self.loop.run_until_complete(self.sut.listunspents('aa'))
+        self.assertEqual(1, connection.rpc_call.call_count)
+        Mock.assert_called_once_with(connection.subscribe_scripthash, 'aa', self.sut.on_status)
+        self.sut.on_status(self.connection, 'aa', 'new_status')
+        self.loop.run_until_complete(self.sut.listunspents('aa'))
+        self.assertEqual(1, connection.rpc_call.call_count)
+
+    def test_subscribe_error(self):
+        self.connection.subscribe_scripthash.side_effect = ValueError
+        self.loop.run_until_complete(self.sut.listunspents('aa'))
+        self.loop.run_until_complete(self.sut.listunspents('aa'))
+        self.assertEqual(2, self.connection.rpc_call.call_count)
+        self.assertEqual({}, dict(self.sut._entries))
+
+    def test_no_connections(self):
+        self.pool.pick_connection.return_value = None
+        self.loop.run_until_complete(self.sut.listunspents('aa'))
+        self.loop.run_until_complete(self.sut.listunspents('aa'))
+        self.assertEqual(2, self.pool.call.call_count)
+        self.assertEqual({}, dict(self.sut._entries))
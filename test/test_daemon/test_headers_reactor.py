@@ -270,17 +270,21 @@ class TestHeadersReactor(unittest.TestCase):
         self.sut.set_last_processed_header(loc_header)
         self.repo.get_best_header.return_value = loc_header
         _headers = make_headers(2017, 2120, '00'*32)
-        self.interface.get_headers_in_range_from_chunks.side_effect = [async_coro((Mock(), _headers)), async_coro(None)]
+        self.interface.get_peers.return_value = [peer]
+        self.interface.get_headers_from_chunk.side_effect = [async_coro((peer, _headers))]
         self.interface.get_header.return_value = async_coro(net_header)
-        self.repo.save_headers.side_effect = lambda x, **k: x
+        self.repo.ingest_headers.side_effect = lambda x, **k: x
 
         self.loop.run_until_complete(self.sut.on_new_header(peer, net_header))
 
-        Mock.assert_called_with(self.repo.save_headers, [h for h in _headers if h['block_height'] > 2020])
+        Mock.assert_called_with(
+            self.repo.ingest_headers, [h for h in _headers if h['block_height'] > 2020], check_pow=False
+        )
         Mock.assert_not_called(peer.close)
         self.assertEqual(self.sut._last_processed_header, _headers[-1])
         self.assertEqual(self.sut.synced, True)
-        self.assertEqual(1, len(self.interface.method_calls))
+        Mock.assert_called_once_with(self.interface.get_headers_from_chunk, 1, get_peer=True, connection=peer)
+        self.assertEqual(2, len(self.interface.method_calls))
         self.assertEqual(2, len(self.repo.method_calls))
         self.assertEqual(0, len(self.electrod_loop.method_calls))
 
@@ -330,9 +334,9 @@ class TestHeadersReactor(unittest.TestCase):
         """
         a new header is received, best_height is 3000
         there is no local header
-        the chunk 0 is requested, but there are no peers available due race condition
-        then the chunk 0 is fetched and saved
-        then the chunk 1 is fetched and saved
+        the chunks 0 and 1 are requested at once, to two different peers
+        the chunk 0 fails twice and is retried on the other peer, then it's fetched
+        the chunks 0 and 1 are saved in order
         new height is 3000
         reactor is in sync with the network
         """
@@ -344,29 +348,106 @@ class TestHeadersReactor(unittest.TestCase):
             "prev_block_hash": "00" * 32,
             "header_bytes": b"0"*80
         }
-        peer = Mock(server_info='mock_peer')
+        peer, peer_2 = Mock(server_info='mock_peer'), Mock(server_info='mock_peer_2')
         loc_header = None
         self.repo.get_best_header.return_value = loc_header
-        _chunk_1 = make_headers(0, 2015, ctx.get_network()['checkpoints'][0])
-        _chunk_2 = make_headers(2016, 2999, _chunk_1[-1]['block_height'])
-        _chunk_2.append(net_header)
+        _chunk_1 = make_headers(0, 2016, ctx.get_network()['checkpoints'][0])
+        _chunk_2 = make_headers(2016, 2999, _chunk_1[-1]['block_hash'])
+        _chunk_2.append(dict(net_header, prev_block_hash=_chunk_2[-1]['block_hash']))
+        responses = {
+            0: [exceptions.NoPeersException, None, _chunk_1],
+            1: [_chunk_2]
+        }
+        requests = []
 
-        self.interface.get_headers_in_range_from_chunks.side_effect = [
-            exceptions.NoPeersException,
-            async_coro(None),
-            async_coro((Mock(), _chunk_1)),
-            async_coro((Mock(), _chunk_2))
-        ]
-        self.interface.get_header.return_value = async_coro((Mock(), net_header))
-        self.repo.save_headers.side_effect = lambda x, **k: x
+        async def get_headers_from_chunk(chunk_index, get_peer=True, connection=None):
+            requests.append((chunk_index, connection))
+            response = responses[chunk_index].pop(0)
+            if response == exceptions.NoPeersException:
+                raise response
+            return response and (connection, response)
+
+        self.interface.get_peers.return_value = [peer, peer_2]
+        self.interface.get_headers_from_chunk.side_effect = get_headers_from_chunk
+        self.repo.ingest_headers.side_effect = lambda x, **k: x
 
         self.loop.run_until_complete(self.sut.on_new_header(peer, net_header))
-        self.assertEqual(self.sut._last_processed_header, net_header)
+        self.assertEqual(self.sut._last_processed_header, _chunk_2[-1])
         self.assertTrue(self.sut.synced)
-        self.assertEqual(4, len(self.interface.method_calls))
-        self.assertEqual(5, len(self.repo.method_calls))
+        self.assertEqual(4, len(requests))
+        self.assertEqual({0, 1}, {x[0] for x in requests[:2]})
+        self.assertEqual({peer, peer_2}, {x[1] for x in requests[:2]})
+        retries = [x[1] for x in requests if x[0] == 0]
+        self.assertNotEqual(retries[0], retries[1])
+        Mock.assert_has_calls(
+            self.repo.ingest_headers, calls=[call(_chunk_1, check_pow=False), call(_chunk_2, check_pow=False)]
+        )
+        self.assertEqual(3, len(self.repo.method_calls))
         self.assertEqual(0, len(self.electrod_loop.method_calls))
 
+    def test_fast_sync_no_local_headers(self):
+        """
+        fast sync, there is no local header, best height is 4059
+        the headers from the checkpoint chunk to the checkpoint (4041) are fetched with the proof and saved,
+        the backfill is started, then the chunks sync goes on from the checkpoint
+        """
+        self.sut.fast_sync = True
+        self.interface.checkpoint_height = 4041
+        peer = Mock(server_info='mock_peer')
+        anchor_headers = make_headers(4032, 4042, 'ff' * 32)
+        net_headers = make_headers(4042, 4060, anchor_headers[-1]['block_hash'])
+        self.repo.get_best_header.side_effect = [None, anchor_headers[-1]]
+        self.repo.get_lowest_header.return_value = anchor_headers[0]
+        self.interface.get_headers_with_checkpoint_proof.return_value = async_coro((peer, anchor_headers, 'root'))
+        self.interface.get_peers.return_value = [peer]
+        self.interface.get_headers_from_chunk.return_value = async_coro((peer, anchor_headers + net_headers))
+        self.repo.ingest_headers.side_effect = lambda x, **k: x
+
+        self.loop.run_until_complete(self.sut.on_new_header(peer, net_headers[-1]))
+        Mock.assert_called_once_with(self.interface.get_headers_with_checkpoint_proof, 4032, 10)
+        Mock.assert_called_once_with(self.repo.backfill_headers, anchor_headers)
+        Mock.assert_called_once_with(self.interface.get_headers_from_chunk, 2, get_peer=True, connection=peer)
+        Mock.assert_called_once_with(self.repo.ingest_headers, net_headers, check_pow=False)
+        Mock.assert_called_once_with(self.electrod_loop.create_task, coro_call('backfill_headers'))
+        self.electrod_loop.create_task.call_args[0][0].close()
+        self.assertEqual(self.sut._checkpoint_root, 'root')
+        self.assertEqual(self.sut._last_processed_header, net_headers[-1])
+        self.assertTrue(self.sut.synced)
+
+    def test_backfill_headers(self):
+        """
+        the lowest local header is at 4037, the headers 4032-4036 are fetched with a proof against the
+        checkpoint root and saved. a root mismatch is handled as a peer error.
+        """
+        self.interface.checkpoint_height = 4041
+        peer = Mock(server_info='mock_peer')
+        headers = make_headers(4032, 4037, 'ff' * 32)
+        self.repo.get_lowest_header.return_value = {'block_height': 4037}
+        self.interface.get_headers_with_checkpoint_proof.side_effect = [
+            async_coro((peer, [], 'root')),
+            async_coro((peer, headers, 'root')),
+            async_coro((peer, headers, 'another_root'))
+        ]
+        self.interface.handle_peer_error.return_value = async_coro(None)
+        self.loop.run_until_complete(self.sut.backfill_headers())
+        Mock.assert_has_calls(
+            self.interface.get_headers_with_checkpoint_proof, calls=[call(4041, 1), call(4032, 5)]
+        )
+        Mock.assert_called_once_with(self.repo.backfill_headers, headers)
+        Mock.assert_called_once_with(self.delay_task_runner, coro_call('backfill_headers'), 1)
+
+        self.loop.run_until_complete(self.sut.backfill_headers())
+        Mock.assert_called_once_with(self.interface.handle_peer_error, peer)
+        Mock.assert_called_with(self.delay_task_runner, coro_call('backfill_headers'), 30)
+        self.assertEqual(1, self.repo.backfill_headers.call_count)
+
+        self.sut._backfilling = True
+        self.repo.get_lowest_header.return_value = {'block_height': 0}
+        self.loop.run_until_complete(self.sut.backfill_headers())
+        self.assertFalse(self.sut._backfilling)
+        for c in self.delay_task_runner.call_args_list:
+            c[0][0].close()
+
     def test_on_new_headers_5_blocks_behind(self):
         """
         local height is 10
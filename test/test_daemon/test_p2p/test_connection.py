@@ -100,6 +100,22 @@ class TestP2PConnection(TestCase):
         self.sut._on_ping('ping', 'ping', {'nonce': 'cafe'})
         Mock.assert_called_once_with(self.sut.peer.send_msg, 'pong', nonce='cafe')
 
+    def test_latency_and_throughput(self):
+        self.sut.peer = Mock()
+        self.assertIsNone(self.sut.cost)
+        self.sut.ping()
+        nonce = self.sut.peer.send_msg.call_args[1]['nonce']
+        self.sut._on_pong('pong', 'pong', {'nonce': nonce + 1})
+        self.assertIsNone(self.sut.latency)
+        self.sut._on_pong('pong', 'pong', {'nonce': nonce})
+        self.assertLess(self.sut.latency, 1)
+        self.assertIsNone(self.sut.cost)
+        self.sut._latency = 0.5
+        self.sut.add_throughput(1024 * 1024, 1)
+        self.sut.add_throughput(1024 * 1024, 2)
+        self.assertAlmostEqual(1024 * 1024 * 0.85, self.sut.throughput)
+        self.assertAlmostEqual(0.5 + 1 / 0.85, self.sut.cost)
+
     def test_version_checker(self):
         versions = [
             [{'subversion': b'/Satoshi:0.1', 'version': 70000}, False],
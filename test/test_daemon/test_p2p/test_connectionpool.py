@@ -1,7 +1,11 @@
 import asyncio
+from collections import deque
 from unittest import TestCase
 from unittest.mock import Mock, call
-from spruned.daemon.bitcoin_p2p.p2p_connection import P2PConnectionPool
+from spruned.application.tools import blockheader_to_blockhash
+from spruned.daemon.bitcoin_p2p.p2p_connection import P2PConnectionPool, P2PConnection, PRIORITY_BACKGROUND
+from spruned.dependencies.pycoinnet.inv_batcher import InvBatcher
+from spruned.dependencies.pycoinnet.pycoin.InvItem import InvItem, ITEM_TYPE_BLOCK
 
 from test.utils import async_coro, coro_call
 
@@ -41,3 +45,154 @@ class TestP2PConnectionPool(TestCase):
                 call(coro_call('_connect_peer')), call(coro_call('_connect_peer'))
             ]
         )
+
+    def test_get_shared_batcher(self):
+        blocks = {}
+        for i in range(3):
+            block_bytes = bytes([i]) * 100
+            blocks[str(InvItem(ITEM_TYPE_BLOCK, blockheader_to_blockhash(block_bytes[:80])[::-1]))] = block_bytes
+
+        def make_connection(hostname):
+            peer = Mock()
+
+            def send_msg(name, items=None):
+                for item in items:
+                    data = {'block': Mock(read=Mock(return_value=blocks[str(item)]))}
+                    self.loop.call_soon(self.sut._batcher.handle_block_event, peer, 'block', data)
+            peer.send_msg.side_effect = send_msg
+            return Mock(connected=True, score=10, peer_event_handler=peer, hostname=hostname, errors=[], cost=None)
+
+        connection, connection2 = make_connection('cafe'), make_connection('babe')
+        self.sut._connections.extend([connection, connection2])
+        items = [InvItem(ITEM_TYPE_BLOCK, blockheader_to_blockhash(x[:80])[::-1]) for x in blocks.values()]
+        res = self.loop.run_until_complete(self.sut.get(items[0], timeout=2))
+        batcher = self.sut._batcher
+        self.assertEqual(blocks[str(items[0])], res)
+        connection2.connected = False
+        res = self.loop.run_until_complete(
+            asyncio.gather(*[self.sut.get(item, timeout=2, privileged=True) for item in items[1:]])
+        )
+        self.assertEqual([blocks[str(item)] for item in items[1:]], res)
+        self.assertIs(batcher, self.sut._batcher)
+        self.assertEqual([connection.peer_event_handler], batcher.peers)
+        self.assertEqual(2, connection.peer_event_handler.set_request_callback.call_count)
+        self.assertEqual(2, connection2.peer_event_handler.set_request_callback.call_count)
+        self.assertTrue(connection.add_success.called)
+        batcher.stop()
+
+    def test_get_priority_classes(self):
+        background = [bytes([i]) * 100 for i in range(10, 14)]
+        interactive = bytes([20]) * 100
+        blocks = {str(InvItem(ITEM_TYPE_BLOCK, blockheader_to_blockhash(x[:80])[::-1])): x for x in background}
+        interactive_item = InvItem(ITEM_TYPE_BLOCK, blockheader_to_blockhash(interactive[:80])[::-1])
+        peer = Mock()
+
+        def send_msg(name, items=None):
+            # the peer is stuck on the background backlog, but answers the interactive request
+            for item in items:
+                if str(item) == str(interactive_item):
+                    data = {'block': Mock(read=Mock(return_value=interactive))}
+                    self.loop.call_later(0.05, self.sut._batcher.handle_block_event, peer, 'block', data)
+        peer.send_msg.side_effect = send_msg
+        self.sut._connections.append(
+            Mock(connected=True, score=10, peer_event_handler=peer, hostname='cafe', errors=[], cost=None)
+        )
+        items = [InvItem(ITEM_TYPE_BLOCK, blockheader_to_blockhash(x[:80])[::-1]) for x in background]
+
+        async def get_interactive():
+            await asyncio.sleep(0.1)
+            return await self.sut.get(interactive_item, timeout=1)
+
+        res = self.loop.run_until_complete(asyncio.gather(
+            get_interactive(), *[self.sut.get(item, timeout=1, priority=PRIORITY_BACKGROUND) for item in items]
+        ))
+        self.assertEqual([interactive, None, None, None, None], res)
+        info = self.sut.get_fetch_info()
+        self.assertEqual(['interactive', 'background'], list(info))
+        self.assertEqual((1, 0), (info['interactive']['requests'], info['interactive']['failures']))
+        self.assertEqual((4, 4), (info['background']['requests'], info['background']['failures']))
+        self.assertLess(info['interactive']['max_time'], 0.5)
+        self.sut._batcher.stop()
+
+    def test_get_hedged(self):
+        block_bytes = bytes([30]) * 100
+        item = InvItem(ITEM_TYPE_BLOCK, blockheader_to_blockhash(block_bytes[:80])[::-1])
+        requests = []
+
+        def make_connection(hostname):
+            peer = Mock()
+
+            def send_msg(name, items=None):
+                # the first peer asked is stuck, the hedged request is answered
+                requests.append(peer)
+                if len(requests) > 1:
+                    data = {'block': Mock(read=Mock(return_value=block_bytes))}
+                    self.loop.call_soon(self.sut._batcher.handle_block_event, peer, 'block', data)
+            peer.send_msg.side_effect = send_msg
+            return Mock(connected=True, score=10, peer_event_handler=peer, hostname=hostname, errors=[], cost=None)
+
+        self.sut._connections.extend([make_connection('cafe'), make_connection('babe')])
+        self.sut._fetch_latencies[0] = deque([0.05] * 20)
+        res = self.loop.run_until_complete(self.sut.get(item, timeout=2))
+        self.assertEqual(block_bytes, res)
+        self.assertEqual(2, len(set(requests)))
+        self.assertEqual((1, 1, 1), (self.sut.hedges.requests, self.sut.hedges.hedged, self.sut.hedges.wins))
+        self.sut._batcher.stop()
+
+    def test_slowest_connection_ranks_block_costs_only(self):
+        connections = []
+        for hostname in ('a', 'b', 'c', 'd', 'e'):
+            connection = P2PConnection(hostname, 8333, loop=self.loopmock)
+            connection.peer = Mock()
+            connection.add_latency(0.1)
+            connections.append(connection)
+        self.sut._connections = connections
+        connections[0].add_throughput(1300000, 1.3)
+        self.assertEqual([None] * 4, [c.cost for c in connections[1:]])
+        self.assertIsNone(self.sut._get_slowest_connection())
+        connections[1].add_throughput(1300000, 1.3)
+        connections[2].add_throughput(1300000, 13)
+        connections[3].add_throughput(1300000, 1.2)
+        self.assertIs(connections[2], self.sut._get_slowest_connection())
+
+    def test_get_interactive_under_background_load(self):
+        background = [i.to_bytes(2, 'little') * 50 for i in range(200)]
+        interactive = bytes([255]) * 100
+        interactive_item = InvItem(ITEM_TYPE_BLOCK, blockheader_to_blockhash(interactive[:80])[::-1])
+        for i in range(8):
+            peer = Mock()
+
+            def send_msg(name, items=None, peer=peer):
+                # every peer is busy on the background backlog, but answers the interactive request quickly
+                for item in items:
+                    if str(item) == str(interactive_item):
+                        data = {'block': Mock(read=Mock(return_value=interactive))}
+                        self.loop.call_later(0.05, self.sut._batcher.handle_block_event, peer, 'block', data)
+            peer.send_msg.side_effect = send_msg
+            self.sut._connections.append(
+                Mock(connected=True, score=10, peer_event_handler=peer, hostname='peer%s' % i, errors=[])
+            )
+        items = [InvItem(ITEM_TYPE_BLOCK, blockheader_to_blockhash(x[:80])[::-1]) for x in background]
+
+        async def get_interactive():
+            await asyncio.sleep(0.5)
+            return await self.sut.get(interactive_item, timeout=3)
+
+        res = self.loop.run_until_complete(asyncio.gather(
+            get_interactive(), *[self.sut.get(item, timeout=4, priority=PRIORITY_BACKGROUND) for item in items]
+        ))
+        self.assertEqual(interactive, res[0])
+        self.assertLess(self.sut.get_fetch_info()['interactive']['max_time'], 0.5)
+        self.sut._batcher.stop()
+
+    def test_batcher_requeue_cancelled_item(self):
+        async def requeue():
+            batcher = InvBatcher()
+            item = InvItem(ITEM_TYPE_BLOCK, b'\x01' * 32)
+            (await batcher.inv_item_to_future(item)).cancel()
+            # the cancelled entry is still queued: same priority and item, the futures are never compared
+            future = await batcher.inv_item_to_future(item)
+            self.assertEqual(2, batcher._inv_item_future_queue.qsize())
+            future.cancel()
+            batcher.stop()
+        self.loop.run_until_complete(requeue())
@@ -10,7 +10,7 @@ from test.utils import async_coro
 
 class TestP2PInterface(TestCase):
     def setUp(self):
-        self.pool = Mock()
+        self.pool = Mock(established_connections=[])
         self.loopmock = Mock()
         self.peers_bootstrapper = Mock()
         self.sut = P2PInterface(self.pool, loop=self.loopmock, peers_bootstrapper=self.peers_bootstrapper)
@@ -34,6 +34,13 @@ class TestP2PInterface(TestCase):
         self.sut.set_bootstrap_status(10)
         self.assertEqual(self.sut.bootstrap_status, 10)
 
+    def test_get_network_stats(self):
+        self.pool.get_fetch_info.return_value = {'background': {'requests': 1}}
+        self.pool.hedges.get_info.return_value = {'requests': 1}
+        self.assertEqual(
+            {'fetches': {'background': {'requests': 1}}, 'hedges': {'requests': 1}}, self.sut.get_network_stats()
+        )
+
     def test_get_block(self):
         block = b'block'
         self.pool.get.return_value = async_coro(block)
@@ -62,3 +69,43 @@ class TestP2PInterface(TestCase):
             },
             response
         )
+
+    def test_get_block_single_flight(self):
+        async def get(inv_item, **kw):
+            await asyncio.sleep(0.01)
+            return b'block'
+        self.pool.get.side_effect = get
+        responses = self.loop.run_until_complete(asyncio.gather(
+            self.sut.get_block('aa'*32), self.sut.get_block('aa'*32), self.sut.get_blocks('aa'*32, 'bb'*32)
+        ))
+        self.assertIs(responses[0], responses[1])
+        self.assertIs(responses[0], responses[2]['aa'*32])
+        self.assertEqual(2, self.pool.get.call_count)
+        self.assertEqual({}, self.sut._inflight_blocks)
+        self.loop.run_until_complete(self.sut.get_block('aa'*32))
+        self.assertEqual(3, self.pool.get.call_count)
+
+    def test_get_blocks_window(self):
+        self.sut._blocks_per_peer = 1
+        self.pool.established_connections = [Mock(), Mock()]
+        requests = []
+        running = []
+
+        async def get(inv_item, **kw):
+            requests.append(str(inv_item))
+            first = len(requests) == 1
+            running.append(inv_item)
+            await asyncio.sleep(0.01)
+            self.assertLessEqual(len(running), 2)
+            running.remove(inv_item)
+            return not first and b'block' or None
+        self.pool.get.side_effect = get
+        received = []
+        response = self.loop.run_until_complete(
+            self.sut.get_blocks('aa'*32, 'bb'*32, 'cc'*32, on_block=lambda b: received.append(b['block_hash']))
+        )
+        self.assertEqual('bb'*32, received[0])
+        self.assertEqual({'aa'*32, 'bb'*32, 'cc'*32}, set(received))
+        self.assertEqual({'aa'*32, 'bb'*32, 'cc'*32}, set(response))
+        self.assertEqual({None}, set(response.values()))
+        self.assertEqual(4, len(requests))
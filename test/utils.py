@@ -46,6 +46,46 @@ def make_headers(s: int, e: int, prevblock_0: str= None, with_timestamp=True):
     return _headers
 
 
+def make_chunk(howmany: int, prev_block_hash=b'\x00' * 32, bits=0x207fffff):
+    """
+    a chain of linked headers with an easy target, the nonce is ground until the pow is valid
+    """
+    import hashlib
+    import struct
+    target = (bits & 0x007fffff) << (8 * ((bits >> 24) - 3))
+    chunk = b''
+    for i in range(howmany):
+        nonce = 0
+        while 1:
+            header = struct.pack('<I32s32sIII', 1, prev_block_hash, b'\x11' * 32, 1500000000 + i, bits, nonce)
+            blockhash = hashlib.sha256(hashlib.sha256(header).digest()).digest()
+            if int.from_bytes(blockhash, 'little') <= target:
+                break
+            nonce += 1
+        chunk += header
+        prev_block_hash = blockhash
+    return chunk
+
+
+def make_merkle_proof(leaves: list, index: int):
+    """
+    electrumx style merkle branch and root for the leaf at <index>, hex encoded as served by the servers
+    """
+    import hashlib
+    import binascii
+    branch = []
+    level = list(leaves)
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        branch.append(binascii.hexlify(level[index ^ 1][::-1]).decode())
+        index >>= 1
+        level = [
+            hashlib.sha256(hashlib.sha256(level[i] + level[i + 1]).digest()).digest() for i in range(0, len(level), 2)
+        ]
+    return branch, binascii.hexlify(level[0][::-1]).decode()
+
+
 def batcher_factory(self):
     class FakeBatcher:
         @staticmethod
@@ -54,7 +94,24 @@ def batcher_factory(self):
             return self.batcher_factory.add_peer(data)
 
         @staticmethod
-        async def inv_item_to_future(data):
+        def remove_peer(data):
+            nonlocal self
+            return self.batcher_factory.remove_peer(data)
+
+        @staticmethod
+        def add_on_batch_callback(callback):
+            pass
+
+        @staticmethod
+        async def prioritize(data, priority):
+            pass
+
+        @staticmethod
+        def add_on_hedge_win_callback(callback):
+            pass
+
+        @staticmethod
+        async def inv_item_to_future(data, priority=0):
             nonlocal self
             return async_coro(self.batcher_factory.inv_item_to_future(data))
 